@@ -10,3 +10,7 @@ __doc__ = __description__ + " <" + __uri__ + ">"
 
 __author__ = "Akshay Gupta"
 __email__ = "akshay.gupta2@capitalone.com"
+
+from edgetest.executor import run_async
+
+__all__ = ["run_async"]
@@ -0,0 +1,324 @@
+"""Remove unused environments to bound the disk usage of the base directory."""
+
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Set, Tuple
+
+from tabulate import tabulate
+
+from edgetest.core import (
+    BASES_DIRNAME,
+    LAST_USED_MARKER,
+    LOGS_DIRNAME,
+    SNAPSHOTS_DIRNAME,
+    STORE_DIRNAME,
+    STORE_MARKER,
+    TMP_DIRNAME,
+    WHEELHOUSE_DIRNAME,
+)
+from edgetest.logger import get_logger
+
+LOG = get_logger(__name__)
+
+# Directories with one removable entry per environment, base or run
+ENTRY_DIRNAMES = (
+    STORE_DIRNAME,
+    BASES_DIRNAME,
+    SNAPSHOTS_DIRNAME,
+    TMP_DIRNAME,
+    LOGS_DIRNAME,
+)
+# Durable caches which are never removed
+DURABLE_DIRNAMES = ("wheels", WHEELHOUSE_DIRNAME)
+SECONDS_PER_DAY = 86400
+
+
+class Entry(NamedTuple):
+    """A removable entry in the base directory."""
+
+    path: Path
+    size: int
+    last_used: float
+
+
+def disk_usage(path: Path, seen: Optional[Set[Tuple[int, int]]] = None) -> int:
+    """Get the disk usage of a file or directory without following symbolic links.
+
+    Parameters
+    ----------
+    path : Path
+        The file or directory.
+    seen : set, optional (default None)
+        The device and inode of files already counted. Hard linked files are only
+        counted the first time they are seen. Updated in place.
+
+    Returns
+    -------
+    int
+        The disk usage in bytes.
+    """
+    seen = set() if seen is None else seen
+    paths = [path]
+    if path.is_dir() and not path.is_symlink():
+        for dirpath, dirnames, filenames in os.walk(path):
+            paths.extend(Path(dirpath, name) for name in dirnames + filenames)
+    total = 0
+    for item in paths:
+        try:
+            stat = item.lstat()
+        except OSError:
+            continue
+        if (stat.st_dev, stat.st_ino) in seen:
+            continue
+        seen.add((stat.st_dev, stat.st_ino))
+        total += getattr(stat, "st_blocks", 0) * 512 or stat.st_size
+
+    return total
+
+
+def _last_used(path: Path) -> float:
+    """Get the time an entry was last used.
+
+    Parameters
+    ----------
+    path : Path
+        The entry.
+
+    Returns
+    -------
+    float
+        The modification time of ``LAST_USED_MARKER`` in the entry, or of the entry
+        itself if there isn't one.
+    """
+    marker = path / LAST_USED_MARKER
+    if not path.is_symlink() and marker.is_file():
+        return marker.stat().st_mtime
+
+    return path.lstat().st_mtime
+
+
+def _is_environment(path: Path, root: Path) -> bool:
+    """Check if a directory entry is an environment created by ``edgetest``.
+
+    Parameters
+    ----------
+    path : Path
+        The entry.
+    root : Path
+        The directory the entry is in.
+
+    Returns
+    -------
+    bool
+        Whether the entry is a link into the store, or a directory with
+        ``LAST_USED_MARKER`` or ``STORE_MARKER``. Anything else, e.g. data from other
+        tools in a shared directory, is left alone.
+    """
+    if path.is_symlink():
+        target = Path(os.path.normpath(path.parent / os.readlink(path)))
+        return target.parent == root / STORE_DIRNAME
+
+    return path.is_dir() and any(
+        (path / marker).is_file() for marker in (LAST_USED_MARKER, STORE_MARKER)
+    )
+
+
+def _roots(basedir: Path, envs_dir: Optional[Path] = None) -> List[Path]:
+    """Get the existing directories with removable entries.
+
+    Parameters
+    ----------
+    basedir : Path
+        The base directory.
+    envs_dir : Path, optional (default None)
+        The directory for the environments, if not the base directory.
+
+    Returns
+    -------
+    List[Path]
+        The directories.
+    """
+    roots = (
+        [basedir] if envs_dir is None or envs_dir == basedir else [basedir, envs_dir]
+    )
+
+    return [root for root in roots if root.is_dir()]
+
+
+def find_entries(basedir: Path, envs_dir: Optional[Path] = None) -> List[Entry]:
+    """Find the removable entries in the base directory.
+
+    Environments, cached and base environments, snapshots, temporary directories and
+    logs of previous runs are removable. Files, e.g. lockfiles and the run history,
+    the wheel caches and directories which ``edgetest`` didn't create are not.
+
+    Parameters
+    ----------
+    basedir : Path
+        The base directory.
+    envs_dir : Path, optional (default None)
+        The directory for the environments, if not the base directory.
+
+    Returns
+    -------
+    List[Entry]
+        The entries, most recently used first. Files hard linked between entries are
+        only counted towards the most recently used one.
+    """
+    paths: List[Path] = []
+    for root in _roots(basedir, envs_dir):
+        for path in root.iterdir():
+            if path.name in ENTRY_DIRNAMES:
+                paths.extend(path.iterdir())
+            elif path.name not in DURABLE_DIRNAMES and _is_environment(path, root):
+                paths.append(path)
+    used = sorted(((_last_used(path), path) for path in paths), reverse=True)
+    seen: Set[Tuple[int, int]] = set()
+
+    return [Entry(path, disk_usage(path, seen), last) for last, path in used]
+
+
+def collect_garbage(
+    basedir: Path,
+    max_disk: Optional[int] = None,
+    max_age: Optional[float] = None,
+    dry_run: bool = False,
+    envs_dir: Optional[Path] = None,
+) -> List[Entry]:
+    """Remove the least recently used entries from the base directory.
+
+    Parameters
+    ----------
+    basedir : Path
+        The base directory.
+    max_disk : int, optional (default None)
+        The maximum disk usage of the removable entries in bytes. The least recently
+        used entries are removed until they fit.
+    max_age : float, optional (default None)
+        The number of days after which unused entries are removed.
+    dry_run : bool, optional (default False)
+        Whether or not to only report the entries which would be removed.
+    envs_dir : Path, optional (default None)
+        The directory for the environments, if not the base directory.
+
+    Returns
+    -------
+    List[Entry]
+        The removed entries.
+    """
+    entries = find_entries(basedir, envs_dir)
+    total = sum(entry.size for entry in entries)
+    cutoff = None if max_age is None else time.time() - max_age * SECONDS_PER_DAY
+    removed: List[Entry] = []
+    for entry in reversed(entries):
+        expired = cutoff is not None and entry.last_used < cutoff
+        if not expired and (max_disk is None or total <= max_disk):
+            continue
+        removed.append(entry)
+        total -= entry.size
+        if dry_run:
+            continue
+        LOG.info(f"Removing {entry.path}")
+        if entry.path.is_symlink() or not entry.path.is_dir():
+            entry.path.unlink()
+        else:
+            shutil.rmtree(entry.path, ignore_errors=True)
+    if not dry_run:
+        # Environments linked to removed entries in the store
+        for root in _roots(basedir, envs_dir):
+            for path in root.iterdir():
+                if _is_environment(path, root) and not path.exists():
+                    path.unlink()
+
+    return removed
+
+
+def _format_size(size: int) -> str:
+    """Format a disk usage for the report.
+
+    Parameters
+    ----------
+    size : int
+        The disk usage in bytes.
+
+    Returns
+    -------
+    str
+        The disk usage with a binary unit, e.g. ``1.5G``.
+    """
+    value = float(size)
+    for unit in ("B", "K", "M", "G"):
+        if value < 1024:
+            return f"{value:.1f}{unit}"
+        value /= 1024
+
+    return f"{value:.1f}T"
+
+
+def _display_path(path: Path, roots: List[Path]) -> str:
+    """Get the path of an entry relative to the directory it is in.
+
+    Parameters
+    ----------
+    path : Path
+        The entry.
+    roots : list
+        The output of ``_roots``.
+
+    Returns
+    -------
+    str
+        The path relative to the base directory, or the directory for the
+        environments if it's in there.
+    """
+    for root in reversed(roots):
+        try:
+            return str(path.relative_to(root))
+        except ValueError:
+            continue
+
+    return str(path)
+
+
+def gen_gc_report(
+    basedir: Path, removed: List[Entry], envs_dir: Optional[Path] = None
+) -> str:
+    """Summarize the disk usage of the base directory after garbage collection.
+
+    Parameters
+    ----------
+    basedir : Path
+        The base directory.
+    removed : list
+        The output of ``collect_garbage``.
+    envs_dir : Path, optional (default None)
+        The directory for the environments, if not the base directory.
+
+    Returns
+    -------
+    str
+        The report.
+    """
+    paths = {entry.path for entry in removed}
+    entries = [
+        entry for entry in find_entries(basedir, envs_dir) if entry.path not in paths
+    ]
+    rows = [
+        [
+            _display_path(entry.path, _roots(basedir, envs_dir)),
+            _format_size(entry.size),
+            time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.last_used)),
+            entry.path in paths,
+        ]
+        for entry in sorted(entries + removed, key=lambda entry: -entry.last_used)
+    ]
+    freed = sum(entry.size for entry in removed)
+
+    return (
+        tabulate(
+            rows, headers=["Entry", "Size", "Last used", "Removed"], tablefmt="rst"
+        )
+        + f"\n\nRemoved {len(removed)} entries, freeing {_format_size(freed)}."
+    )
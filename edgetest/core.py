@@ -1,134 +1,1460 @@
 """Core module."""
 
+import asyncio
+import contextvars
+import hashlib
 import json
+import math
+import os
 import shlex
+import shutil
+import sys
+import threading
+import time
+from functools import partial
 from pathlib import Path
-from subprocess import Popen
-from typing import Dict, List, Optional
+from subprocess import PIPE, STDOUT, Popen
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Dict, Generator, List, Optional, Set, Union
 
 from pluggy._hooks import _HookRelay
 
 from edgetest.logger import get_logger
-from edgetest.utils import _isin_case_dashhyphen_ins, _run_command, pushd
+from edgetest.utils import (
+    WHEELHOUSE_CONFIG,
+    CommandTimeoutError,
+    OutputLog,
+    _drain_async,
+    _hash_source_tree,
+    _isin_case_dashhyphen_ins,
+    _kill_process_group,
+    _read_installed_packages,
+    _run_command,
+    _run_command_async,
+    _set_limits,
+    _site_packages,
+    _wait_for_process,
+    build_requires,
+    clone_environment,
+    command_deadline,
+    command_log,
+    command_variables,
+    snapshot_tree,
+)
 
 LOG = get_logger(__name__)
 
+# The base directory, relative to the current working directory
+DEFAULT_BASEDIR = ".edgetest"
+BASEDIR_VARIABLE = "EDGETEST_BASEDIR"
+ENVS_DIR_VARIABLE = "EDGETEST_ENVS_DIR"
+# The subdirectory of a configured ``envs_dir`` which edgetest owns
+ENVS_DIRNAME = "edgetest"
+STORE_DIRNAME = ".store"
+WHEELHOUSE_DIRNAME = "wheelhouse"
+BASES_DIRNAME = ".bases"
+SNAPSHOTS_DIRNAME = ".snapshots"
+TMP_DIRNAME = ".tmp"
+STORE_MARKER = ".edgetest-complete"
+# Touched whenever an environment is used, for ``edgetest gc``
+LAST_USED_MARKER = ".edgetest-last-used"
+LOCK_INPUTS_PREFIX = "# edgetest inputs: "
+RESULTS_FNAME = "results.json"
+LOGS_DIRNAME = "logs"
+# The stages with a log file, named ``<stage>.log.gz``
+LOG_STAGES = ("setup", "test")
+# Thread pool sizes read by common numerical libraries
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "BLIS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+# The phases of set up and testing with recorded durations
+PHASES = ("resolve", "create", "deps", "install", "update", "test")
+# Files in the package directory that declare its dependencies
+METADATA_FILES = ("pyproject.toml", "setup.cfg", "setup.py", "requirements.txt")
+# Options in ``deps`` which include another requirements file
+FILE_OPTIONS = ("-r", "--requirement", "-c", "--constraint")
+_STORE_LOCKS: Dict[str, threading.Lock] = {}
+_STORE_LOCKS_GUARD = threading.Lock()
+# Seconds between attempts to take a store lock from the event loop
+LOCK_POLL_INTERVAL = 0.05
+
+
+def _store_lock(fingerprint: str) -> threading.Lock:
+    """Get the lock guarding a single environment in the store.
+
+    Parameters
+    ----------
+    fingerprint : str
+        The fingerprint of the environment.
+
+    Returns
+    -------
+    threading.Lock
+        The lock for the environment.
+    """
+    with _STORE_LOCKS_GUARD:
+        return _STORE_LOCKS.setdefault(fingerprint, threading.Lock())
+
+
+def _acquire_lock(lock: threading.Lock) -> None:
+    """Wait for a store lock.
+
+    Parameters
+    ----------
+    lock : threading.Lock
+        The lock from ``_store_lock``.
+
+    Returns
+    -------
+    None
+    """
+    lock.acquire()
+
+
+async def _acquire_lock_async(lock: threading.Lock) -> None:
+    """Wait for a store lock without holding a thread.
+
+    Waiting in the default executor would take a worker thread per waiting
+    environment, leaving none for the environment which holds the lock.
+
+    Parameters
+    ----------
+    lock : threading.Lock
+        The lock from ``_store_lock``.
+
+    Returns
+    -------
+    None
+    """
+    while not lock.acquire(blocking=False):
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+
+
+def resolve_basedir(basedir: Optional[Union[str, Path]] = None) -> Path:
+    """Get the base directory for the durable files of a run.
+
+    Lockfiles, previous results, logs, the run history and the wheel caches are kept
+    in the base directory. Resolve it once per run and pass it to each
+    ``TestPackage``.
+
+    Parameters
+    ----------
+    basedir : str or Path, optional (default None)
+        The configured base directory. Defaults to ``EDGETEST_BASEDIR`` if set,
+        otherwise ``DEFAULT_BASEDIR``. Relative paths are relative to the current
+        working directory.
+
+    Returns
+    -------
+    Path
+        The absolute path to the base directory, which is created if necessary.
+    """
+    if basedir is None:
+        basedir = os.environ.get(BASEDIR_VARIABLE) or DEFAULT_BASEDIR
+    path = Path.cwd() / basedir
+    path.mkdir(parents=True, exist_ok=True)
+
+    return path
+
+
+def resolve_envs_dir(
+    envs_dir: Optional[Union[str, Path]] = None, basedir: Optional[Path] = None
+) -> Path:
+    """Get the directory for the environments of a run.
+
+    The environments, cached and base environments, snapshots and temporary
+    directories are only needed during a run, so they can be placed on a faster,
+    ephemeral filesystem, e.g. ``tmpfs``, than the base directory.
+
+    Parameters
+    ----------
+    envs_dir : str or Path, optional (default None)
+        The configured directory. Defaults to ``EDGETEST_ENVS_DIR`` if set, otherwise
+        the base directory. Relative paths are relative to the current working
+        directory.
+    basedir : Path, optional (default None)
+        The output of ``resolve_basedir``. Resolved if not provided.
+
+    Returns
+    -------
+    Path
+        The absolute path to the ``ENVS_DIRNAME`` subdirectory of the configured
+        directory, or the base directory. It is created if necessary.
+    """
+    if envs_dir is None:
+        envs_dir = os.environ.get(ENVS_DIR_VARIABLE)
+    if envs_dir is None:
+        return resolve_basedir() if basedir is None else basedir
+    # The configured directory may be shared, e.g. ``/dev/shm``
+    path = Path.cwd() / envs_dir / ENVS_DIRNAME
+    path.mkdir(parents=True, exist_ok=True)
+
+    return path
+
+
+def new_run_id() -> str:
+    """Get a unique ID for the logs of a run.
+
+    Returns
+    -------
+    str
+        The start time of the run and the ID of the current process.
+    """
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+
+def load_results(basedir: Path) -> Dict[str, Dict]:
+    """Load the results recorded for the ``incremental`` option.
+
+    Parameters
+    ----------
+    basedir : Path
+        The base directory for the environments.
+
+    Returns
+    -------
+    Dict[str, Dict]
+        The last recorded result for each environment.
+    """
+    fname = basedir / RESULTS_FNAME
+    if not fname.is_file():
+        return {}
+    try:
+        results: Dict[str, Dict] = json.loads(fname.read_text())
+    except ValueError:
+        LOG.warning(f"Unable to read the previous results from {fname}")
+        return {}
+
+    return results
+
+
+class _Call:
+    """A blocking call requested by the environment set up steps."""
+
+    def __init__(self, func: Callable, *args, **kwargs):
+        """Init method."""
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.phase: Optional[str] = None
+
+    def timed(self, phase: str) -> "_Call":
+        """Record the duration of the call under a set up phase.
+
+        Parameters
+        ----------
+        phase : str
+            The name of the phase.
+
+        Returns
+        -------
+        _Call
+            The call.
+        """
+        self.phase = phase
+
+        return self
+
 
 class TestPackage:
     """Run test commands with bleeding edge dependencies.
 
-    Parameters
-    ----------
-    hook : _HookRelay
-        The hook object from ``pluggy``.
-    envname : str
-        The name of the conda environment to create/use.
-    upgrade : list
-        The list of packages to upgrade
-    lower : list
-        The list of packages to install lower bounds alongside the lower bound value.
-        E.g. ``["pandas==1.5.2"]``.
-    package_dir : str, optional (default None)
-        The location of the local package to install and test.
+    Every command runs with an explicit working directory and environment, and the
+    state of the current process, e.g. its working directory or environment
+    variables, is never modified. Separate ``TestPackage`` objects can therefore be
+    set up and tested concurrently from a thread pool or the event loop. Each object
+    should only be used by one thread at a time.
+
+    Parameters
+    ----------
+    hook : _HookRelay
+        The hook object from ``pluggy``.
+    envname : str
+        The name of the conda environment to create/use.
+    upgrade : list
+        The list of packages to upgrade
+    lower : list
+        The list of packages to install lower bounds alongside the lower bound value.
+        E.g. ``["pandas==1.5.2"]``.
+    package_dir : str, optional (default None)
+        The location of the local package to install and test.
+    run_id : str, optional (default None)
+        The ID of the run, from ``new_run_id``. If provided, the output of every
+        command is streamed to compressed logs in ``log_dir`` instead of being kept in
+        memory or printed to the terminal.
+    basedir : str or Path, optional (default None)
+        The base directory for lockfiles, logs and other durable files. Resolved with
+        ``resolve_basedir`` if not provided.
+    envs_dir : str or Path, optional (default None)
+        The directory for the environments. Resolved with ``resolve_envs_dir`` if not
+        provided.
+
+    Attributes
+    ----------
+    _basedir : Path
+        The base directory. ``None`` until ``basedir`` is first used, if not provided.
+    _envs_dir : Path
+        The directory for the environments. ``None`` until ``envs_dir`` is first
+        used, if not provided.
+    status : bool
+        A boolean status indicator for whether or not the tests passed. Only populated
+        after ``run_tests`` has been executed.
+    returncode : int
+        The exit code of the test command. Only populated after ``run_tests`` has been
+        executed.
+    fingerprint : str
+        The hash of the interpreter, inputs and resolved dependencies for the
+        environment. Only populated by ``setup`` when the ``cache`` option is used.
+    wheel : str
+        The path to a pre-built wheel of the local package. If populated, ``setup``
+        installs the wheel instead of building the local package.
+    incremental_key : str
+        The hash of the resolved dependencies, source tree and test command. Only
+        populated by ``setup`` when the ``incremental`` option is used.
+    cached : bool
+        Whether or not the status is the result of a previous run with the same
+        ``incremental_key``.
+    timings : dict
+        The wall-clock duration of each phase in seconds, keyed by the names in
+        ``PHASES``. Populated by ``setup`` and ``run_tests``.
+    peak_memory : int
+        The peak memory usage of the test command in bytes. ``None`` if it was not
+        measured.
+    timed_out : str
+        ``"setup"`` or ``"test"`` if the environment set up or the test command ran
+        past its timeout, otherwise ``None``.
+    run_id : str
+        The ID of the run the logs are written for. ``None`` if output is not logged.
+    snapshot_dir : str
+        The snapshot of the package directory the environment is installed from and
+        tested in. Only populated by ``setup`` when the ``snapshot`` option is used.
+    tmp_dir : str
+        The temporary directory exported as ``TMPDIR`` to the test command. Only
+        populated by ``setup`` when the ``snapshot`` option is used.
+    wheelhouse : str
+        The directory of prefetched distributions. If populated, ``setup`` installs
+        from it offline instead of from the package index.
+    """
+
+    # Tell pytest this isn't for tests
+    __test__ = False
+
+    def __init__(
+        self,
+        hook: _HookRelay,
+        envname: str,
+        upgrade: Optional[List[str]] = None,
+        lower: Optional[List[str]] = None,
+        package_dir: Optional[str] = None,
+        run_id: Optional[str] = None,
+        basedir: Optional[Union[str, Path]] = None,
+        envs_dir: Optional[Union[str, Path]] = None,
+    ):
+        """Init method."""
+        self.hook = hook
+        self.envname = envname
+
+        if (upgrade is None and lower is None) or (
+            upgrade is not None and lower is not None
+        ):
+            raise ValueError("Exactly one of upgrade and lower must be provided.")
+        self.upgrade = upgrade
+        self.lower = lower
+        self.package_dir = package_dir or "."
+
+        self.setup_status: bool = False
+        self.status: bool = False
+        self.returncode: Optional[int] = None
+        self.fingerprint: Optional[str] = None
+        self.wheel: Optional[str] = None
+        self.wheelhouse: Optional[str] = None
+        self.incremental_key: Optional[str] = None
+        self.cached: bool = False
+        self._installed: Optional[List[Dict[str, str]]] = None
+        self.timings: Dict[str, float] = {}
+        self.peak_memory: Optional[int] = None
+        self.timed_out: Optional[str] = None
+        self.run_id = run_id
+        self._basedir = Path(basedir) if basedir is not None else None
+        self._envs_dir = Path(envs_dir) if envs_dir is not None else None
+        self.snapshot_dir: Optional[str] = None
+        self.tmp_dir: Optional[str] = None
+
+    @property
+    def basedir(self) -> Path:
+        """Base directory.
+
+        Returns
+        -------
+        Path
+            Base directory for lockfiles, logs and other durable files.
+        """
+        if self._basedir is None:
+            self._basedir = resolve_basedir()
+
+        return self._basedir
+
+    @property
+    def envs_dir(self) -> Path:
+        """Directory for the environments.
+
+        Returns
+        -------
+        Path
+            Directory for the environments, snapshots and temporary directories.
+        """
+        if self._envs_dir is None:
+            self._envs_dir = resolve_envs_dir(basedir=self.basedir)
+
+        return self._envs_dir
+
+    @property
+    def own_dirs(self) -> List[Path]:
+        """Directories written by ``edgetest``.
+
+        Returns
+        -------
+        List[Path]
+            The base directory and the directory for the environments, which are
+            left out of snapshots and hashes of the package directory.
+        """
+        return [self.basedir, self.envs_dir]
+
+    @property
+    def work_dir(self) -> str:
+        """Directory to install the local package from and run the tests in.
+
+        Returns
+        -------
+        str
+            The snapshot of the package directory if there is one, otherwise the
+            package directory.
+        """
+        return self.snapshot_dir or self.package_dir
+
+    def _work_options(self) -> Dict[str, Any]:
+        """Get the options to run a command in ``work_dir``.
+
+        Returns
+        -------
+        Dict[str, Any]
+            The ``cwd`` argument for ``_run_command``, and the ``env`` argument with
+            ``tmp_dir`` exported if there is one.
+        """
+        options: Dict[str, Any] = {"cwd": self.work_dir}
+        variables = self._tmp_variables()
+        if variables:
+            options["env"] = dict(os.environ, **variables)
+
+        return options
+
+    def _snapshot(self) -> None:
+        """Snapshot the package directory and create a temporary directory.
+
+        Each environment gets its own copy of build artifacts, caches and temporary
+        files, so environments can be set up and tested concurrently.
+        """
+        LOG.info(f"Taking a snapshot of {self.package_dir} for {self.envname}...")
+        snapshot = snapshot_tree(
+            self.package_dir,
+            self.envs_dir / SNAPSHOTS_DIRNAME / self.envname,
+            exclude_dirs=self.own_dirs,
+        )
+        tmp_dir = self.envs_dir / TMP_DIRNAME / self.envname
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+        self.snapshot_dir, self.tmp_dir = str(snapshot), str(tmp_dir)
+
+    @property
+    def log_dir(self) -> Optional[Path]:
+        """Directory with the logs of the environment for the current run.
+
+        Returns
+        -------
+        Path
+            ``<basedir>/logs/<run_id>/<envname>``. ``None`` if output is not logged.
+        """
+        if self.run_id is None:
+            return None
+
+        return self.basedir / LOGS_DIRNAME / self.run_id / self.envname
+
+    def _log_file(self, stage: str) -> Optional[Path]:
+        """Get the log file for a stage.
+
+        Parameters
+        ----------
+        stage : str
+            One of ``LOG_STAGES``.
+
+        Returns
+        -------
+        Path
+            The gzip-compressed log file. ``None`` if output is not logged.
+        """
+        log_dir = self.log_dir
+        if log_dir is None:
+            return None
+
+        return log_dir / f"{stage}.log.gz"
+
+    def log_files(self) -> Dict[str, str]:
+        """Get the log files written for the environment.
+
+        Returns
+        -------
+        Dict[str, str]
+            The path to the log of each stage which ran, keyed by stage.
+        """
+        files = {stage: self._log_file(stage) for stage in LOG_STAGES}
+
+        return {
+            stage: str(path)
+            for stage, path in files.items()
+            if path is not None and path.is_file()
+        }
+
+    @property
+    def python_path(self) -> str:
+        """Get the path to the python executable.
+
+        Returns
+        -------
+        str
+            The path to the python executable.
+        """
+        return self.hook.path_to_python(**self._location())  # type: ignore
+
+    def _location(self) -> Dict[str, Any]:
+        """Get the location the environment is built in.
+
+        Environments built with the ``cache`` option live in a content-addressed store
+        under the base directory and are linked by environment name.
+
+        Returns
+        -------
+        Dict[str, Any]
+            The ``basedir`` and ``envname`` arguments for the hooks.
+        """
+        if self.fingerprint is None:
+            return {"basedir": self.envs_dir, "envname": self.envname}
+
+        return {"basedir": self.envs_dir / STORE_DIRNAME, "envname": self.fingerprint}
+
+    def _local_package(self, extras: Optional[List[str]] = None) -> str:
+        """Get the requirement for the local package.
+
+        Parameters
+        ----------
+        extras : list, optional (default None)
+            The list of extra installations to include.
+
+        Returns
+        -------
+        str
+            The pre-built wheel with the extras if available, otherwise the package
+            directory with the extras.
+        """
+        extra = f"[{', '.join(extras)}]" if extras else ""
+        if self.wheel is None:
+            return f".{extra}"
+        # The distribution name is the first component of the wheel filename
+        name = Path(self.wheel).name.split("-")[0]
+
+        return f"{name}{extra} @ {Path(self.wheel).resolve().as_uri()}"
+
+    def _requirement_lines(self, deps: Optional[List[str]] = None) -> List[str]:
+        """Convert the additional dependencies to lines of a requirements file.
+
+        ``deps`` are arguments for ``uv pip install`` in ``work_dir``, but files
+        included with ``-r`` or ``-c`` in a requirements file are relative to that
+        file. Relative paths to included files are made absolute so they resolve
+        the same way in both.
+
+        Parameters
+        ----------
+        deps : list, optional (default None)
+            A list of additional dependencies to install via ``pip``
+
+        Returns
+        -------
+        List[str]
+            One line per dependency.
+        """
+        base = Path(self.work_dir).resolve()
+        lines: List[str] = []
+        for dep in deps or []:
+            args = shlex.split(dep)
+            if not any(arg.startswith(FILE_OPTIONS) for arg in args):
+                lines.append(dep)
+                continue
+            for idx, arg in enumerate(args):
+                if idx > 0 and args[idx - 1] in FILE_OPTIONS:
+                    args[idx] = str(base / arg)
+                    continue
+                for option in FILE_OPTIONS:
+                    # Both ``--requirement=file`` and ``-rfile``
+                    prefix = f"{option}=" if option.startswith("--") else option
+                    if arg != option and arg.startswith(prefix):
+                        args[idx] = f"{option} {base / arg[len(prefix) :]}"
+            lines.append(" ".join(args))
+
+        return lines
+
+    def _resolver_inputs(
+        self,
+        directory: Path,
+        extras: Optional[List[str]] = None,
+        deps: Optional[List[str]] = None,
+    ) -> List[str]:
+        """Write the inputs for resolving the environment in a single pass.
+
+        The local package and any additional dependencies are requirements. Packages
+        to upgrade are overridden without a version so they resolve to the latest
+        release, while lower bounds are overridden with their pinned version.
+
+        Parameters
+        ----------
+        directory : Path
+            The directory to write the requirements and overrides files to.
+        extras : list, optional (default None)
+            The list of extra installations to include.
+        deps : list, optional (default None)
+            A list of additional dependencies to install via ``pip``
+
+        Returns
+        -------
+        List[str]
+            The arguments for ``uv pip``.
+        """
+        pkg = self._local_package(extras)
+        requirements = directory / "requirements.in"
+        requirements.write_text("\n".join([pkg, *self._requirement_lines(deps)]) + "\n")
+        overrides = directory / "overrides.txt"
+        overrides.write_text("\n".join(self.upgrade or self.lower or []) + "\n")
+
+        return [str(requirements), "--override", str(overrides)]
+
+    def _index_variables(self) -> Optional[Dict[str, str]]:
+        """Get the environment variables for installing from the wheelhouse.
+
+        Returns
+        -------
+        Dict[str, str]
+            The ``uv`` configuration file for offline installs from ``wheelhouse``.
+            ``None`` if there is no wheelhouse.
+        """
+        if self.wheelhouse is None:
+            return None
+
+        return {"UV_CONFIG_FILE": str(Path(self.wheelhouse, WHEELHOUSE_CONFIG))}
+
+    def pinned_requirements(
+        self,
+        extras: Optional[List[str]] = None,
+        deps: Optional[List[str]] = None,
+        **options,
+    ) -> List[str]:
+        """Resolve every distribution needed to set up the environment.
+
+        Both the environment before and after upgrading or lowering packages are
+        resolved, since set up installs the local package first. The build
+        requirements of the local package are resolved too, unless it is installed
+        from a pre-built ``wheel``.
+
+        Parameters
+        ----------
+        extras : list, optional (default None)
+            The list of extra installations to include.
+        deps : list, optional (default None)
+            A list of additional dependencies to install via ``pip``
+        **options
+            The environment options.
+
+        Returns
+        -------
+        List[str]
+            The pinned requirements, excluding the local package.
+
+        Raises
+        ------
+        RuntimeError
+            Error raised when the dependencies cannot be resolved.
+        """
+        pins: Set[str] = set()
+        with TemporaryDirectory() as tmpdir:
+            inputs = self._resolver_inputs(Path(tmpdir), extras, deps)
+            # The requirements alone, then with the overrides
+            resolutions = [inputs[:1], inputs]
+            if self.wheel is None:
+                build = Path(tmpdir, "build.in")
+                build.write_text("\n".join(build_requires(self.package_dir)) + "\n")
+                resolutions.append([str(build)])
+            for args in resolutions:
+                out, _ = _run_command(
+                    "uv",
+                    "pip",
+                    "compile",
+                    "--no-header",
+                    "--no-annotate",
+                    *self._resolver_python(**options),
+                    *args,
+                    cwd=self.package_dir,
+                )
+                pins.update(
+                    line.strip()
+                    for line in out.splitlines()
+                    if "==" in line and " @ " not in line
+                )
+
+        return sorted(pins)
+
+    def _resolver_python(self, **options) -> List[str]:
+        """Get the interpreter arguments for resolving before the environment exists.
+
+        Parameters
+        ----------
+        **options
+            The environment options. If ``python_version`` is provided, the resolution
+            targets that version. Otherwise, it targets the current interpreter.
+
+        Returns
+        -------
+        List[str]
+            The arguments for ``uv pip``.
+        """
+        if options.get("python_version"):
+            return [f"--python-version={options['python_version']}"]
+
+        return [f"--python={sys.executable}"]
+
+    def _fingerprint(
+        self,
+        resolved: str,
+        extras: Optional[List[str]] = None,
+        deps: Optional[List[str]] = None,
+        **options,
+    ) -> str:
+        """Hash the interpreter, local package, inputs and resolved versions.
+
+        Parameters
+        ----------
+        resolved : str
+            The output of ``uv pip compile`` for the environment.
+        extras : list, optional (default None)
+            The list of extra installations to include.
+        deps : list, optional (default None)
+            A list of additional dependencies to install via ``pip``
+        **options
+            The environment options. ``python_version`` is included in the hash.
+
+        Returns
+        -------
+        str
+            The fingerprint.
+        """
+        spec = {
+            "python": [sys.version, sys.platform, options.get("python_version")],
+            "package_dir": str(Path(self.package_dir).resolve()),
+            # Environments in the store are shared, so the local package is never
+            # reinstalled into them
+            "source": self._local_hash(),
+            "upgrade": self.upgrade,
+            "lower": self.lower,
+            "extras": extras,
+            "deps": deps,
+            "resolved": sorted(
+                line.strip() for line in resolved.splitlines() if "==" in line
+            ),
+        }
+
+        return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+    def _incremental_key(
+        self,
+        resolved: str,
+        extras: Optional[List[str]] = None,
+        deps: Optional[List[str]] = None,
+        **options,
+    ) -> str:
+        """Hash the resolved versions, source tree and test command for the environment.
+
+        Parameters
+        ----------
+        resolved : str
+            The output of ``uv pip compile`` for the environment.
+        extras : list, optional (default None)
+            The list of extra installations to include.
+        deps : list, optional (default None)
+            A list of additional dependencies to install via ``pip``
+        **options
+            The environment options. ``command`` is included in the hash.
+
+        Returns
+        -------
+        str
+            The key for the result of the environment.
+        """
+        spec = {
+            "fingerprint": self._fingerprint(resolved, extras, deps, **options),
+            "source": _hash_source_tree(self.package_dir, self.own_dirs),
+            "command": options.get("command"),
+        }
+
+        return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+    def _link_environment(self) -> None:
+        """Link the environment name to the cached environment in the store."""
+        link = self.envs_dir / self.envname
+        target = self.envs_dir / STORE_DIRNAME / str(self.fingerprint)
+        if link.is_symlink() or link.is_file():
+            link.unlink()
+        elif link.is_dir():
+            shutil.rmtree(link)
+        try:
+            os.symlink(target, link, target_is_directory=True)
+        except OSError:
+            LOG.warning("Unable to link %s to the cached environment %s", link, target)
+
+    def _mark_used(self) -> None:
+        """Record the last use of the environment for ``edgetest gc``."""
+        location = self._location()
+        envdir = Path(location["basedir"], location["envname"])
+        if envdir.is_dir():
+            (envdir / LAST_USED_MARKER).touch()
+
+    def cleanup(self) -> None:
+        """Remove the environment, its snapshot and temporary directory.
+
+        The installed packages are read first, so ``upgraded_packages`` still works
+        afterwards. If they can't be read, e.g. because the set up failed, nothing is
+        reported as installed. Environments from the ``cache`` option are unlinked, but
+        stay in the store for other environments and runs.
+
+        Returns
+        -------
+        None
+        """
+        if self._installed is None:
+            try:
+                self.installed_packages()
+            except RuntimeError:
+                if self.setup_status:
+                    LOG.exception(
+                        "Unable to read the installed packages in %s", self.envname
+                    )
+                self._installed = []
+        link = self.envs_dir / self.envname
+        if link.is_symlink():
+            link.unlink()
+        elif link.is_dir():
+            shutil.rmtree(link)
+        for tmpdir in (self.snapshot_dir, self.tmp_dir):
+            if tmpdir is not None:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+        self.snapshot_dir = None
+        self.tmp_dir = None
+        LOG.info(f"Removed the environment {self.envname}")
+
+    def _add_timing(self, phase: Optional[str], start: float) -> None:
+        """Add the time since ``start`` to a phase.
+
+        Parameters
+        ----------
+        phase : str
+            The name of the phase. Nothing is recorded if ``None``.
+        start : float
+            The start time from ``time.monotonic``.
+
+        Returns
+        -------
+        None
+        """
+        if phase is not None:
+            elapsed = time.monotonic() - start
+            self.timings[phase] = self.timings.get(phase, 0.0) + elapsed
+
+    def setup(
+        self,
+        extras: Optional[List[str]] = None,
+        deps: Optional[List[str]] = None,
+        skip: bool = False,
+        **options,
+    ) -> None:
+        """Set up the testing environment.
+
+        Parameters
+        ----------
+        extras : list, optional (default None)
+            The list of extra installations to include.
+        deps : list, optional (default None)
+            A list of additional dependencies to install via ``pip``
+        skip : bool, optional (default False)
+            Whether to skip setup as a pre-made environment has already been
+            created.
+        **options
+            Additional options for ``self.hook.create_environment``.
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        RuntimeError
+            This error will be raised if any part of the set up process fails.
+        """
+        steps = self._setup_steps(extras=extras, deps=deps, skip=skip, **options)
+        log = self._log_file("setup")
+        index = command_variables(self._index_variables())
+        with command_deadline(options.get("setup_timeout")), command_log(log), index:
+            try:
+                call = next(steps)
+                while True:
+                    start = time.monotonic()
+                    try:
+                        result = call.func(*call.args, **call.kwargs)
+                    except Exception as err:
+                        self._add_timing(call.phase, start)
+                        self._check_timeout(err)
+                        call = steps.throw(err)
+                    else:
+                        self._add_timing(call.phase, start)
+                        call = steps.send(result)
+            except StopIteration:
+                pass
+        # Environments which failed to set up are removable by ``edgetest gc`` too
+        self._mark_used()
+
+    async def setup_async(
+        self,
+        extras: Optional[List[str]] = None,
+        deps: Optional[List[str]] = None,
+        skip: bool = False,
+        **options,
+    ) -> None:
+        """Set up the testing environment using ``asyncio``.
+
+        Runs the same steps as ``setup``. Commands executed by ``edgetest`` are
+        awaited as ``asyncio`` subprocesses and locks on shared environments are
+        awaited on the event loop, while plugin hooks run in the default executor.
+
+        Parameters
+        ----------
+        extras : list, optional (default None)
+            The list of extra installations to include.
+        deps : list, optional (default None)
+            A list of additional dependencies to install via ``pip``
+        skip : bool, optional (default False)
+            Whether to skip setup as a pre-made environment has already been
+            created.
+        **options
+            Additional options for ``self.hook.create_environment``.
+
+        Returns
+        -------
+        None
+        """
+        loop = asyncio.get_running_loop()
+        steps = self._setup_steps(extras=extras, deps=deps, skip=skip, **options)
+        log = self._log_file("setup")
+        index = command_variables(self._index_variables())
+        with command_deadline(options.get("setup_timeout")), command_log(log), index:
+            try:
+                call = next(steps)
+                while True:
+                    start = time.monotonic()
+                    try:
+                        if call.func is _run_command:
+                            result = await _run_command_async(*call.args, **call.kwargs)
+                        elif call.func is _acquire_lock:
+                            await _acquire_lock_async(*call.args)
+                            result = None
+                        else:
+                            # Hooks running in the executor share the deadline and log
+                            context = contextvars.copy_context()
+                            result = await loop.run_in_executor(
+                                None,
+                                partial(
+                                    context.run, call.func, *call.args, **call.kwargs
+                                ),
+                            )
+                    except Exception as err:
+                        self._add_timing(call.phase, start)
+                        self._check_timeout(err)
+                        call = steps.throw(err)
+                    else:
+                        self._add_timing(call.phase, start)
+                        call = steps.send(result)
+            except StopIteration:
+                pass
+        self._mark_used()
+
+    def _check_timeout(self, err: Exception) -> None:
+        """Record a set up step which ran past the ``setup_timeout``.
+
+        Hooks wrap the errors of the commands they run, e.g. in a ``RuntimeError``, so
+        the whole chain of causes is checked.
+
+        Parameters
+        ----------
+        err : Exception
+            The error raised by the step.
+        """
+        cause: Optional[BaseException] = err
+        while cause is not None and not isinstance(cause, CommandTimeoutError):
+            cause = cause.__cause__ or cause.__context__
+        if cause is not None and self.timed_out is None:
+            LOG.warning(f"Setting up {self.envname} timed out")
+            self.timed_out = "setup"
+
+    def _setup_steps(
+        self,
+        extras: Optional[List[str]] = None,
+        deps: Optional[List[str]] = None,
+        skip: bool = False,
+        **options,
+    ) -> Generator[_Call, Any, None]:
+        """Generate the steps to set up the testing environment.
+
+        Each blocking call is yielded to the caller, which executes it and sends back
+        the result or throws the raised exception into the generator. This keeps a
+        single implementation of the set up logic for ``setup`` and ``setup_async``.
+
+        Parameters
+        ----------
+        extras : list, optional (default None)
+            The list of extra installations to include.
+        deps : list, optional (default None)
+            A list of additional dependencies to install via ``pip``
+        skip : bool, optional (default False)
+            Whether to skip setup as a pre-made environment has already been
+            created.
+        **options
+            Additional options for ``self.hook.create_environment``.
+
+        Yields
+        ------
+        _Call
+            The blocking call to execute.
+        """
+        # The installed packages may change
+        self._installed = None
+        self.timings = {}
+        self.peak_memory = None
+        self.timed_out = None
+        self.snapshot_dir = None
+        self.tmp_dir = None
+        if options.get("snapshot"):
+            try:
+                yield _Call(self._snapshot)
+            except OSError:
+                LOG.exception(f"Unable to take a snapshot for {self.envname}")
+                self.setup_status = False
+                return
+        if skip:
+            self.setup_status = True
+            return
+        pkg = self._local_package(extras)
+        self.fingerprint = None
+        self.incremental_key = None
+        self.cached = False
+        resolved = None
+        if options.get("cache") or options.get("incremental"):
+            resolved = yield from self._resolve_steps(
+                extras=extras, deps=deps, **options
+            )
+        if options.get("incremental") and resolved is not None:
+            self.incremental_key = yield _Call(
+                self._incremental_key, resolved, extras, deps, **options
+            )
+            record = load_results(self.basedir).get(self.envname, {})
+            if record.get("key") == self.incremental_key:
+                LOG.info(
+                    f"The dependencies and source for {self.envname} have not changed "
+                    "since the last run. Using the previous result..."
+                )
+                self.setup_status = True
+                self.status = record["status"]
+                self.cached = True
+                self._installed = record["upgraded"]
+                return
+        inputs = self._inputs_hash(extras=extras, deps=deps, **options)
+        if options.get("from_lock"):
+            if self._lock_inputs() == inputs:
+                yield from self._sync_steps(pkg=pkg, **options)
+                return
+            LOG.info(
+                f"The lockfile for {self.envname} is missing or out of date. "
+                "Resolving the environment..."
+            )
+        yield from self._build_steps(
+            pkg=pkg, extras=extras, deps=deps, resolved=resolved, **options
+        )
+        if self.setup_status:
+            yield from self._lock_steps(inputs=inputs)
+
+    def _resolve_steps(
+        self,
+        extras: Optional[List[str]] = None,
+        deps: Optional[List[str]] = None,
+        **options,
+    ) -> Generator[_Call, Any, Optional[str]]:
+        """Generate the steps to resolve the dependencies without installing them.
+
+        Parameters
+        ----------
+        extras : list, optional (default None)
+            The list of extra installations to include.
+        deps : list, optional (default None)
+            A list of additional dependencies to install via ``pip``
+        **options
+            The environment options.
+
+        Yields
+        ------
+        _Call
+            The blocking call to execute.
+
+        Returns
+        -------
+        str
+            The output of ``uv pip compile``. ``None`` if the dependencies cannot be
+            resolved.
+        """
+        LOG.info(f"Resolving the dependencies for {self.envname}...")
+        with TemporaryDirectory() as tmpdir:
+            try:
+                out, _ = yield _Call(
+                    _run_command,
+                    "uv",
+                    "pip",
+                    "compile",
+                    "--no-header",
+                    "--no-annotate",
+                    *self._resolver_python(**options),
+                    *self._resolver_inputs(Path(tmpdir), extras, deps),
+                    **self._work_options(),
+                ).timed("resolve")
+            except RuntimeError:
+                LOG.exception(
+                    "Unable to resolve the dependencies for %s. Not using the cache "
+                    "or previous results.",
+                    self.envname,
+                )
+                return None
+
+        return str(out)
+
+    def _build_steps(
+        self,
+        pkg: str,
+        extras: Optional[List[str]] = None,
+        deps: Optional[List[str]] = None,
+        resolved: Optional[str] = None,
+        **options,
+    ) -> Generator[_Call, Any, None]:
+        """Generate the steps to build the environment.
+
+        Parameters
+        ----------
+        pkg : str
+            The local package to install, including any extras.
+        extras : list, optional (default None)
+            The list of extra installations to include.
+        deps : list, optional (default None)
+            A list of additional dependencies to install via ``pip``
+        resolved : str, optional (default None)
+            The output of ``uv pip compile`` for the environment. Required to use the
+            ``cache`` option.
+        **options
+            Additional options for ``self.hook.create_environment``.
+
+        Yields
+        ------
+        _Call
+            The blocking call to execute.
+        """
+        if options.get("cache") and resolved is not None:
+            self.fingerprint = self._fingerprint(resolved, extras, deps, **options)
+        if self.fingerprint is None:
+            yield from self._install_steps(pkg=pkg, deps=deps, **options)
+            return
+        # Environments with the same fingerprint share a directory in the store
+        store = self.envs_dir / STORE_DIRNAME / self.fingerprint
+        lock = _store_lock(self.fingerprint)
+        yield _Call(_acquire_lock, lock)
+        try:
+            if (store / STORE_MARKER).is_file():
+                LOG.info(
+                    f"Reusing cached environment {self.fingerprint[:12]} for {self.envname}"
+                )
+                self.setup_status = True
+            else:
+                if store.exists():
+                    # Remove any partially built environment
+                    shutil.rmtree(store)
+                yield from self._install_steps(pkg=pkg, deps=deps, **options)
+                if not self.setup_status:
+                    return
+                store.mkdir(parents=True, exist_ok=True)
+                (store / STORE_MARKER).touch()
+            self._link_environment()
+        finally:
+            lock.release()
+
+    @property
+    def lockfile(self) -> Path:
+        """The lockfile of the exact packages installed in the environment.
+
+        Returns
+        -------
+        Path
+            The location of the lockfile.
+        """
+        return self.basedir / f"{self.envname}.lock"
+
+    def _inputs_hash(
+        self,
+        extras: Optional[List[str]] = None,
+        deps: Optional[List[str]] = None,
+        **options,
+    ) -> str:
+        """Hash the inputs which determine the packages in the environment.
+
+        Parameters
+        ----------
+        extras : list, optional (default None)
+            The list of extra installations to include.
+        deps : list, optional (default None)
+            A list of additional dependencies to install via ``pip``
+        **options
+            The environment options. ``python_version`` is included in the hash.
+
+        Returns
+        -------
+        str
+            The hash of the interpreter, the environment configuration and the
+            dependency metadata of the local package.
+        """
+        metadata = {}
+        for fname in METADATA_FILES:
+            path = Path(self.package_dir, fname)
+            if path.is_file():
+                metadata[fname] = hashlib.sha256(path.read_bytes()).hexdigest()
+        spec = {
+            "python": [sys.version, sys.platform, options.get("python_version")],
+            "package_dir": str(Path(self.package_dir).resolve()),
+            "upgrade": self.upgrade,
+            "lower": self.lower,
+            "extras": extras,
+            "deps": deps,
+            "metadata": metadata,
+        }
+
+        return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+    def _lock_inputs(self) -> Optional[str]:
+        """Read the hash of the inputs recorded in the lockfile.
+
+        Returns
+        -------
+        str
+            The hash of the inputs. ``None`` if there is no lockfile.
+        """
+        if not self.lockfile.is_file():
+            return None
+        for line in self.lockfile.read_text().splitlines():
+            if line.startswith(LOCK_INPUTS_PREFIX):
+                return line[len(LOCK_INPUTS_PREFIX) :].strip()
 
-    Attributes
-    ----------
-    _basedir : str
-        The base directory location for each environment
-    status : bool
-        A boolean status indicator for whether or not the tests passed. Only populated
-        after ``run_tests`` has been executed.
-    """
+        return None
 
-    # Tell pytest this isn't for tests
-    __test__ = False
+    def _lock_steps(self, inputs: str) -> Generator[_Call, Any, None]:
+        """Generate the steps to write the lockfile for the environment.
 
-    def __init__(
-        self,
-        hook: _HookRelay,
-        envname: str,
-        upgrade: Optional[List[str]] = None,
-        lower: Optional[List[str]] = None,
-        package_dir: Optional[str] = None,
-    ):
-        """Init method."""
-        self.hook = hook
-        self.envname = envname
+        The local package is excluded from the lockfile since it is reinstalled from
+        the source when the environment is rebuilt.
 
-        if (upgrade is None and lower is None) or (
-            upgrade is not None and lower is not None
-        ):
-            raise ValueError("Exactly one of upgrade and lower must be provided.")
-        self.upgrade = upgrade
-        self.lower = lower
-        self.package_dir = package_dir or "."
+        Parameters
+        ----------
+        inputs : str
+            The hash of the inputs for the environment.
 
-        self.setup_status: bool = False
-        self.status: bool = False
+        Yields
+        ------
+        _Call
+            The blocking call to execute.
+        """
+        try:
+            out, _ = yield _Call(
+                _run_command, "uv", "pip", "freeze", f"--python={self.python_path}"
+            )
+        except RuntimeError:
+            LOG.exception("Unable to write the lockfile for %s", self.envname)
+            return
+        local = {Path(self.work_dir).resolve().as_uri()}
+        if self.wheel is not None:
+            local.add(Path(self.wheel).resolve().as_uri())
+        pins = [
+            line.strip()
+            for line in out.splitlines()
+            if line.strip() and line.split(" @ ")[-1].strip() not in local
+        ]
+        self.lockfile.write_text(
+            "\n".join(
+                [
+                    f"# This file was generated by edgetest for {self.envname}",
+                    f"{LOCK_INPUTS_PREFIX}{inputs}",
+                    *pins,
+                ]
+            )
+            + "\n"
+        )
+        LOG.info(f"Wrote the lockfile for {self.envname} to {self.lockfile}")
 
-    @property
-    def basedir(self) -> Path:
-        """Base directory.
+    def _sync_steps(self, pkg: str, **options) -> Generator[_Call, Any, None]:
+        """Generate the steps to rebuild the environment from the lockfile.
+
+        Parameters
+        ----------
+        pkg : str
+            The local package to install, including any extras.
+        **options
+            Additional options for ``self.hook.create_environment``.
+
+        Yields
+        ------
+        _Call
+            The blocking call to execute.
+        """
+        yield from self._create_steps(self._location(), **options)
+        if not self.setup_status:
+            return
+        LOG.info(f"Installing {self.envname} from {self.lockfile}...")
+        try:
+            yield _Call(
+                _run_command,
+                "uv",
+                "pip",
+                "sync",
+                f"--python={self.python_path}",
+                str(self.lockfile),
+            ).timed("install")
+            # The dependencies of the local package are already in the lockfile
+            yield _Call(
+                _run_command,
+                "uv",
+                "pip",
+                "install",
+                f"--python={self.python_path}",
+                "--no-deps",
+                pkg,
+                **self._work_options(),
+            ).timed("install")
+        except RuntimeError:
+            LOG.exception("Unable to install %s from the lockfile", self.envname)
+            self.setup_status = False
+            return
+        LOG.info(f"Successfully installed {self.envname} from the lockfile")
+        self.setup_status = True
+
+    def _combined_install_supported(self) -> bool:
+        """Check whether the plugins can install the environment in one resolution.
+
+        The default ``run_install`` implementation installs with ``uv``. It is not used
+        if another plugin replaces ``run_update`` or ``run_install_lower`` without also
+        implementing ``run_install``.
 
         Returns
         -------
-        Path
-            Base directory for execution.
+        bool
+            Whether or not to call ``self.hook.run_install``.
         """
-        _basedir = Path.cwd() / ".edgetest"
-        _basedir.mkdir(exist_ok=True)
+        impls = self.hook.run_install.get_hookimpls()
+        if len(impls) != 1:
+            return bool(impls)
 
-        return _basedir
+        return all(
+            len(caller.get_hookimpls()) <= 1
+            for caller in (self.hook.run_update, self.hook.run_install_lower)
+        )
 
-    @property
-    def python_path(self) -> str:
-        """Get the path to the python executable.
+    def _local_hash(self) -> str:
+        """Hash the local package.
 
         Returns
         -------
         str
-            The path to the python executable.
+            The SHA-256 hash of the pre-built wheel if there is one, otherwise of the
+            source tree.
         """
-        return self.hook.path_to_python(basedir=self.basedir, envname=self.envname)  # type: ignore
+        if self.wheel is None:
+            return _hash_source_tree(self.package_dir, self.own_dirs)
 
-    def setup(
-        self,
-        extras: Optional[List[str]] = None,
-        deps: Optional[List[str]] = None,
-        skip: bool = False,
-        **options,
-    ) -> None:
-        """Set up the testing environment.
+        return hashlib.sha256(Path(self.wheel).read_bytes()).hexdigest()
+
+    def _base_key(self, pkg: str, deps: Optional[List[str]] = None, **options) -> str:
+        """Hash the inputs which determine the packages in the base environment.
 
         Parameters
         ----------
-        extras : list, optional (default None)
-            The list of extra installations to include.
+        pkg : str
+            The local package to install, including any extras.
         deps : list, optional (default None)
             A list of additional dependencies to install via ``pip``
-        skip : bool, optional (default False)
-            Whether to skip setup as a pre-made environment has already been
-            created.
         **options
-            Additional options for ``self.hook.create_environment``.
+            The environment options. ``python_version`` and ``venv_backend`` are
+            included in the hash.
 
         Returns
         -------
-        None
+        str
+            The key for the base environment.
+        """
+        spec = {
+            "python": [
+                sys.version,
+                sys.platform,
+                options.get("python_version"),
+                options.get("venv_backend"),
+            ],
+            "package_dir": str(Path(self.package_dir).resolve()),
+            "source": self._local_hash(),
+            "pkg": pkg,
+            "deps": deps,
+        }
 
-        Raises
+        return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+    def _create_steps(
+        self, location: Dict[str, Any], **options
+    ) -> Generator[_Call, Any, None]:
+        """Generate the steps to create an empty environment.
+
+        Sets ``setup_status`` to whether or not the environment was created.
+
+        Parameters
+        ----------
+        location : dict
+            The ``basedir`` and ``envname`` arguments for the hooks.
+        **options
+            Additional options for ``self.hook.create_environment``.
+
+        Yields
         ------
-        RuntimeError
-            This error will be raised if any part of the set up process fails.
+        _Call
+            The blocking call to execute.
         """
-        if skip:
-            self.setup_status = True
-            return
-        # Create the conda environment
         try:
             LOG.info(f"Creating the following environment: {self.envname}...")
-            self.hook.create_environment(
-                basedir=self.basedir, envname=self.envname, conf=options
+            yield _Call(self.hook.create_environment, conf=options, **location).timed(
+                "create"
             )
             LOG.info(f"Successfully created {self.envname}")
         except RuntimeError:
@@ -138,50 +1464,200 @@ class TestPackage:
             self.setup_status = False
             return
 
-        # Install the local package
-        with pushd(self.package_dir):
-            pkg = "."
-            if extras:
-                pkg += f"[{', '.join(extras)}]"
-            if deps:
-                LOG.info(
-                    "Installing specified additional dependencies into %s: %s",
+        self.setup_status = True
+
+    def _local_steps(
+        self, python_path: str, pkg: str, deps: Optional[List[str]] = None
+    ) -> Generator[_Call, Any, None]:
+        """Generate the steps to install the additional dependencies and local package.
+
+        Sets ``setup_status`` to whether or not the packages were installed.
+
+        Parameters
+        ----------
+        python_path : str
+            The python executable of the environment to install into.
+        pkg : str
+            The local package to install, including any extras.
+        deps : list, optional (default None)
+            A list of additional dependencies to install via ``pip``
+
+        Yields
+        ------
+        _Call
+            The blocking call to execute.
+        """
+        if deps:
+            LOG.info(
+                "Installing specified additional dependencies into %s: %s",
+                self.envname,
+                ", ".join(deps),
+            )
+            split = [shlex.split(dep) for dep in deps]
+            try:
+                yield _Call(
+                    _run_command,
+                    "uv",
+                    "pip",
+                    "install",
+                    f"--python={python_path}",
+                    *[itm for lst in split for itm in lst],
+                    **self._work_options(),
+                ).timed("deps")
+            except RuntimeError:
+                LOG.exception(
+                    "Unable to install specified additional dependencies in %s",
                     self.envname,
-                    ", ".join(deps),
                 )
-                split = [shlex.split(dep) for dep in deps]
+                self.setup_status = False
+                return
+            LOG.info(
+                f"Successfully installed specified additional dependencies into {self.envname}"
+            )
+
+        LOG.info(f"Installing the local package into {self.envname}...")
+        try:
+            yield _Call(
+                _run_command,
+                "uv",
+                "pip",
+                "install",
+                f"--python={python_path}",
+                pkg,
+                **self._work_options(),
+            ).timed("install")
+            LOG.info(f"Successfully installed the local package into {self.envname}...")
+        except RuntimeError:
+            LOG.exception("Unable to install the local package into %s", self.envname)
+            self.setup_status = False
+            return
+
+        self.setup_status = True
+
+    def _base_steps(
+        self, pkg: str, deps: Optional[List[str]] = None, **options
+    ) -> Generator[_Call, Any, None]:
+        """Generate the steps to clone the environment from a shared base environment.
+
+        Sets ``setup_status`` to whether or not the environment was cloned.
+
+        The base environment has the additional dependencies and the local package
+        installed. It is built once for each unique interpreter, local package,
+        extras and additional dependencies, and cloned for each environment.
+
+        Parameters
+        ----------
+        pkg : str
+            The local package to install, including any extras.
+        deps : list, optional (default None)
+            A list of additional dependencies to install via ``pip``
+        **options
+            Additional options for ``self.hook.create_environment``.
+
+        Yields
+        ------
+        _Call
+            The blocking call to execute.
+        """
+        key = self._base_key(pkg=pkg, deps=deps, **options)
+        base = self.envs_dir / BASES_DIRNAME / key
+        location: Dict[str, Any] = {"basedir": base.parent, "envname": key}
+        lock = _store_lock(f"base-{key}")
+        yield _Call(_acquire_lock, lock)
+        try:
+            if (base / STORE_MARKER).is_file():
+                LOG.info(f"Reusing base environment {key[:12]} for {self.envname}")
+                (base / LAST_USED_MARKER).touch()
+            else:
+                if base.exists():
+                    # Remove any partially built environment
+                    shutil.rmtree(base)
+                yield from self._create_steps(location, **options)
+                if not self.setup_status:
+                    return
+                python_path = self.hook.path_to_python(**location)
+                yield from self._local_steps(python_path, pkg, deps)
+                if not self.setup_status:
+                    return
+                base.mkdir(parents=True, exist_ok=True)
+                (base / STORE_MARKER).touch()
+        finally:
+            lock.release()
+        location = self._location()
+        try:
+            LOG.info(f"Cloning the base environment into {self.envname}...")
+            yield _Call(
+                clone_environment,
+                base,
+                Path(location["basedir"], location["envname"]),
+                # Each environment is used and garbage collected on its own
+                exclude_files=(STORE_MARKER, LAST_USED_MARKER),
+            ).timed("create")
+        except OSError:
+            LOG.exception("Unable to clone the base environment into %s", self.envname)
+            self.setup_status = False
+            return
+
+        self.setup_status = True
+
+    def _install_steps(
+        self, pkg: str, deps: Optional[List[str]] = None, **options
+    ) -> Generator[_Call, Any, None]:
+        """Generate the steps to create the environment and install into it.
+
+        Parameters
+        ----------
+        pkg : str
+            The local package to install, including any extras.
+        deps : list, optional (default None)
+            A list of additional dependencies to install via ``pip``
+        **options
+            Additional options for ``self.hook.create_environment``.
+
+        Yields
+        ------
+        _Call
+            The blocking call to execute.
+        """
+        if options.get("base_env"):
+            yield from self._base_steps(pkg=pkg, deps=deps, **options)
+            if not self.setup_status:
+                return
+        else:
+            # Create the conda environment
+            yield from self._create_steps(self._location(), **options)
+            if not self.setup_status:
+                return
+
+            if options.get("combined_install") and self._combined_install_supported():
+                LOG.info(f"Installing all packages into {self.envname} at once...")
+                split = [shlex.split(dep) for dep in deps or []]
                 try:
-                    _run_command(
-                        "uv",
-                        "pip",
-                        "install",
-                        f"--python={self.python_path}",
-                        *[itm for lst in split for itm in lst],
-                    )
+                    installed = yield _Call(
+                        self.hook.run_install,
+                        requirements=[*[itm for lst in split for itm in lst], pkg],
+                        upgrade=self.upgrade,
+                        lower=self.lower,
+                        conf=options,
+                        cwd=self.work_dir,
+                        **self._location(),
+                    ).timed("install")
                 except RuntimeError:
-                    LOG.exception(
-                        "Unable to install specified additional dependencies in %s",
-                        self.envname,
-                    )
+                    LOG.exception("Unable to install packages in %s", self.envname)
                     self.setup_status = False
                     return
+                if installed:
+                    LOG.info(f"Successfully installed all packages into {self.envname}")
+                    self.setup_status = True
+                    return
                 LOG.info(
-                    f"Successfully installed specified additional dependencies into {self.envname}"
+                    f"Unable to install all packages into {self.envname} at once. "
+                    "Installing them one step at a time..."
                 )
 
-            LOG.info(f"Installing the local package into {self.envname}...")
-            try:
-                _run_command(
-                    "uv", "pip", "install", f"--python={self.python_path}", pkg
-                )
-                LOG.info(
-                    f"Successfully installed the local package into {self.envname}..."
-                )
-            except RuntimeError:
-                LOG.exception(
-                    "Unable to install the local package into %s", self.envname
-                )
-                self.setup_status = False
+            # Install the local package
+            yield from self._local_steps(self.python_path, pkg, deps)
+            if not self.setup_status:
                 return
 
         if self.upgrade:
@@ -190,12 +1666,12 @@ class TestPackage:
                 f"Upgrading the following packages in {self.envname}: {', '.join(self.upgrade)}"
             )
             try:
-                self.hook.run_update(
-                    basedir=self.basedir,
-                    envname=self.envname,
+                yield _Call(
+                    self.hook.run_update,
                     upgrade=self.upgrade,
                     conf=options,
-                )
+                    **self._location(),
+                ).timed("update")
                 self.setup_status = True
             except RuntimeError:
                 self.setup_status = False
@@ -210,12 +1686,12 @@ class TestPackage:
                 ", ".join(self.lower),  # type:ignore
             )
             try:
-                self.hook.run_install_lower(
-                    basedir=self.basedir,
-                    envname=self.envname,
+                yield _Call(
+                    self.hook.run_install_lower,
                     lower=self.lower,
                     conf=options,
-                )
+                    **self._location(),
+                ).timed("update")
                 self.setup_status = True
             except RuntimeError:
                 self.setup_status = False
@@ -227,6 +1703,37 @@ class TestPackage:
                 f"Successfully installed lower bounds of packages in {self.envname}"
             )
 
+    def installed_packages(self) -> List[Dict[str, str]]:
+        """Get the packages installed in the test environment.
+
+        The versions are read from the package metadata in ``site-packages``. If
+        ``site-packages`` can't be found, e.g. for environments from plugins with a
+        different layout, ``uv pip list`` is used instead. The result is cached until
+        the next call to ``setup``.
+
+        Returns
+        -------
+        List[Dict[str, str]]
+            The name and version of each installed package, like the output of
+            ``pip list --format json``.
+        """
+        if self._installed is None:
+            site_packages = _site_packages(self.python_path)
+            if site_packages:
+                self._installed = _read_installed_packages(site_packages)
+            else:
+                out, _ = _run_command(
+                    "uv",
+                    "pip",
+                    "list",
+                    f"--python={self.python_path}",
+                    "--format",
+                    "json",
+                )
+                self._installed = json.loads(out)
+
+        return self._installed
+
     def upgraded_packages(self) -> List[Dict[str, str]]:
         """Get the list of upgraded packages for the test environment.
 
@@ -237,21 +1744,15 @@ class TestPackage:
         Returns
         -------
         List
-            The output of ``pip list --format json``, filtered to the packages upgraded
-            for this environment.
+            The installed packages, filtered to the packages upgraded for this
+            environment.
         """
         if self.upgrade is None:
             return []
-        # Get the version for the upgraded package(s)
-        out, _ = _run_command(
-            "uv", "pip", "list", f"--python={self.python_path}", "--format", "json"
-        )
-        outjson = json.loads(out)
-
         upgrade_wo_extras = [pkg.split("[")[0] for pkg in self.upgrade]
         return [
             pkg
-            for pkg in outjson
+            for pkg in self.installed_packages()
             if _isin_case_dashhyphen_ins(pkg.get("name", ""), upgrade_wo_extras)
         ]
 
@@ -270,27 +1771,247 @@ class TestPackage:
             {"name": pkg_info[0], "version": pkg_info[1]} for pkg_info in packages_split
         ]
 
-    def run_tests(self, command: str) -> int:
+    def _test_limits(
+        self,
+        pid: int,
+        cpus: Optional[List[int]],
+        timeout: Optional[float],
+        max_memory: Optional[int],
+    ) -> None:
+        """Limit the resources of a running test command.
+
+        Parameters
+        ----------
+        pid : int
+            The ID of the test command.
+        cpus : list
+            The IDs of the CPUs to pin the test command to.
+        timeout : float
+            The wall-clock timeout in seconds. The CPU time is limited to the timeout
+            for each CPU the tests can use, as a backstop for processes which outlive
+            the test command.
+        max_memory : int
+            The maximum address space in bytes.
+        """
+        if cpus and hasattr(os, "sched_setaffinity"):
+            # Processes started by the tests inherit the affinity
+            try:
+                os.sched_setaffinity(pid, cpus)
+            except OSError as err:
+                LOG.warning(f"Unable to pin the tests for {self.envname}: {err}")
+        cpu_seconds = None
+        if timeout is not None:
+            cpu_seconds = math.ceil(timeout * len(cpus or range(os.cpu_count() or 1)))
+        if max_memory is not None or cpu_seconds is not None:
+            _set_limits(pid, max_memory=max_memory, cpu_seconds=cpu_seconds)
+
+    def _finish_tests(self, returncode: int, timed_out: bool) -> None:
+        """Record the outcome of the test command.
+
+        Parameters
+        ----------
+        returncode : int
+            The exit code.
+        timed_out : bool
+            Whether or not the test command was killed after the timeout.
+        """
+        if timed_out:
+            LOG.warning(f"The tests for {self.envname} timed out")
+            self.timed_out = "test"
+        self.status = bool(returncode == 0) and not timed_out
+        self.returncode = returncode
+
+    def _tmp_variables(self) -> Dict[str, str]:
+        """Get the environment variables pointing the tests to ``tmp_dir``.
+
+        Returns
+        -------
+        Dict[str, str]
+            ``TMPDIR``, ``TEMP`` and ``TMP``, or nothing if there is no ``tmp_dir``.
+        """
+        if self.tmp_dir is None:
+            return {}
+
+        return dict.fromkeys(("TMPDIR", "TEMP", "TMP"), self.tmp_dir)
+
+    def _open_test_log(self, args: tuple) -> Optional[OutputLog]:
+        """Open the log for the output of the test command.
+
+        Parameters
+        ----------
+        args : tuple
+            Arguments for the test command.
+
+        Returns
+        -------
+        OutputLog
+            The log. ``None`` if output is not logged.
+        """
+        log_file = self._log_file("test")
+        if log_file is None:
+            return None
+        log_file.parent.mkdir(parents=True, exist_ok=True)
+
+        return OutputLog(log_file, args)
+
+    def _report_test_log(self, log: Optional[OutputLog]) -> None:
+        """Point to the log of the test command if the tests failed.
+
+        Parameters
+        ----------
+        log : OutputLog
+            The closed log. Nothing is done if ``None``.
+        """
+        if log is not None and not self.status:
+            LOG.warning(
+                f"The tests for {self.envname} failed. The end of the output is: "
+                f"\n\n {log.tail('output')} \n\n"
+                f"The full output is in {log.path}"
+            )
+
+    def run_tests(
+        self,
+        command: str,
+        cpus: Optional[List[int]] = None,
+        timeout: Optional[float] = None,
+        max_memory: Optional[int] = None,
+    ) -> int:
         """Run the tests in the package directory.
 
         Parameters
         ----------
         command : str
             The test command
+        cpus : list, optional (default None)
+            The IDs of the CPUs to run the tests on. The IDs are exported as
+            ``EDGETEST_CPUS`` and the thread pool sizes in ``THREAD_ENV_VARS`` are set
+            to the number of CPUs. On Linux, the test command is also pinned to them.
+        timeout : float, optional (default None)
+            The number of seconds after which the test command and every process it
+            started are killed.
+        max_memory : int, optional (default None)
+            The maximum address space of each test process in bytes. Only enforced on
+            Linux.
 
         Returns
         -------
         int
             The exit code
+
+        Notes
+        -----
+        If the output is logged, the output of the test command is streamed to
+        ``test.log.gz`` in ``log_dir`` instead of the terminal, so concurrent test
+        commands don't interleave. With the ``snapshot`` option, the tests run in
+        ``snapshot_dir`` with ``TMPDIR`` set to ``tmp_dir``.
         """
         if not self.setup_status:
             raise RuntimeError("Environment setup failed. Cannot run tests.")
-        with pushd(self.package_dir):
-            popen = Popen(
-                (self.python_path, "-m", *shlex.split(command)), universal_newlines=True
+        self._mark_used()
+        args = (self.python_path, "-m", *shlex.split(command))
+        options: Dict[str, Any] = {}
+        log = self._open_test_log(args)
+        if log is not None:
+            options.update(stdout=PIPE, stderr=STDOUT)
+        variables = self._tmp_variables()
+        if cpus:
+            variables["EDGETEST_CPUS"] = ",".join(str(cpu) for cpu in cpus)
+            variables.update({name: str(len(cpus)) for name in THREAD_ENV_VARS})
+        if variables:
+            options["env"] = dict(os.environ, **variables)
+        if timeout is not None:
+            # Kill the whole process group on timeout
+            options["start_new_session"] = True
+        start = time.monotonic()
+        popen = Popen(args, universal_newlines=True, cwd=self.work_dir, **options)
+        if log is not None:
+            log.drain("output", popen.stdout)  # type: ignore
+        if cpus or timeout is not None or max_memory is not None:
+            self._test_limits(
+                popen.pid, cpus=cpus, timeout=timeout, max_memory=max_memory
             )
-            popen.communicate()
+        killed = threading.Event()
+
+        def _kill():
+            killed.set()
+            _kill_process_group(popen.pid)
 
-        self.status = bool(popen.returncode == 0)
+        timer = threading.Timer(timeout, _kill) if timeout is not None else None
+        if timer is not None:
+            timer.start()
+        try:
+            self.peak_memory = _wait_for_process(popen)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if log is not None:
+                log.close()
+        self._add_timing("test", start)
+        self._finish_tests(popen.returncode, timed_out=killed.is_set())
+        self._report_test_log(log)
 
         return popen.returncode
+
+    async def run_tests_async(
+        self,
+        command: str,
+        timeout: Optional[float] = None,
+        max_memory: Optional[int] = None,
+    ) -> int:
+        """Run the tests in the package directory using ``asyncio``.
+
+        Parameters
+        ----------
+        command : str
+            The test command
+        timeout : float, optional (default None)
+            The number of seconds after which the test command and every process it
+            started are killed.
+        max_memory : int, optional (default None)
+            The maximum address space of each test process in bytes. Only enforced on
+            Linux.
+
+        Returns
+        -------
+        int
+            The exit code
+        """
+        if not self.setup_status:
+            raise RuntimeError("Environment setup failed. Cannot run tests.")
+        self._mark_used()
+        args = (self.python_path, "-m", *shlex.split(command))
+        options: Dict[str, Any] = {}
+        log = self._open_test_log(args)
+        if log is not None:
+            options.update(
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+            )
+        variables = self._tmp_variables()
+        if variables:
+            options["env"] = dict(os.environ, **variables)
+        if timeout is not None:
+            options["start_new_session"] = True
+        start = time.monotonic()
+        proc = await asyncio.create_subprocess_exec(*args, cwd=self.work_dir, **options)
+        if timeout is not None or max_memory is not None:
+            self._test_limits(
+                proc.pid, cpus=None, timeout=timeout, max_memory=max_memory
+            )
+        waits = [proc.wait()]
+        if log is not None:
+            waits.append(_drain_async(log, "output", proc.stdout))  # type: ignore
+        timed_out = False
+        try:
+            await asyncio.wait_for(asyncio.gather(*waits), timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            _kill_process_group(proc.pid)
+        finally:
+            if log is not None:
+                log.close()
+        returncode = await proc.wait()
+        self._add_timing("test", start)
+        self._finish_tests(returncode, timed_out=timed_out)
+        self._report_test_log(log)
+
+        return returncode
@@ -0,0 +1,629 @@
+"""Execute the environment set up and tests."""
+
+import asyncio
+import json
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from functools import partial
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+import click
+from pluggy._hooks import _HookRelay
+
+from edgetest.core import (
+    RESULTS_FNAME,
+    WHEELHOUSE_DIRNAME,
+    TestPackage,
+    load_results,
+    new_run_id,
+    resolve_basedir,
+    resolve_envs_dir,
+)
+from edgetest.history import record_run
+from edgetest.logger import get_logger
+from edgetest.schedule import ResourceBudget, schedule_environments
+from edgetest.utils import (
+    ALL_REQUIREMENTS,
+    build_wheel,
+    command_variables,
+    copy_distributions,
+    download_distributions,
+    write_wheelhouse_config,
+)
+
+LOG = get_logger(__name__)
+
+
+def build_wheels(testers: List[TestPackage]) -> None:
+    """Build each local package once and share the wheel between environments.
+
+    If a wheel cannot be built, the environments for that package fall back to
+    installing from the package directory. Wheels are built after the wheelhouse is
+    filled, so the build requirements are installed from it too.
+
+    Parameters
+    ----------
+    testers : list
+        The ``TestPackage`` objects, one per environment.
+
+    Returns
+    -------
+    None
+    """
+    wheels: Dict[str, Optional[str]] = {}
+    for tester in testers:
+        if tester.package_dir not in wheels:
+            try:
+                with command_variables(tester._index_variables()):
+                    wheels[tester.package_dir] = build_wheel(
+                        package_dir=tester.package_dir,
+                        outdir=tester.basedir / "wheels",
+                        exclude_dirs=tester.own_dirs,
+                    )
+            except RuntimeError:
+                LOG.exception(
+                    "Unable to build a wheel for %s. Installing from the directory.",
+                    tester.package_dir,
+                )
+                wheels[tester.package_dir] = None
+        tester.wheel = wheels[tester.package_dir]
+
+
+def use_wheelhouse(conf: Dict) -> bool:
+    """Check whether or not to install the environments from a wheelhouse.
+
+    Parameters
+    ----------
+    conf : dict
+        The validated configuration dictionary.
+
+    Returns
+    -------
+    bool
+        Whether the ``wheelhouse``, ``find_links`` or ``offline`` option is used.
+    """
+    return bool(conf.get("wheelhouse") or conf.get("find_links") or conf.get("offline"))
+
+
+def prefetch_wheelhouse(
+    testers: List[TestPackage], envs: List[Dict], conf: Dict
+) -> None:
+    """Fill a shared wheelhouse once and install every environment offline from it.
+
+    The distributions are copied from the ``find_links`` directory, if provided. Then,
+    unless the ``offline`` option is used, every distribution any environment needs
+    is resolved and downloaded in a single pass for each python version. If the
+    wheelhouse cannot be filled, the environments install from the package index
+    instead. With the ``offline`` option, they always install from the wheelhouse.
+
+    Parameters
+    ----------
+    testers : list
+        The ``TestPackage`` objects, one per environment.
+    envs : list
+        The environment configurations, in the same order as ``testers``.
+    conf : dict
+        The validated configuration dictionary.
+
+    Returns
+    -------
+    None
+    """
+    if not testers:
+        return
+    wheelhouse = testers[0].basedir / WHEELHOUSE_DIRNAME
+    try:
+        if conf.get("find_links"):
+            copy_distributions(conf["find_links"], wheelhouse)
+        if not conf.get("offline"):
+            pins: Dict[Optional[str], Set[str]] = {}
+            for tester, env in zip(testers, envs):
+                pins.setdefault(env.get("python_version"), set()).update(
+                    tester.pinned_requirements(**env)
+                )
+            for python_version, requirements in pins.items():
+                download_distributions(
+                    sorted(requirements), wheelhouse, python_version=python_version
+                )
+    except (RuntimeError, OSError):
+        if not conf.get("offline"):
+            LOG.exception(
+                "Unable to fill the wheelhouse %s. Installing from the package index.",
+                wheelhouse,
+            )
+            return
+        LOG.exception("Unable to fill the wheelhouse %s", wheelhouse)
+    write_wheelhouse_config(wheelhouse)
+    for tester in testers:
+        tester.wheelhouse = str(wheelhouse)
+
+
+def record_results(testers: List[TestPackage]) -> None:
+    """Record the test results for the ``incremental`` option.
+
+    Only environments which were set up and tested in this run are recorded, so a
+    set up failure is always retried in the next run.
+
+    Parameters
+    ----------
+    testers : list
+        The ``TestPackage`` objects, one per environment.
+
+    Returns
+    -------
+    None
+    """
+    updates: Dict[Path, Dict[str, Dict]] = {}
+    for tester in testers:
+        if tester.incremental_key is None or tester.cached or not tester.setup_status:
+            continue
+        updates.setdefault(tester.basedir, {})[tester.envname] = {
+            "key": tester.incremental_key,
+            "status": tester.status,
+            "upgraded": tester.upgraded_packages(),
+        }
+    for basedir, records in updates.items():
+        results = load_results(basedir)
+        results.update(records)
+        (basedir / RESULTS_FNAME).write_text(json.dumps(results, indent=2))
+
+
+def _setup_stage(tester: TestPackage, env: Dict, nosetup: bool = False) -> TestPackage:
+    """Set up a single environment.
+
+    Parameters
+    ----------
+    tester : TestPackage
+        The ``TestPackage`` object for the environment.
+    env : dict
+        The validated configuration for the environment.
+    nosetup : bool, optional (default False)
+        Whether or not to use an existing environment instead of creating one.
+
+    Returns
+    -------
+    TestPackage
+        The ``TestPackage`` object after set up.
+    """
+    if nosetup:
+        click.echo(f"Using existing environment for {env['name']}...")
+        tester.setup(skip=True, **env)
+    else:
+        tester.setup(**env)
+
+    return tester
+
+
+def _test_limits(env: Dict) -> Dict:
+    """Get the configured limits for the test command of an environment.
+
+    Parameters
+    ----------
+    env : dict
+        The validated configuration for the environment.
+
+    Returns
+    -------
+    Dict
+        The ``timeout`` and ``max_memory`` arguments for ``TestPackage.run_tests``,
+        if set.
+    """
+    return {
+        key: env[key] for key in ("timeout", "max_memory") if env.get(key) is not None
+    }
+
+
+def _test_stage(
+    tester: TestPackage,
+    env: Dict,
+    notest: bool = False,
+    budget: Optional[ResourceBudget] = None,
+) -> TestPackage:
+    """Run the test command for a single environment.
+
+    With the ``cleanup`` option, the environment is removed afterwards.
+
+    Parameters
+    ----------
+    tester : TestPackage
+        The ``TestPackage`` object for the environment.
+    env : dict
+        The validated configuration for the environment.
+    notest : bool, optional (default False)
+        Whether or not to skip the test command.
+    budget : ResourceBudget, optional (default None)
+        The resources to wait for before running the test command.
+
+    Returns
+    -------
+    TestPackage
+        The ``TestPackage`` object after testing.
+    """
+    if tester.cached:
+        click.echo(f"Using the previous result for {env['name']}")
+    elif notest or not tester.setup_status:
+        click.echo(f"Skipping tests for {env['name']}")
+    elif budget is None:
+        tester.run_tests(env["command"], **_test_limits(env))
+    else:
+        with budget.admit(env["name"]) as cpus:
+            limits = _test_limits(env)
+            if budget.pin:
+                limits["cpus"] = cpus
+            tester.run_tests(env["command"], **limits)
+    if env.get("cleanup"):
+        tester.cleanup()
+
+    return tester
+
+
+def run_environment(
+    tester: TestPackage, env: Dict, nosetup: bool = False, notest: bool = False
+) -> TestPackage:
+    """Set up and test a single environment.
+
+    Parameters
+    ----------
+    tester : TestPackage
+        The ``TestPackage`` object for the environment.
+    env : dict
+        The validated configuration for the environment.
+    nosetup : bool, optional (default False)
+        Whether or not to use an existing environment instead of creating one.
+    notest : bool, optional (default False)
+        Whether or not to skip the test command.
+
+    Returns
+    -------
+    TestPackage
+        The ``TestPackage`` object after set up and testing.
+    """
+    _setup_stage(tester=tester, env=env, nosetup=nosetup)
+
+    return _test_stage(tester=tester, env=env, notest=notest)
+
+
+def run_environments(
+    testers: List[TestPackage],
+    envs: List[Dict],
+    jobs: int = 1,
+    nosetup: bool = False,
+    notest: bool = False,
+    setup_jobs: Optional[int] = None,
+    test_jobs: Optional[int] = None,
+    order: Optional[List[int]] = None,
+    budget: Optional[ResourceBudget] = None,
+) -> List[TestPackage]:
+    """Set up and test environments through a two-stage pipeline.
+
+    Environments are set up in one pool of worker threads. As soon as an environment
+    is ready, its tests are submitted to a second pool. Setting up an environment mostly
+    waits on the network and disk while the tests mostly use the CPU, so the next
+    environment installs while the previous one is being tested.
+
+    Parameters
+    ----------
+    testers : list
+        The ``TestPackage`` objects, one per environment.
+    envs : list
+        The validated environment configurations, in the same order as ``testers``.
+    jobs : int, optional (default 1)
+        The default size of both the set up and test pools.
+    nosetup : bool, optional (default False)
+        Whether or not to use existing environments instead of creating them.
+    notest : bool, optional (default False)
+        Whether or not to skip the test command.
+    setup_jobs : int, optional (default None)
+        The maximum number of environments to set up at the same time. Defaults to
+        ``jobs``.
+    test_jobs : int, optional (default None)
+        The maximum number of test commands to run at the same time. Defaults to
+        ``jobs``.
+    order : list, optional (default None)
+        The indices of the environments in the order to start them, from
+        ``edgetest.schedule.schedule_environments``. Defaults to configuration order.
+    budget : ResourceBudget, optional (default None)
+        The CPUs and memory to share between the test commands. If provided, the
+        test pool defaults to one worker per CPU and each test command waits until
+        its environment fits in the remaining budget.
+
+    Returns
+    -------
+    List[TestPackage]
+        The ``TestPackage`` objects in configuration order.
+    """
+    if order is None:
+        order = list(range(len(testers)))
+    setup_jobs = setup_jobs or jobs
+    test_jobs = test_jobs or (budget.cpus if budget is not None else jobs)
+    LOG.info(
+        f"Running {len(envs)} environment(s) with {setup_jobs} set up worker(s) "
+        f"and {test_jobs} test worker(s)"
+    )
+    setup_pool = ThreadPoolExecutor(
+        max_workers=setup_jobs, thread_name_prefix="edgetest-setup"
+    )
+    test_pool = ThreadPoolExecutor(
+        max_workers=test_jobs, thread_name_prefix="edgetest-test"
+    )
+    with test_pool:
+        with setup_pool:
+            setups: Dict[Future, int] = {
+                setup_pool.submit(_setup_stage, testers[idx], envs[idx], nosetup): idx
+                for idx in order
+            }
+            # Hand each environment to the test pool as soon as it is ready
+            tests: List[Future] = []
+            for future in as_completed(setups):
+                tests.append(
+                    test_pool.submit(
+                        _test_stage,
+                        future.result(),
+                        envs[setups[future]],
+                        notest,
+                        budget,
+                    )
+                )
+        for future in tests:
+            future.result()
+    if not notest:
+        record_results(testers)
+
+    return testers
+
+
+def _covered_by_search(env: Dict, root: Dict) -> bool:
+    """Check if the adaptive search tests the same thing as an environment.
+
+    Parameters
+    ----------
+    env : dict
+        The validated environment configuration.
+    root : dict
+        The validated ``all-requirements`` environment configuration.
+
+    Returns
+    -------
+    bool
+        Whether or not the environment only upgrades one of the requirements of
+        ``all-requirements``, with the same options, like the environments generated
+        for each requirement.
+    """
+    upgrade = env.get("upgrade") or []
+    options = {
+        key: value for key, value in env.items() if key not in ("name", "upgrade")
+    }
+    root_options = {
+        key: value for key, value in root.items() if key not in ("name", "upgrade")
+    }
+
+    return (
+        len(upgrade) == 1
+        and upgrade[0] in (root.get("upgrade") or [])
+        and options == root_options
+    )
+
+
+def run_adaptive(
+    hook: _HookRelay, conf: Dict, nosetup: bool = False
+) -> Tuple[List[TestPackage], List[List[str]]]:
+    """Find the upgrades which fail the tests through adaptive group testing.
+
+    The ``all-requirements`` environment is tested first. If it passes, no other
+    environment is created for the search. Otherwise, the upgrades are split in half
+    and each half is tested, recursively, until the failing upgrades are isolated. If
+    both halves pass, the failure comes from upgrades in different halves, so each
+    half is searched while the other half is upgraded to find the interacting
+    packages. The other configured environments, e.g. with ``lower``, are set up and
+    tested alongside ``all-requirements``, except for the environments which only
+    upgrade a single requirement, which the search already covers.
+
+    Parameters
+    ----------
+    hook : _HookRelay
+        The hook object from ``pluggy``.
+    conf : dict
+        The validated configuration dictionary. Must contain the ``all-requirements``
+        environment.
+    nosetup : bool, optional (default False)
+        Whether or not to use existing environments instead of creating them.
+
+    Returns
+    -------
+    List[TestPackage]
+        The ``TestPackage`` objects for every environment tested: the other
+        configured environments, then the search, with the ``all-requirements``
+        environment last.
+    List[List[str]]
+        The failing upgrades. Each entry is either a single package or a group of
+        packages which only fail together.
+    """
+    root = next(env for env in conf["envs"] if env["name"] == ALL_REQUIREMENTS)
+    others = [
+        env
+        for env in conf["envs"]
+        if env["name"] != ALL_REQUIREMENTS and not _covered_by_search(env, root)
+    ]
+    skipped = len(conf["envs"]) - len(others) - 1
+    if skipped:
+        LOG.info(
+            f"Skipping {skipped} single upgrade environment(s) covered by the search"
+        )
+    results: Dict[FrozenSet[str], TestPackage] = {}
+    extra: List[TestPackage] = []
+    run_id = new_run_id()
+    basedir = resolve_basedir(conf.get("basedir"))
+    envs_dir = resolve_envs_dir(conf.get("envs_dir"), basedir=basedir)
+
+    def _test(groups: List[List[str]]) -> List[bool]:
+        envs: List[Dict] = []
+        for group in groups:
+            if frozenset(group) in results or any(
+                set(env["upgrade"]) == set(group) for env in envs
+            ):
+                continue
+            if not results:
+                name = ALL_REQUIREMENTS
+            elif len(group) == 1:
+                name = group[0]
+            else:
+                name = f"group-{len(results) + len(envs)}"
+            envs.append(dict(root, name=name, upgrade=group))
+        searched = len(envs)
+        if not results:
+            # Run the other environments with the first round of the search
+            envs += others
+        testers = [
+            TestPackage(
+                hook=hook,
+                envname=env["name"],
+                upgrade=env.get("upgrade"),
+                lower=env.get("lower"),
+                package_dir=env["package_dir"],
+                run_id=run_id,
+                basedir=basedir,
+                envs_dir=envs_dir,
+            )
+            for env in envs
+        ]
+        if use_wheelhouse(conf) and not nosetup:
+            prefetch_wheelhouse(testers, envs=envs, conf=conf)
+        if conf.get("build_wheel") and not nosetup:
+            build_wheels(testers)
+        run_environments(
+            testers=testers,
+            envs=envs,
+            jobs=conf.get("jobs") or 1,
+            nosetup=nosetup,
+            setup_jobs=conf.get("setup_jobs"),
+            test_jobs=conf.get("test_jobs"),
+        )
+        for tester in testers[:searched]:
+            results[frozenset(tester.upgrade or [])] = tester
+        extra.extend(testers[searched:])
+
+        return [results[frozenset(group)].status for group in groups]
+
+    def _isolate(group: List[str], context: List[str]) -> List[List[str]]:
+        # ``group`` fails when upgraded alongside ``context``, while ``context`` passes
+        if len(group) == 1:
+            return [group]
+        left, right = group[: len(group) // 2], group[len(group) // 2 :]
+        left_passed, right_passed = _test([left + context, right + context])
+        culprits: List[List[str]] = []
+        if not left_passed:
+            culprits += _isolate(left, context)
+        if not right_passed:
+            culprits += _isolate(right, context)
+        if left_passed and right_passed:
+            # Only fails with upgrades from both halves
+            for found in _isolate(left, context + right):
+                for other in _isolate(right, context + found):
+                    culprits.append(found + other)
+
+        return culprits
+
+    upgrade = list(root["upgrade"])
+    culprits = [] if _test([upgrade])[0] else _isolate(upgrade, [])
+    LOG.info(f"Tested {len(results)} environment(s) for {len(upgrade)} requirement(s)")
+    testers = list(results.values())
+
+    return extra + testers[1:] + testers[:1], culprits
+
+
+async def run_async(
+    conf: Dict,
+    hook: Optional[_HookRelay] = None,
+    nosetup: bool = False,
+    notest: bool = False,
+) -> List[TestPackage]:
+    """Set up and test environments concurrently on the running event loop.
+
+    This is the ``asyncio`` counterpart to the ``edgetest`` CLI for orchestrators
+    that manage their own event loop. The ``jobs``, ``setup_jobs`` and ``test_jobs``
+    options limit the number of concurrent set up and test stages, the ``schedule``
+    option orders them, the ``build_wheel`` option builds the local package once
+    before set up and the ``wheelhouse`` option prefetches every distribution once
+    before set up.
+
+    Parameters
+    ----------
+    conf : dict
+        The validated configuration dictionary.
+    hook : _HookRelay, optional (default None)
+        The hook object from ``pluggy``. Defaults to the hooks of the installed
+        plugins.
+    nosetup : bool, optional (default False)
+        Whether or not to use existing environments instead of creating them.
+    notest : bool, optional (default False)
+        Whether or not to skip the test command.
+
+    Returns
+    -------
+    List[TestPackage]
+        The ``TestPackage`` objects in configuration order.
+
+    Examples
+    --------
+    >>> testers = await edgetest.run_async(conf)
+    """
+    if hook is None:
+        # Avoid a circular import with the CLI
+        from edgetest.interface import get_plugin_manager
+
+        hook = get_plugin_manager().hook
+    jobs = conf.get("jobs") or 1
+    setup_slots = asyncio.Semaphore(conf.get("setup_jobs") or jobs)
+    test_slots = asyncio.Semaphore(conf.get("test_jobs") or jobs)
+
+    async def _run(tester: TestPackage, env: Dict) -> TestPackage:
+        async with setup_slots:
+            await tester.setup_async(skip=nosetup, **env)
+        if tester.cached:
+            LOG.info(f"Using the previous result for {env['name']}")
+        elif notest or not tester.setup_status:
+            LOG.info(f"Skipping tests for {env['name']}")
+        else:
+            async with test_slots:
+                await tester.run_tests_async(env["command"], **_test_limits(env))
+        if env.get("cleanup"):
+            await asyncio.get_running_loop().run_in_executor(None, tester.cleanup)
+
+        return tester
+
+    hook.pre_run_hook(conf=conf)
+    run_id = new_run_id()
+    basedir = resolve_basedir(conf.get("basedir"))
+    envs_dir = resolve_envs_dir(conf.get("envs_dir"), basedir=basedir)
+    testers = [
+        TestPackage(
+            hook=hook,
+            envname=env["name"],
+            upgrade=env.get("upgrade"),
+            lower=env.get("lower"),
+            package_dir=env["package_dir"],
+            run_id=run_id,
+            basedir=basedir,
+            envs_dir=envs_dir,
+        )
+        for env in conf["envs"]
+    ]
+    if use_wheelhouse(conf) and not nosetup:
+        await asyncio.get_running_loop().run_in_executor(
+            None, partial(prefetch_wheelhouse, testers, envs=conf["envs"], conf=conf)
+        )
+    if conf.get("build_wheel") and not nosetup:
+        await asyncio.get_running_loop().run_in_executor(None, build_wheels, testers)
+    order: List[int] = []
+    if testers:
+        order = schedule_environments(
+            hook=hook, envs=conf["envs"], conf=conf, basedir=basedir
+        )
+    await asyncio.gather(*(_run(testers[idx], conf["envs"][idx]) for idx in order))
+    if not notest:
+        await asyncio.get_running_loop().run_in_executor(None, record_results, testers)
+    if not (nosetup and notest):
+        await asyncio.get_running_loop().run_in_executor(None, record_run, testers)
+    hook.post_run_hook(testers=testers, conf=conf)
+
+    return testers
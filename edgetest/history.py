@@ -0,0 +1,266 @@
+"""Record the results of each run and summarize them."""
+
+import json
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from tabulate import tabulate
+
+from edgetest.core import TestPackage
+from edgetest.logger import get_logger
+
+LOG = get_logger(__name__)
+
+HISTORY_FNAME = "history.db"
+# The number of most recent runs used for the pass rate trend
+RECENT_RUNS = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    envname TEXT NOT NULL,
+    setup_status INTEGER NOT NULL,
+    status INTEGER NOT NULL,
+    returncode INTEGER,
+    cached INTEGER NOT NULL,
+    setup_time REAL,
+    test_time REAL,
+    timings TEXT NOT NULL,
+    peak_memory INTEGER
+);
+CREATE TABLE IF NOT EXISTS versions (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    envname TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_envname ON results (envname);
+"""
+
+
+def _connect(basedir: Path) -> sqlite3.Connection:
+    """Connect to the history database, creating it if necessary.
+
+    Parameters
+    ----------
+    basedir : Path
+        The base directory for the environments.
+
+    Returns
+    -------
+    sqlite3.Connection
+        The connection.
+    """
+    basedir.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(basedir / HISTORY_FNAME))
+    conn.executescript(SCHEMA)
+    # Databases written before the peak memory was recorded
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(results)")]
+    if "peak_memory" not in columns:
+        conn.execute("ALTER TABLE results ADD COLUMN peak_memory INTEGER")
+
+    return conn
+
+
+def record_run(testers: List[TestPackage]) -> Optional[int]:
+    """Append the results of a run to the history database.
+
+    The status, phase durations, peak memory usage of the test command and upgraded
+    or lowered package versions of each environment are stored in ``history.db`` under the base directory.
+
+    Parameters
+    ----------
+    testers : list
+        The ``TestPackage`` objects for the run.
+
+    Returns
+    -------
+    int
+        The ID of the run. ``None`` if there are no environments to record.
+    """
+    if not testers:
+        return None
+    with closing(_connect(testers[0].basedir)) as conn, conn:
+        run_id = conn.execute(
+            "INSERT INTO runs (timestamp) VALUES (?)", (time.time(),)
+        ).lastrowid
+        for tester in testers:
+            setup_time = sum(
+                duration
+                for phase, duration in tester.timings.items()
+                if phase != "test"
+            )
+            conn.execute(
+                "INSERT INTO results (run_id, envname, setup_status, status, returncode, "
+                "cached, setup_time, test_time, timings, peak_memory) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    run_id,
+                    tester.envname,
+                    tester.setup_status,
+                    tester.status,
+                    tester.returncode,
+                    tester.cached,
+                    setup_time if tester.timings else None,
+                    tester.timings.get("test"),
+                    json.dumps(tester.timings),
+                    tester.peak_memory,
+                ),
+            )
+            if not tester.setup_status:
+                continue
+            try:
+                versions = [
+                    (run_id, tester.envname, kind, pkg["name"], pkg["version"])
+                    for kind, packages in (
+                        ("upgraded", tester.upgraded_packages()),
+                        ("lowered", tester.lowered_packages()),
+                    )
+                    for pkg in packages
+                ]
+            except RuntimeError:
+                LOG.warning(f"Unable to record the versions for {tester.envname}")
+                continue
+            conn.executemany("INSERT INTO versions VALUES (?, ?, ?, ?, ?)", versions)
+    LOG.info(f"Recorded run {run_id} in {testers[0].basedir / HISTORY_FNAME}")
+
+    return run_id
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    """Get a percentile with linear interpolation.
+
+    Parameters
+    ----------
+    values : list
+        The values.
+    pct : float
+        The percentile, between 0 and 100.
+
+    Returns
+    -------
+    float
+        The percentile. ``None`` if there are no values.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def env_stats(basedir: Path) -> List[Dict]:
+    """Summarize the recorded runs for each environment.
+
+    Results reused by the ``incremental`` option are excluded from the durations.
+
+    Parameters
+    ----------
+    basedir : Path
+        The base directory for the environments.
+
+    Returns
+    -------
+    List[Dict]
+        One dictionary per environment with the number of runs, the p50 and p95 set
+        up and test durations in seconds, the p95 peak memory usage of the tests in
+        bytes, the overall pass rate and the pass rate over the most recent runs,
+        sorted from slowest to fastest median total duration.
+    """
+    if not (basedir / HISTORY_FNAME).is_file():
+        return []
+    with closing(_connect(basedir)) as conn:
+        rows = conn.execute(
+            "SELECT envname, status, cached, setup_time, test_time, peak_memory "
+            "FROM results ORDER BY run_id"
+        ).fetchall()
+    history: Dict[str, List] = {}
+    for envname, *run in rows:
+        history.setdefault(envname, []).append(run)
+    stats = []
+    for envname, runs in history.items():
+        setup_times = [run[2] for run in runs if not run[1] and run[2] is not None]
+        test_times = [run[3] for run in runs if not run[1] and run[3] is not None]
+        memory = [run[4] for run in runs if not run[1] and run[4] is not None]
+        recent = runs[-RECENT_RUNS:]
+        stats.append(
+            {
+                "name": envname,
+                "runs": len(runs),
+                "setup_p50": _percentile(setup_times, 50),
+                "setup_p95": _percentile(setup_times, 95),
+                "test_p50": _percentile(test_times, 50),
+                "test_p95": _percentile(test_times, 95),
+                "memory_p95": _percentile(memory, 95),
+                "pass_rate": sum(run[0] for run in runs) / len(runs),
+                "recent_pass_rate": sum(run[0] for run in recent) / len(recent),
+            }
+        )
+
+    return sorted(
+        stats,
+        key=lambda env: (env["setup_p50"] or 0.0) + (env["test_p50"] or 0.0),
+        reverse=True,
+    )
+
+
+def gen_stats_report(basedir: Path, output_type: str = "rst") -> str:
+    """Generate a report of the recorded runs for each environment.
+
+    Parameters
+    ----------
+    basedir : Path
+        The base directory for the environments.
+    output_type : str, optional (default "rst")
+        A valid output type for ``tabulate``.
+
+    Returns
+    -------
+    str
+        The report, with the slowest environments first.
+    """
+    headers = [
+        "Environment",
+        "Runs",
+        "Setup p50 (s)",
+        "Setup p95 (s)",
+        "Test p50 (s)",
+        "Test p95 (s)",
+        "Memory p95 (MB)",
+        "Pass rate",
+        f"Pass rate (last {RECENT_RUNS})",
+    ]
+
+    def _seconds(value: Optional[float]) -> str:
+        return "" if value is None else f"{value:.1f}"
+
+    def _megabytes(value: Optional[float]) -> str:
+        return "" if value is None else f"{value / 1024**2:.0f}"
+
+    rows = [
+        [
+            env["name"],
+            str(env["runs"]),
+            _seconds(env["setup_p50"]),
+            _seconds(env["setup_p95"]),
+            _seconds(env["test_p50"]),
+            _seconds(env["test_p95"]),
+            _megabytes(env["memory_p95"]),
+            f"{env['pass_rate']:.0%}",
+            f"{env['recent_pass_rate']:.0%}",
+        ]
+        for env in env_stats(basedir)
+    ]
+
+    return tabulate(rows, headers=headers, tablefmt=output_type, disable_numparse=True)
@@ -1,6 +1,6 @@
 """Hook specifications for edgetest."""
 
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 import pluggy
 
@@ -114,6 +114,80 @@ def run_install_lower(basedir: str, envname: str, lower: Dict[str, str], conf: D
     """
 
 
+@hookspec(firstresult=True)
+def run_install(
+    basedir: str,
+    envname: str,
+    requirements: List[str],
+    upgrade: Optional[List[str]],
+    lower: Optional[List[str]],
+    conf: Dict,
+    cwd: str,
+) -> Optional[bool]:
+    """Install the local package, dependencies and upgrades in a single resolution.
+
+    Only used with the ``combined_install`` option. Packages in ``upgrade`` should
+    resolve to their latest release, ignoring the constraints of the local package,
+    while the pinned versions in ``lower`` should be installed as-is.
+
+    Parameters
+    ----------
+    basedir : str
+        The base directory location for the environment.
+    envname : str
+        The name of the virtual environment.
+    requirements : list
+        The arguments for installing the local package and any additional
+        dependencies.
+    upgrade : list
+        The list of packages to upgrade. ``None`` if installing lower bounds.
+    lower : list
+        The lower bounds of packages to install. ``None`` if upgrading.
+    conf : dict
+        The configuration dictionary for the environment.
+    cwd : str
+        The directory to install from. ``requirements`` can be relative to it.
+
+    Returns
+    -------
+    bool
+        ``True`` if the environment was installed. If no plugin installs the
+        environment, ``edgetest`` falls back to
+        :py:meth:`edgetest.hookspecs.run_update` or
+        :py:meth:`edgetest.hookspecs.run_install_lower`. This is always the case for
+        plugins which implement those hooks but not this one.
+
+    Raises
+    ------
+    RuntimeError
+        Error raised if the packages cannot be installed.
+    """
+
+
+@hookspec(firstresult=True)
+def order_environments(
+    envs: List[Dict], conf: Dict, durations: Dict[str, float]
+) -> Optional[List[str]]:
+    """Choose the order to set up and test the environments in.
+
+    Parameters
+    ----------
+    envs : list
+        The validated environment configurations.
+    conf : dict
+        The entire configuration dictionary.
+    durations : dict
+        The estimated duration of each environment in seconds, based on the run
+        history.
+
+    Returns
+    -------
+    list
+        The environment names in the order to run them. Return ``None`` to use the
+        ``schedule`` option instead.
+    """
+
+
 @hookspec
 def post_run_hook(testers: List, conf: Dict):
     """Post testing hook.
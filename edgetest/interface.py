@@ -1,20 +1,43 @@
 """Command-line interface."""
 
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
 import click
 import pluggy
 from tomlkit import dumps
 
 from edgetest import hookspecs, lib
-from edgetest.core import TestPackage
+from edgetest.cleanup import collect_garbage, gen_gc_report
+from edgetest.core import (
+    TestPackage,
+    new_run_id,
+    resolve_basedir,
+    resolve_envs_dir,
+)
+from edgetest.executor import (
+    build_wheels,
+    prefetch_wheelhouse,
+    run_adaptive,
+    run_environments,
+    use_wheelhouse,
+)
+from edgetest.history import gen_stats_report, record_run
 from edgetest.logger import get_logger
-from edgetest.report import gen_report
+from edgetest.report import VALID_REPORT_FILES, gen_report, write_report_file
+from edgetest.schedule import (
+    SCHEDULES,
+    ResourceBudget,
+    resource_budget,
+    schedule_environments,
+)
 from edgetest.schema import EdgetestValidator, Schema
 from edgetest.utils import (
+    ALL_REQUIREMENTS,
+    _lift_global_options,
     gen_requirements_config,
     parse_cfg,
+    parse_memory,
     parse_toml,
     upgrade_pyproject_toml,
     upgrade_requirements,
@@ -42,7 +65,8 @@ def get_plugin_manager() -> pluggy.PluginManager:
     return pm
 
 
-@click.command()
+@click.group(invoke_without_command=True)
+@click.pass_context
 @click.option(
     "--config",
     "-c",
@@ -99,7 +123,89 @@ def get_plugin_manager() -> pluggy.PluginManager:
     is_flag=True,
     help="Whether or not to export the updated requirements file. Overwrites input requirements.",
 )
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=None,
+    help="The number of environments to set up and test at the same time.",
+)
+@click.option(
+    "--setup-jobs",
+    type=click.IntRange(min=1),
+    default=None,
+    help="The number of environments to set up at the same time. Defaults to ``--jobs``.",
+)
+@click.option(
+    "--test-jobs",
+    type=click.IntRange(min=1),
+    default=None,
+    help="The number of test commands to run at the same time. Defaults to ``--jobs``.",
+)
+@click.option(
+    "--schedule",
+    type=click.Choice(SCHEDULES),
+    default=None,
+    help="The order to run the environments in: configuration order, longest first (``ljf``) or most recently failing first (``fail-fast-first``).",
+)
+@click.option(
+    "--admission",
+    is_flag=True,
+    help="Whether or not to run test commands whenever their CPUs and memory fit on this machine instead of a fixed number at a time.",
+)
+@click.option(
+    "--pin-cpus",
+    is_flag=True,
+    help="Whether or not to run each test command on its own set of CPUs.",
+)
+@click.option(
+    "--cache",
+    is_flag=True,
+    help="Whether or not to reuse environments with the same dependency fingerprint.",
+)
+@click.option(
+    "--report-file",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Path to write the results to, as JSON (``.json``) or JUnit XML (``.xml``).",
+)
+@click.option(
+    "--timings",
+    is_flag=True,
+    help="Whether or not to add the duration of each set up and test phase to the report.",
+)
+@click.option(
+    "--adaptive",
+    is_flag=True,
+    help="Whether or not to isolate failing upgrades by splitting ``all-requirements`` instead of testing each requirement.",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Whether or not to reuse the previous result if the dependencies and source have not changed.",
+)
+@click.option(
+    "--from-lock",
+    is_flag=True,
+    help="Whether or not to rebuild environments from their lockfiles if they are up to date.",
+)
+@click.option(
+    "--combined-install",
+    is_flag=True,
+    help="Whether or not to install all packages in each environment in a single resolution.",
+)
+@click.option(
+    "--build-wheel",
+    is_flag=True,
+    help="Whether or not to build the local package once and install the wheel in each environment.",
+)
+@click.option(
+    "--offline",
+    is_flag=True,
+    help="Whether or not to install every environment from the wheelhouse without network access.",
+)
 def cli(
+    ctx,
     config,
     requirements,
     environment,
@@ -109,12 +215,33 @@ def cli(
     deps,
     command,
     export,
+    jobs,
+    setup_jobs,
+    test_jobs,
+    schedule,
+    admission,
+    pin_cpus,
+    cache,
+    report_file,
+    timings,
+    adaptive,
+    incremental,
+    from_lock,
+    combined_install,
+    build_wheel,
+    offline,
 ):
     """Create the environments and test.
 
     If you do not supply a configuration file, this package will search for a
     ``requirements.txt`` file and create a conda environment for each package in that file.
     """
+    if ctx.invoked_subcommand is not None:
+        return
+    if report_file and Path(report_file).suffix.lower() not in VALID_REPORT_FILES:
+        raise ValueError(
+            f"Invalid report file: {report_file}. Use one of {VALID_REPORT_FILES}."
+        )
     # Get the hooks
     pm = get_plugin_manager()
     if config and Path(config).suffix == ".cfg":
@@ -133,42 +260,112 @@ def cli(
     # Validate the configuration file
     docstructure = Schema()
     pm.hook.addoption(schema=docstructure)
+    conf = _lift_global_options(conf=conf, schema=docstructure.schema)
     validator = EdgetestValidator(schema=docstructure.schema)
     if not validator.validate(conf):
         click.echo(f"Unable to validate configuration file. Error: {validator.errors}")
         raise ValueError("Unable to validate configuration file.")
     conf = validator.document
+    if jobs:
+        conf["jobs"] = jobs
+    if setup_jobs:
+        conf["setup_jobs"] = setup_jobs
+    if test_jobs:
+        conf["test_jobs"] = test_jobs
+    if schedule:
+        conf["schedule"] = schedule
+
+    if build_wheel:
+        conf["build_wheel"] = True
+    if offline:
+        conf["offline"] = True
+    if adaptive:
+        conf["adaptive"] = True
+    if admission:
+        conf["admission"] = True
+    if pin_cpus:
+        conf["pin_cpus"] = True
+    if cache:
+        for env in conf["envs"]:
+            env["cache"] = True
+    if incremental:
+        for env in conf["envs"]:
+            env["incremental"] = True
+    if from_lock:
+        for env in conf["envs"]:
+            env["from_lock"] = True
+    if combined_install:
+        for env in conf["envs"]:
+            env["combined_install"] = True
 
     if environment:
         conf["envs"] = [env for env in conf["envs"] if env["name"] == environment]
 
+    # Resolve the directories once for the whole run
+    basedir = resolve_basedir(conf["basedir"])
+    envs_dir = resolve_envs_dir(conf["envs_dir"], basedir=basedir)
+    conf["basedir"], conf["envs_dir"] = str(basedir), str(envs_dir)
+
     # Run the pre-test hook
     pm.hook.pre_run_hook(conf=conf)
-    testers: List[TestPackage] = []
-    for env in conf["envs"]:
-        testers.append(
+    culprits: Optional[List[List[str]]] = None
+    if conf["adaptive"] and not notest:
+        if any(env["name"] == ALL_REQUIREMENTS for env in conf["envs"]):
+            testers, culprits = run_adaptive(hook=pm.hook, conf=conf, nosetup=nosetup)
+        else:
+            click.echo(
+                f"No ``{ALL_REQUIREMENTS}`` environment to test adaptively. "
+                "Testing every environment."
+            )
+    if culprits is None:
+        run_id = new_run_id()
+        testers = [
             TestPackage(
                 hook=pm.hook,
                 envname=env["name"],
                 upgrade=env.get("upgrade"),
                 lower=env.get("lower"),
                 package_dir=env["package_dir"],
+                run_id=run_id,
+                basedir=basedir,
+                envs_dir=envs_dir,
             )
+            for env in conf["envs"]
+        ]
+        if use_wheelhouse(conf) and not nosetup:
+            prefetch_wheelhouse(testers, envs=conf["envs"], conf=conf)
+        if conf["build_wheel"] and not nosetup:
+            build_wheels(testers)
+        order: Optional[List[int]] = None
+        budget: Optional[ResourceBudget] = None
+        if testers:
+            order = schedule_environments(
+                hook=pm.hook, envs=conf["envs"], conf=conf, basedir=basedir
+            )
+            if conf["admission"] or conf["pin_cpus"]:
+                budget = resource_budget(envs=conf["envs"], conf=conf, basedir=basedir)
+        # Set up the test environments and run the tests
+        run_environments(
+            testers=testers,
+            envs=conf["envs"],
+            jobs=conf["jobs"],
+            nosetup=nosetup,
+            notest=notest,
+            setup_jobs=conf["setup_jobs"],
+            test_jobs=conf["test_jobs"],
+            order=order,
+            budget=budget,
         )
-        # Set up the test environment
-        if nosetup:
-            click.echo(f"Using existing environment for {env['name']}...")
-            testers[-1].setup(skip=True, **env)
-        else:
-            testers[-1].setup(**env)
-        # Run the tests
-        if notest or not testers[-1].setup_status:
-            click.echo(f"Skipping tests for {env['name']}")
-        else:
-            testers[-1].run_tests(env["command"])
 
-    report = gen_report(testers)
+    if not (nosetup and notest):
+        record_run(testers)
+    report = gen_report(testers, timings=timings)
     click.echo(f"\n\n{report}")
+    if report_file:
+        write_report_file(testers, filename=report_file)
+    if culprits:
+        failing = ", ".join(" + ".join(group) for group in culprits)
+        click.echo(f"\nThe following upgrades fail the tests: {failing}")
 
     if export and testers[-1].status:
         if config is not None and Path(config).name == "setup.cfg":
@@ -218,3 +415,67 @@ def cli(
 
     # Run the post-test hook
     pm.hook.post_run_hook(testers=testers, conf=conf)
+    if conf["max_disk"] is not None or conf["max_age"] is not None:
+        removed = collect_garbage(
+            basedir,
+            max_disk=conf["max_disk"],
+            max_age=conf["max_age"],
+            envs_dir=envs_dir,
+        )
+        LOG.info(f"Removed {len(removed)} unused entries from {envs_dir}")
+
+
+@cli.command()
+@click.option(
+    "--basedir",
+    default=None,
+    type=click.Path(file_okay=False),
+    help="Path to the base directory with the run history. Defaults to ``EDGETEST_BASEDIR`` or ``.edgetest``.",
+)
+def stats(basedir):
+    """Summarize the durations and pass rates of previous runs."""
+    report = gen_stats_report(resolve_basedir(basedir))
+    click.echo(report)
+
+
+@cli.command()
+@click.option(
+    "--basedir",
+    default=None,
+    type=click.Path(file_okay=False),
+    help="Path to the base directory with the logs. Defaults to ``EDGETEST_BASEDIR`` or ``.edgetest``.",
+)
+@click.option(
+    "--envs-dir",
+    default=None,
+    type=click.Path(file_okay=False),
+    help="Path to the directory with the environments. Defaults to ``EDGETEST_ENVS_DIR`` or the base directory.",
+)
+@click.option(
+    "--max-disk",
+    default=None,
+    help="Maximum disk usage of the environments, e.g. ``20G``. The least recently used are removed.",
+)
+@click.option(
+    "--max-age",
+    default=None,
+    type=click.FloatRange(min=0),
+    help="Number of days after which unused environments are removed.",
+)
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    help="Whether or not to only report the environments which would be removed.",
+)
+def gc(basedir, envs_dir, max_disk, max_age, dry_run):
+    """Remove the least recently used environments from the base directory."""
+    basedir = resolve_basedir(basedir)
+    envs_dir = resolve_envs_dir(envs_dir, basedir=basedir)
+    removed = collect_garbage(
+        basedir,
+        max_disk=None if max_disk is None else parse_memory(max_disk),
+        max_age=max_age,
+        dry_run=dry_run,
+        envs_dir=envs_dir,
+    )
+    click.echo(gen_gc_report(basedir, removed, envs_dir=envs_dir))
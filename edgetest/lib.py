@@ -1,8 +1,11 @@
 """Default virtual environment hook."""
 
+import os
 import platform
+import sys
 from pathlib import Path
-from typing import Dict, List
+from tempfile import TemporaryDirectory
+from typing import Dict, List, Optional
 from venv import EnvBuilder
 
 import pluggy
@@ -21,11 +24,54 @@ def path_to_python(basedir: str, envname: str) -> str:
         return str(Path(basedir) / envname / "bin" / "python")
 
 
+def _create_uv_environment(
+    basedir: str,
+    envname: str,
+    python_version: Optional[str] = None,
+    python_cache: Optional[str] = None,
+):
+    """Create the virtual environment with ``uv venv``.
+
+    Parameters
+    ----------
+    basedir : str
+        The base directory location for the environment.
+    envname : str
+        The name of the virtual environment.
+    python_version : str, optional (default None)
+        The requested interpreter, e.g. ``3.12``. ``uv`` finds a matching interpreter
+        on the machine or downloads a managed one. Defaults to the interpreter running
+        ``edgetest``.
+    python_cache : str, optional (default None)
+        The directory to keep managed interpreters in, so they are downloaded once.
+        Defaults to the ``uv`` default.
+
+    Raises
+    ------
+    RuntimeError
+        Error raised if the environment cannot be created.
+    """
+    env = None
+    if python_cache:
+        env = dict(os.environ, UV_PYTHON_INSTALL_DIR=str(Path(python_cache).resolve()))
+    try:
+        _run_command(
+            "uv",
+            "venv",
+            str(Path(basedir, envname)),
+            f"--python={python_version or sys.executable}",
+            env=env,
+        )
+    except Exception as err:
+        raise RuntimeError(f"Unable to create {envname} in {basedir}") from err
+
+
 @hookimpl(trylast=True)
 def create_environment(basedir: str, envname: str, conf: Dict):
     """Create the virtual environment for testing.
 
-    Creates an environment using ``venv``.
+    Creates an environment using ``venv``, or ``uv venv`` if the ``venv_backend``
+    option is ``uv`` or a ``python_version`` is requested.
 
     Parameters
     ----------
@@ -34,13 +80,23 @@ def create_environment(basedir: str, envname: str, conf: Dict):
     envname : str
         The name of the virtual environment.
     conf : dict
-        Ignored.
+        The configuration dictionary for the environment. ``venv_backend``,
+        ``python_version`` and ``python_cache`` are used.
 
     Raises
     ------
     RuntimeError
         Error raised if the environment cannot be created.
     """
+    conf = conf or {}
+    if conf.get("venv_backend") == "uv" or conf.get("python_version"):
+        _create_uv_environment(
+            basedir,
+            envname,
+            python_version=conf.get("python_version"),
+            python_cache=conf.get("python_cache"),
+        )
+        return
     builder = EnvBuilder(with_pip=False)
     try:
         builder.create(env_dir=Path(basedir, envname))
@@ -99,3 +155,71 @@ def run_install_lower(basedir: str, envname: str, lower: List[str], conf: Dict):
         _run_command("uv", "pip", "install", f"--python={python_path}", *lower)
     except Exception as err:
         raise RuntimeError(f"Unable to pip install: {lower}") from err
+
+
+@hookimpl(trylast=True)
+def run_install(
+    basedir: str,
+    envname: str,
+    requirements: List[str],
+    upgrade: Optional[List[str]],
+    lower: Optional[List[str]],
+    conf: Dict,
+    cwd: str,
+) -> bool:
+    """Install the local package, dependencies and upgrades in a single resolution.
+
+    Packages to upgrade are overridden without a version so they resolve to the
+    latest release, while lower bounds are overridden with their pinned version.
+
+    Parameters
+    ----------
+    basedir : str
+        The base directory location for the environment.
+    envname : str
+        The name of the virtual environment.
+    requirements : list
+        The arguments for installing the local package and any additional
+        dependencies.
+    upgrade : list
+        The list of packages to upgrade. ``None`` if installing lower bounds.
+    lower : list
+        The lower bounds of packages to install. ``None`` if upgrading.
+    conf : dict
+        Ignored.
+    cwd : str
+        The directory to install from.
+
+    Returns
+    -------
+    bool
+        Always ``True``.
+
+    Raises
+    ------
+    RuntimeError
+        Error raised if the packages cannot be installed.
+    """
+    python_path = path_to_python(basedir, envname)
+    overrides = upgrade or lower or []
+    with TemporaryDirectory() as tmpdir:
+        fname = Path(tmpdir, "overrides.txt")
+        fname.write_text("\n".join(overrides) + "\n")
+        try:
+            _run_command(
+                "uv",
+                "pip",
+                "install",
+                f"--python={python_path}",
+                *requirements,
+                *overrides,
+                "--override",
+                str(fname),
+                cwd=cwd,
+            )
+        except Exception as err:
+            raise RuntimeError(
+                f"Unable to pip install: {requirements + overrides}"
+            ) from err
+
+    return True
@@ -1,15 +1,58 @@
-"""Generate rST reports."""
+"""Generate rST and machine-readable reports."""
 
-from typing import Any, List
+import json
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Any, Dict, List, Optional
 
 from tabulate import tabulate
 
-from edgetest.core import TestPackage
+from edgetest.core import PHASES, TestPackage
 
 VALID_OUTPUTS = ["rst", "github"]
+VALID_REPORT_FILES = [".json", ".xml"]
+TIMED_OUT = "Timed out"
 
 
-def gen_report(testers: List[TestPackage], output_type: str = "rst") -> Any:
+def _format_duration(seconds: Optional[float]) -> str:
+    """Format a duration for the report.
+
+    Parameters
+    ----------
+    seconds : float
+        The duration in seconds. ``None`` if the phase did not run.
+
+    Returns
+    -------
+    str
+        The duration with one decimal place, or an empty string.
+    """
+    return "" if seconds is None else f"{seconds:.1f}"
+
+
+def _statuses(env: TestPackage) -> List[Any]:
+    """Get the set up and test status of an environment for the report.
+
+    Parameters
+    ----------
+    env : TestPackage
+        The ``TestPackage`` object.
+
+    Returns
+    -------
+    List[Any]
+        The set up and test status, with ``TIMED_OUT`` for a stage which ran past its
+        timeout.
+    """
+    return [
+        TIMED_OUT if env.timed_out == "setup" else env.setup_status,
+        TIMED_OUT if env.timed_out == "test" else env.status,
+    ]
+
+
+def gen_report(
+    testers: List[TestPackage], output_type: str = "rst", timings: bool = False
+) -> Any:
     """Generate a rST report.
 
     Parameters
@@ -20,6 +63,10 @@ def gen_report(testers: List[TestPackage], output_type: str = "rst") -> Any:
     output_type : str
         A valid output type of ``rst`` or ``github``
 
+    timings : bool, optional (default False)
+        Whether or not to add the duration of each phase in seconds, with a final row
+        totalling them across environments.
+
     Returns
     -------
     Any
@@ -36,31 +83,189 @@ def gen_report(testers: List[TestPackage], output_type: str = "rst") -> Any:
         "Lowered packages",
         "Package version",
     ]
+    if timings:
+        headers += [f"{phase.capitalize()} (s)" for phase in PHASES]
     rows: List[List] = []
     for env in testers:
+        # Mark results from a previous run with the ``incremental`` option
+        envname = f"{env.envname} (cached)" if env.cached else env.envname
+        durations = (
+            [_format_duration(env.timings.get(phase)) for phase in PHASES]
+            if timings
+            else []
+        )
+        statuses = _statuses(env)
         upgraded = env.upgraded_packages()
         lowered = env.lowered_packages()
         for pkg in upgraded:
             rows.append(
                 [
-                    env.envname,
-                    env.setup_status,
-                    env.status,
+                    envname,
+                    *statuses,
                     pkg["name"],
                     "",
                     pkg["version"],
+                    *durations,
                 ]
             )
         for pkg in lowered:
             rows.append(
                 [
-                    env.envname,
-                    env.setup_status,
-                    env.status,
+                    envname,
+                    *statuses,
                     "",
                     pkg["name"],
                     pkg["version"],
+                    *durations,
                 ]
             )
+    if timings:
+        totals = [
+            sum(env.timings.get(phase, 0.0) for env in testers) for phase in PHASES
+        ]
+        rows.append(
+            ["Total", "", "", "", "", "", *[_format_duration(val) for val in totals]]
+        )
+        # Keep the formatting of the durations
+        return tabulate(
+            rows, headers=headers, tablefmt=output_type, disable_numparse=True
+        )
 
     return tabulate(rows, headers=headers, tablefmt=output_type)
+
+
+def gen_results(testers: List[TestPackage]) -> List[Dict[str, Any]]:
+    """Generate structured results for each environment.
+
+    Parameters
+    ----------
+    testers : list
+        A list of ``TestPackage`` objects.
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        One dictionary per environment with the name, set up and test status, the
+        stage which timed out (``"setup"``, ``"test"`` or ``None``), exit code of the
+        test command, upgraded and lowered package versions, the duration of each
+        phase in seconds and the log file of each stage.
+    """
+    return [
+        {
+            "name": env.envname,
+            "setup_status": env.setup_status,
+            "status": env.status,
+            "timed_out": env.timed_out,
+            "returncode": env.returncode,
+            "cached": env.cached,
+            "upgraded": env.upgraded_packages(),
+            "lowered": env.lowered_packages(),
+            "timings": {
+                phase: env.timings[phase] for phase in PHASES if phase in env.timings
+            },
+            "logs": env.log_files(),
+        }
+        for env in testers
+    ]
+
+
+def gen_junit(results: List[Dict[str, Any]]) -> str:
+    """Generate a JUnit XML report with one test case per environment.
+
+    Environments which fail to set up are reported as errors and failing tests as
+    failures. Package versions and log files are added as properties of each test
+    case.
+
+    Parameters
+    ----------
+    results : list
+        The output of ``gen_results``.
+
+    Returns
+    -------
+    str
+        The JUnit XML report.
+    """
+    failures = sum(res["setup_status"] and not res["status"] for res in results)
+    errors = sum(not res["setup_status"] for res in results)
+    duration = sum(sum(res["timings"].values()) for res in results)
+    attrs = {
+        "name": "edgetest",
+        "tests": str(len(results)),
+        "failures": str(failures),
+        "errors": str(errors),
+        "time": f"{duration:.3f}",
+    }
+    root = ET.Element("testsuites", attrs)
+    suite = ET.SubElement(root, "testsuite", attrs)
+    for res in results:
+        case = ET.SubElement(
+            suite,
+            "testcase",
+            {
+                "classname": "edgetest",
+                "name": res["name"],
+                "time": f"{sum(res['timings'].values()):.3f}",
+            },
+        )
+        properties = ET.SubElement(case, "properties")
+        for kind in ("upgraded", "lowered"):
+            for pkg in res[kind]:
+                ET.SubElement(
+                    properties,
+                    "property",
+                    {"name": f"{kind}:{pkg['name']}", "value": pkg["version"]},
+                )
+        for stage, path in res["logs"].items():
+            ET.SubElement(
+                properties, "property", {"name": f"log:{stage}", "value": path}
+            )
+        if res["timed_out"] == "setup":
+            ET.SubElement(
+                case, "error", {"message": "Timed out setting up the environment"}
+            )
+        elif not res["setup_status"]:
+            ET.SubElement(
+                case, "error", {"message": "Unable to set up the environment"}
+            )
+        elif res["timed_out"] == "test":
+            ET.SubElement(case, "failure", {"message": "Tests timed out"})
+        elif not res["status"]:
+            ET.SubElement(
+                case,
+                "failure",
+                {"message": f"Tests failed with exit code {res['returncode']}"},
+            )
+
+    return ET.tostring(root, encoding="unicode")
+
+
+def write_report_file(testers: List[TestPackage], filename: str) -> None:
+    """Write the results to a JSON or JUnit XML file.
+
+    Parameters
+    ----------
+    testers : list
+        A list of ``TestPackage`` objects.
+    filename : str
+        The path to the file. The format is chosen by the suffix, ``.json`` or
+        ``.xml``.
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    ValueError
+        Error raised if the file suffix is not supported.
+    """
+    suffix = Path(filename).suffix.lower()
+    if suffix not in VALID_REPORT_FILES:
+        raise ValueError(f"Invalid report file suffix provided: {suffix}")
+    results = gen_results(testers)
+    if suffix == ".json":
+        content = json.dumps({"environments": results}, indent=2)
+    else:
+        content = gen_junit(results)
+    Path(filename).write_text(content)
@@ -0,0 +1,391 @@
+"""Order the environments and admit them within the available resources."""
+
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from statistics import median
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from pluggy._hooks import _HookRelay
+
+from edgetest.history import env_stats
+from edgetest.logger import get_logger
+
+LOG = get_logger(__name__)
+
+SCHEDULES = ["config", "ljf", "fail-fast-first"]
+# The pass rate assumed for environments without any recorded runs
+UNSEEN_PASS_RATE = 0.5
+# The share of the available memory assumed for environments without any recorded
+# memory usage, if no other environment has any either
+UNSEEN_MEMORY_FRACTION = 0.25
+
+
+def _num_packages(env: Dict) -> int:
+    """Get the number of packages upgraded or lowered in an environment.
+
+    Parameters
+    ----------
+    env : dict
+        The validated configuration for the environment.
+
+    Returns
+    -------
+    int
+        The number of packages, at least 1.
+    """
+    return max(len(env.get("upgrade") or env.get("lower") or []), 1)
+
+
+def estimate_durations(envs: List[Dict], stats: List[Dict]) -> Dict[str, float]:
+    """Estimate how long each environment takes to set up and test.
+
+    Environments with recorded runs use their median set up and test durations.
+    Environments without any are estimated from the number of packages they upgrade
+    or lower, using the median duration per package of the recorded environments.
+
+    Parameters
+    ----------
+    envs : list
+        The validated environment configurations.
+    stats : list
+        The summary of the recorded runs from ``edgetest.history.env_stats``.
+
+    Returns
+    -------
+    Dict[str, float]
+        The estimated duration of each environment, in seconds.
+    """
+    recorded = {
+        env["name"]: (env["setup_p50"] or 0.0) + (env["test_p50"] or 0.0)
+        for env in stats
+        if env["setup_p50"] is not None or env["test_p50"] is not None
+    }
+    rates = [
+        recorded[env["name"]] / _num_packages(env)
+        for env in envs
+        if env["name"] in recorded
+    ]
+    # Without any history only the relative size of the environments matters
+    per_package = median(rates) if rates else 1.0
+
+    return {
+        env["name"]: recorded.get(env["name"], per_package * _num_packages(env))
+        for env in envs
+    }
+
+
+def order_environments(
+    envs: List[Dict],
+    schedule: str,
+    durations: Dict[str, float],
+    pass_rates: Dict[str, float],
+) -> List[str]:
+    """Order the environments according to a scheduling policy.
+
+    Parameters
+    ----------
+    envs : list
+        The validated environment configurations.
+    schedule : {"config", "ljf", "fail-fast-first"}
+        The scheduling policy. ``config`` keeps the configuration order, ``ljf`` runs
+        the longest environments first to shorten the total run time, and
+        ``fail-fast-first`` runs the environments that failed most recently first,
+        shortest first, to report failures as early as possible.
+    durations : dict
+        The estimated duration of each environment, in seconds.
+    pass_rates : dict
+        The recent pass rate of each environment with recorded runs.
+
+    Returns
+    -------
+    List[str]
+        The names of the environments in the order to run them.
+    """
+    if schedule not in SCHEDULES:
+        raise ValueError(f"Invalid schedule: {schedule}. Use one of {SCHEDULES}.")
+    names = [env["name"] for env in envs]
+    if schedule == "ljf":
+        return sorted(names, key=lambda name: -durations[name])
+    if schedule == "fail-fast-first":
+        return sorted(
+            names,
+            key=lambda name: (
+                pass_rates.get(name, UNSEEN_PASS_RATE),
+                durations[name],
+            ),
+        )
+
+    return names
+
+
+def schedule_environments(
+    hook: _HookRelay, envs: List[Dict], conf: Dict, basedir: Path
+) -> List[int]:
+    """Get the order to run the environments in.
+
+    Plugins can choose the order through the ``order_environments`` hook. Otherwise,
+    the ``schedule`` option is used with the durations and pass rates recorded in the
+    run history.
+
+    Parameters
+    ----------
+    hook : _HookRelay
+        The hook object from ``pluggy``.
+    envs : list
+        The validated environment configurations.
+    conf : dict
+        The validated configuration dictionary.
+    basedir : Path
+        The base directory with the run history.
+
+    Returns
+    -------
+    List[int]
+        The indices of ``envs`` in the order to run them. Environments missing from
+        the order returned by a plugin run last, in configuration order.
+    """
+    schedule = conf.get("schedule") or "config"
+    if schedule == "config" and not hook.order_environments.get_hookimpls():
+        return list(range(len(envs)))
+    stats = env_stats(basedir)
+    durations = estimate_durations(envs=envs, stats=stats)
+    names = hook.order_environments(envs=envs, conf=conf, durations=durations)
+    if names is None:
+        names = order_environments(
+            envs=envs,
+            schedule=schedule,
+            durations=durations,
+            pass_rates={env["name"]: env["recent_pass_rate"] for env in stats},
+        )
+    indices = {env["name"]: idx for idx, env in enumerate(envs)}
+    order = list(dict.fromkeys(indices[name] for name in names if name in indices))
+    order.extend(idx for idx in range(len(envs)) if idx not in order)
+    LOG.info(
+        f"Running the environments in the order: {[envs[idx]['name'] for idx in order]}"
+    )
+
+    return order
+
+
+def available_cores() -> List[int]:
+    """Get the IDs of the CPUs this process may run on.
+
+    Returns
+    -------
+    List[int]
+        The CPU IDs.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+
+    return list(range(os.cpu_count() or 1))
+
+
+def available_cpus() -> int:
+    """Get the number of CPUs this process may run on.
+
+    Returns
+    -------
+    int
+        The number of CPUs.
+    """
+    return len(available_cores())
+
+
+def available_memory() -> Optional[int]:
+    """Get the memory available to start new processes without swapping.
+
+    Returns
+    -------
+    int
+        The available memory in bytes. ``None`` if it could not be determined.
+    """
+    try:
+        with open("/proc/meminfo") as infile:
+            for line in infile:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+class ResourceBudget:
+    """Admit environments while their CPUs and memory fit the remaining budget.
+
+    Each admitted environment holds a disjoint set of CPUs. An environment which
+    needs more than the whole budget is admitted once nothing else is running, so it
+    can't wait forever.
+
+    Parameters
+    ----------
+    cpus : int
+        The number of CPUs to share between the environments.
+    memory : int, optional (default None)
+        The memory to share between the environments in bytes. ``None`` to only
+        limit the CPUs.
+    requirements : dict, optional (default None)
+        The number of CPUs and bytes of memory each environment needs, keyed by
+        name. Other environments need ``default_cpus`` and no memory.
+    cores : list, optional (default None)
+        The IDs of the CPUs. Defaults to ``0`` to ``cpus - 1``.
+    pin : bool, optional (default False)
+        Whether or not to pin each test command to the CPUs of its environment.
+    default_cpus : int, optional (default 1)
+        The number of CPUs for environments without requirements.
+
+    Attributes
+    ----------
+    cpus : int
+        The number of CPUs to share between the environments.
+    memory : int
+        The memory to share between the environments in bytes.
+    requirements : dict
+        The number of CPUs and bytes of memory each environment needs.
+    pin : bool
+        Whether or not to pin each test command to the CPUs of its environment.
+    """
+
+    def __init__(
+        self,
+        cpus: int,
+        memory: Optional[int] = None,
+        requirements: Optional[Dict[str, Tuple[int, int]]] = None,
+        cores: Optional[List[int]] = None,
+        pin: bool = False,
+        default_cpus: int = 1,
+    ):
+        """Init method."""
+        self.cpus = cpus
+        self.memory = memory
+        self.requirements = requirements or {}
+        self.pin = pin
+        self.default_cpus = default_cpus
+        self._free_cores = list(cores if cores is not None else range(cpus))
+        self._used_memory = 0
+        self._running = 0
+        self._condition = threading.Condition()
+
+    def _fits(self, cpus: int, memory: int) -> bool:
+        """Check whether an environment fits in the remaining budget.
+
+        Parameters
+        ----------
+        cpus : int
+            The number of CPUs the environment needs.
+        memory : int
+            The memory the environment needs in bytes.
+
+        Returns
+        -------
+        bool
+            Whether or not the environment can start.
+        """
+        if self._running == 0:
+            return True
+        if cpus > len(self._free_cores):
+            return False
+
+        return self.memory is None or self._used_memory + memory <= self.memory
+
+    @contextmanager
+    def admit(self, envname: str) -> Iterator[List[int]]:
+        """Wait until an environment fits in the budget and hold its resources.
+
+        Parameters
+        ----------
+        envname : str
+            The name of the environment.
+
+        Yields
+        ------
+        List[int]
+            The IDs of the CPUs held by the environment.
+        """
+        cpus, memory = self.requirements.get(envname, (self.default_cpus, 0))
+        cpus = min(cpus, self.cpus)
+        with self._condition:
+            if not self._fits(cpus, memory):
+                LOG.info(f"Waiting for resources to run {envname}...")
+            self._condition.wait_for(lambda: self._fits(cpus, memory))
+            cores = self._free_cores[:cpus]
+            del self._free_cores[:cpus]
+            self._used_memory += memory
+            self._running += 1
+        try:
+            yield cores
+        finally:
+            with self._condition:
+                self._free_cores = sorted(self._free_cores + cores)
+                self._used_memory -= memory
+                self._running -= 1
+                self._condition.notify_all()
+
+
+def resource_budget(envs: List[Dict], conf: Dict, basedir: Path) -> ResourceBudget:
+    """Get the resource budget for running the environments on this machine.
+
+    With the ``admission`` option, each environment needs the ``cpus`` and
+    ``max_memory`` from its configuration. If ``max_memory`` is not set, the 95th
+    percentile of the peak memory usage in the run history is used instead.
+    Environments without either are assumed to need as much as the largest recorded
+    environment, or ``UNSEEN_MEMORY_FRACTION`` of the available memory on the first
+    run, so a first run doesn't start every test suite at once. With only
+    the ``pin_cpus`` option, memory is not limited and environments without ``cpus``
+    get an equal share of the CPUs for each of the ``test_jobs``.
+
+    Parameters
+    ----------
+    envs : list
+        The validated environment configurations.
+    conf : dict
+        The validated configuration dictionary.
+    basedir : Path
+        The base directory with the run history.
+
+    Returns
+    -------
+    ResourceBudget
+        The budget, with the available CPUs and memory.
+    """
+    cores = available_cores()
+    if conf.get("admission"):
+        memory_p95 = {env["name"]: env["memory_p95"] for env in env_stats(basedir)}
+        memory = available_memory()
+        default_cpus = 1
+        default_memory = max(
+            (value for value in memory_p95.values() if value), default=None
+        ) or int((memory or 0) * UNSEEN_MEMORY_FRACTION)
+    else:
+        memory_p95 = {}
+        memory = None
+        jobs = conf.get("test_jobs") or conf.get("jobs") or 1
+        default_cpus = max(len(cores) // jobs, 1)
+        default_memory = 0
+    requirements = {
+        env["name"]: (
+            env.get("cpus") or default_cpus,
+            int(env.get("max_memory") or memory_p95.get(env["name"]) or default_memory),
+        )
+        for env in envs
+    }
+    budget = ResourceBudget(
+        cpus=len(cores),
+        memory=memory,
+        requirements=requirements,
+        cores=cores,
+        pin=bool(conf.get("pin_cpus")),
+        default_cpus=default_cpus,
+    )
+    LOG.info(
+        f"Admitting environments within {budget.cpus} CPU(s) and "
+        f"{'unlimited' if budget.memory is None else budget.memory // 1024**2} MB "
+        "of memory"
+    )
+
+    return budget
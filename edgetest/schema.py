@@ -1,9 +1,11 @@
 """Define the Cerberus schema for the testing configuration."""
 
-from typing import Dict, List
+from typing import Any, Dict, List
 
 from cerberus import Validator
 
+from edgetest.utils import parse_memory
+
 BASE_SCHEMA = {
     "envs": {
         "type": "list",
@@ -44,9 +46,128 @@ BASE_SCHEMA = {
                 },
                 "command": {"type": "string", "coerce": "strip", "default": "pytest"},
                 "package_dir": {"type": "string", "coerce": "strip", "default": "."},
+                "cache": {"type": "boolean", "coerce": "boolean", "default": False},
+                "incremental": {
+                    "type": "boolean",
+                    "coerce": "boolean",
+                    "default": False,
+                },
+                "from_lock": {"type": "boolean", "coerce": "boolean", "default": False},
+                "combined_install": {
+                    "type": "boolean",
+                    "coerce": "boolean",
+                    "default": False,
+                },
+                "snapshot": {"type": "boolean", "coerce": "boolean", "default": False},
+                "base_env": {"type": "boolean", "coerce": "boolean", "default": False},
+                "cleanup": {"type": "boolean", "coerce": "boolean", "default": False},
+                "venv_backend": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "allowed": ["venv", "uv"],
+                    "default": "venv",
+                },
+                "python_version": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "default": None,
+                    "nullable": True,
+                },
+                "python_cache": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "default": None,
+                    "nullable": True,
+                },
+                "max_memory": {
+                    "type": "integer",
+                    "coerce": "memory",
+                    "min": 1,
+                    "default": None,
+                    "nullable": True,
+                },
+                "cpus": {
+                    "type": "integer",
+                    "coerce": int,
+                    "min": 1,
+                    "default": None,
+                    "nullable": True,
+                },
+                "timeout": {
+                    "type": "float",
+                    "coerce": float,
+                    "min": 1,
+                    "default": None,
+                    "nullable": True,
+                },
+                "setup_timeout": {
+                    "type": "float",
+                    "coerce": float,
+                    "min": 1,
+                    "default": None,
+                    "nullable": True,
+                },
             },
         },
-    }
+    },
+    "jobs": {"type": "integer", "coerce": int, "min": 1, "default": 1},
+    "basedir": {
+        "type": "string",
+        "coerce": "strip",
+        "default": None,
+        "nullable": True,
+    },
+    "envs_dir": {
+        "type": "string",
+        "coerce": "strip",
+        "default": None,
+        "nullable": True,
+    },
+    "build_wheel": {"type": "boolean", "coerce": "boolean", "default": False},
+    "wheelhouse": {"type": "boolean", "coerce": "boolean", "default": False},
+    "find_links": {
+        "type": "string",
+        "coerce": "strip",
+        "default": None,
+        "nullable": True,
+    },
+    "offline": {"type": "boolean", "coerce": "boolean", "default": False},
+    "max_disk": {
+        "type": "integer",
+        "coerce": "memory",
+        "min": 1,
+        "default": None,
+        "nullable": True,
+    },
+    "max_age": {
+        "type": "float",
+        "coerce": float,
+        "min": 0,
+        "default": None,
+        "nullable": True,
+    },
+    "adaptive": {"type": "boolean", "coerce": "boolean", "default": False},
+    "admission": {"type": "boolean", "coerce": "boolean", "default": False},
+    "pin_cpus": {"type": "boolean", "coerce": "boolean", "default": False},
+    "schedule": {
+        "type": "string",
+        "allowed": ["config", "ljf", "fail-fast-first"],
+        "default": "config",
+    },
+    "setup_jobs": {
+        "type": "integer",
+        "coerce": int,
+        "min": 1,
+        "default": None,
+        "nullable": True,
+    },
+    "test_jobs": {
+        "type": "integer",
+        "coerce": int,
+        "min": 1,
+        "default": None,
+        "nullable": True,
+    },
 }
 
 
@@ -109,6 +230,51 @@ class EdgetestValidator(Validator):
         else:
             return value
 
+    def _normalize_coerce_boolean(self, value: Any) -> Any:
+        """Coerce a boolean from ``.ini`` style strings.
+
+        Parameters
+        ----------
+        value : Any
+            The original value for the field.
+
+        Returns
+        -------
+        Any
+            ``True`` or ``False`` for recognized strings, otherwise the original value.
+        """
+        if isinstance(value, str):
+            return {
+                "true": True,
+                "yes": True,
+                "on": True,
+                "1": True,
+                "false": False,
+                "no": False,
+                "off": False,
+                "0": False,
+            }.get(value.strip().lower(), value)
+        else:
+            return value
+
+    def _normalize_coerce_memory(self, value: Any) -> Any:
+        """Coerce an amount of memory with units into bytes.
+
+        Parameters
+        ----------
+        value : Any
+            The original value for the field.
+
+        Returns
+        -------
+        Any
+            The number of bytes for strings like ``6G``, otherwise the original value.
+        """
+        if isinstance(value, str):
+            return parse_memory(value)
+        else:
+            return value
+
     def _normalize_coerce_strip(self, value: str) -> str:
         """Remove leading and trailing spaces.
 
@@ -1,31 +1,410 @@
 """Utility functions."""
 
+import asyncio
+import codecs
+import gzip
+import hashlib
+import json
+import math
 import os
+import platform
+import re
+import shutil
+import signal
+import sys
+import threading
+import time
+import warnings
+from collections import deque
 from configparser import ConfigParser
 from contextlib import contextmanager
+from contextvars import ContextVar
 from copy import deepcopy
+from importlib.metadata import distributions
 from pathlib import Path
-from subprocess import PIPE, Popen
-from typing import Any, Dict, List, Optional, Tuple, Union
+from subprocess import PIPE, Popen, TimeoutExpired
+from tempfile import TemporaryDirectory
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
 from packaging.requirements import Requirement
 from packaging.specifiers import Specifier, SpecifierSet
+from packaging.utils import canonicalize_name
 from tomlkit import TOMLDocument, load
 from tomlkit.container import Container
-from tomlkit.items import Array, Item, String, Table
+from tomlkit.items import Array, Bool, Float, Integer, Item, String, Table
 
 from edgetest.logger import get_logger
 
 LOG = get_logger(__name__)
 
+# The environment created by ``convert_requirements`` with every requirement upgraded
+ALL_REQUIREMENTS = "all-requirements"
 
-def _run_command(*args) -> Tuple[str, int]:
+# Directories which are not part of the source of a local package
+SOURCE_EXCLUDES = {
+    ".edgetest",
+    ".git",
+    ".hg",
+    ".mypy_cache",
+    ".nox",
+    ".pytest_cache",
+    ".ruff_cache",
+    ".tox",
+    ".venv",
+    "__pycache__",
+    "build",
+    "dist",
+}
+
+# Directories and files left out of the snapshots of a local package. Version control
+# directories are kept for tools which read the version from them.
+SNAPSHOT_EXCLUDES = (SOURCE_EXCLUDES - {".git", ".hg"}) | {".coverage"}
+
+# The ``ioctl`` request to clone a file with a reflink on Linux
+FICLONE = 0x40049409
+
+# Multipliers for the units accepted by ``parse_memory``
+MEMORY_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+# The number of characters of output from each stream kept in memory for errors
+OUTPUT_TAIL_CHARS = 8192
+
+# Seconds between samples of the memory usage of a process tree
+MEMORY_SAMPLE_INTERVAL = 0.5
+
+# The ``time.monotonic`` deadline for commands run in the current context
+_DEADLINE: ContextVar[Optional[float]] = ContextVar("edgetest_deadline", default=None)
+
+# The compressed log file for commands run in the current context
+_LOG_FILE: ContextVar[Optional[Path]] = ContextVar("edgetest_log_file", default=None)
+
+# Extra environment variables for commands run in the current context
+_VARIABLES: ContextVar[Optional[Dict[str, str]]] = ContextVar(
+    "edgetest_variables", default=None
+)
+
+# The ``uv`` configuration file in the wheelhouse for offline installs
+WHEELHOUSE_CONFIG = "uv.toml"
+
+# The files in a ``find_links`` directory copied into the wheelhouse
+DISTRIBUTION_SUFFIXES = (".whl", ".tar.gz", ".zip")
+
+# The build requirements of a package without ``[build-system]`` in ``pyproject.toml``
+DEFAULT_BUILD_REQUIRES = ["setuptools>=40.8.0", "wheel"]
+
+
+class CommandTimeoutError(RuntimeError):
+    """Error raised when a command does not finish before its deadline."""
+
+
+@contextmanager
+def command_deadline(timeout: Optional[float]) -> Iterator[None]:
+    """Limit the total run time of the commands run through ``_run_command``.
+
+    The deadline applies to the current thread or ``asyncio`` task, so each
+    environment can be set up with its own deadline. On Linux, the CPU time of each
+    command is also limited with ``_limit_cpu_time``.
+
+    Parameters
+    ----------
+    timeout : float
+        The number of seconds from now. ``None`` for no deadline.
+    """
+    if timeout is None:
+        yield
+        return
+    token = _DEADLINE.set(time.monotonic() + timeout)
+    try:
+        yield
+    finally:
+        _DEADLINE.reset(token)
+
+
+@contextmanager
+def command_log(path: Optional[Path]) -> Iterator[None]:
+    """Stream the output of the commands run through ``_run_command`` to a log file.
+
+    The log applies to the current thread or ``asyncio`` task, so each environment
+    can log to its own file.
+
+    Parameters
+    ----------
+    path : Path
+        The gzip-compressed log file. Output is appended if it already exists.
+        ``None`` to keep the output in memory.
+    """
+    if path is None:
+        yield
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    token = _LOG_FILE.set(path)
+    try:
+        yield
+    finally:
+        _LOG_FILE.reset(token)
+
+
+class OutputLog:
+    """Stream the output of a process to a gzip-compressed log file.
+
+    Only the last ``OUTPUT_TAIL_CHARS`` characters of each stream are kept in memory,
+    so memory usage does not grow with the amount of output.
+
+    Parameters
+    ----------
+    path : Path
+        The log file. Output is appended if it already exists.
+    args : tuple
+        Arguments for the command, written to the log before its output.
+
+    Attributes
+    ----------
+    path : Path
+        The log file.
+    """
+
+    def __init__(self, path: Path, args: Tuple):
+        """Init method."""
+        self.path = path
+        self._outfile = gzip.open(
+            path, "at", encoding="utf-8", errors="backslashreplace"
+        )
+        self._outfile.write(f"$ {' '.join(args)}\n")
+        self._lock = threading.Lock()
+        self._tails: Dict[str, Deque[str]] = {}
+        self._sizes: Dict[str, int] = {}
+        self._threads: List[threading.Thread] = []
+
+    def write(self, name: str, text: str, keep: Optional[List[str]] = None) -> None:
+        """Write output from one of the streams of the process.
+
+        Parameters
+        ----------
+        name : str
+            The name of the stream, e.g. ``stdout``.
+        text : str
+            The output.
+        keep : list, optional (default None)
+            A list to collect the complete output of the stream in.
+        """
+        with self._lock:
+            self._outfile.write(text)
+        if keep is not None:
+            keep.append(text)
+        tail = self._tails.setdefault(name, deque())
+        tail.append(text)
+        self._sizes[name] = self._sizes.get(name, 0) + len(text)
+        while len(tail) > 1 and self._sizes[name] - len(tail[0]) >= OUTPUT_TAIL_CHARS:
+            self._sizes[name] -= len(tail.popleft())
+
+    def drain(self, name: str, stream: IO, keep: Optional[List[str]] = None) -> None:
+        """Read a stream of the process in a background thread until it closes.
+
+        Parameters
+        ----------
+        name : str
+            The name of the stream, e.g. ``stdout``.
+        stream : IO
+            The text stream to read.
+        keep : list, optional (default None)
+            A list to collect the complete output of the stream in.
+        """
+
+        def _read():
+            for line in stream:
+                self.write(name, line, keep)
+            stream.close()
+
+        thread = threading.Thread(target=_read, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def tail(self, name: str) -> str:
+        """Get the end of the output from a stream.
+
+        Parameters
+        ----------
+        name : str
+            The name of the stream.
+
+        Returns
+        -------
+        str
+            The last ``OUTPUT_TAIL_CHARS`` characters of output.
+        """
+        return "".join(self._tails.get(name, ()))[-OUTPUT_TAIL_CHARS:]
+
+    def close(self) -> None:
+        """Wait for the streams to close and close the log file."""
+        for thread in self._threads:
+            thread.join()
+        self._outfile.close()
+
+
+def _command_error(args: Tuple, out: str, err: str, log: Optional[OutputLog]) -> str:
+    """Build the message for a command which returned a non-zero exit code.
+
+    Parameters
+    ----------
+    args : tuple
+        Arguments for the command.
+    out : str
+        The output.
+    err : str
+        The error output.
+    log : OutputLog
+        The log of the command output, if any. The message only includes the end of
+        each stream and points to the log for the rest.
+
+    Returns
+    -------
+    str
+        The error message.
+    """
+    if log is None:
+        return (
+            f"Unable to run the following command: \n\n {' '.join(args)} \n\n"
+            f"Returned the following stdout: \n\n {out} \n\n"
+            f"Returned the following stderr: \n\n {err} \n\n"
+        )
+
+    return (
+        f"Unable to run the following command: \n\n {' '.join(args)} \n\n"
+        f"Returned the following stdout (truncated): \n\n {log.tail('stdout')} \n\n"
+        f"Returned the following stderr (truncated): \n\n {log.tail('stderr')} \n\n"
+        f"The full output is in {log.path}"
+    )
+
+
+def _remaining_time(args: Tuple) -> Optional[float]:
+    """Get the time left before the deadline to run a command.
+
+    Parameters
+    ----------
+    args : tuple
+        Arguments for the command.
+
+    Returns
+    -------
+    float
+        The number of seconds left. ``None`` if there is no deadline.
+
+    Raises
+    ------
+    CommandTimeoutError
+        Error raised if the deadline has already passed.
+    """
+    deadline = _DEADLINE.get()
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise CommandTimeoutError(
+            f"Not enough time left to run the following command: \n\n {' '.join(args)}"
+        )
+
+    return remaining
+
+
+def _kill_process_group(pid: int) -> None:
+    """Kill a process started in a new session and everything it started.
+
+    Parameters
+    ----------
+    pid : int
+        The ID of the process, which is also the ID of its process group.
+    """
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(pid, signal.SIGKILL)
+        else:
+            os.kill(pid, signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _set_limits(
+    pid: int, max_memory: Optional[int] = None, cpu_seconds: Optional[int] = None
+) -> None:
+    """Limit the resources of a running process.
+
+    The address space is limited with ``RLIMIT_AS`` and the CPU time with
+    ``RLIMIT_CPU``. Processes it starts afterwards inherit the limits. Limits can only
+    be set on Linux.
+
+    Parameters
+    ----------
+    pid : int
+        The ID of the process.
+    max_memory : int, optional (default None)
+        The maximum address space in bytes.
+    cpu_seconds : int, optional (default None)
+        The maximum CPU time in seconds.
+    """
+    try:
+        import resource
+
+        prlimit = resource.prlimit
+    except (ImportError, AttributeError):
+        LOG.warning("Resource limits are only supported on Linux")
+        return
+    limits = [(resource.RLIMIT_AS, max_memory), (resource.RLIMIT_CPU, cpu_seconds)]
+    for limit, value in limits:
+        if value is None:
+            continue
+        try:
+            prlimit(pid, limit, (value, value))
+        except (OSError, ValueError) as err:
+            LOG.warning(f"Unable to limit the resources of process {pid}: {err}")
+
+
+def _limit_cpu_time(pid: int, timeout: float) -> None:
+    """Limit the CPU time of a command with a deadline.
+
+    The CPU time is capped at ``timeout`` seconds for each CPU, as a backstop for
+    processes which escape the process group killed at the deadline. Nothing is done
+    outside of Linux.
+
+    Parameters
+    ----------
+    pid : int
+        The ID of the command.
+    timeout : float
+        The time left until the deadline in seconds.
+    """
+    if sys.platform.startswith("linux"):
+        _set_limits(pid, cpu_seconds=math.ceil(timeout * (os.cpu_count() or 1)))
+
+
+def _run_command(
+    *args, cwd: Optional[str] = None, env: Optional[Dict[str, str]] = None
+) -> Tuple[str, int]:
     """Run a command using ``subprocess.Popen``.
 
     Parameters
     ----------
     *args
         Arguments for the command.
+    cwd : str, optional (default None)
+        The directory to run the command in. Passed directly to ``subprocess.Popen``
+        so the working directory of the current process is left untouched.
+    env : dict, optional (default None)
+        The environment variables for the command. Defaults to the environment of the
+        current process, which is never modified. Any variables set with
+        ``command_variables`` are added.
 
     Returns
     -------
@@ -38,29 +417,352 @@ def _run_command(*args) -> Tuple[str, int]:
     ------
     RuntimeError
         Error raised when the command is not successfully executed.
+    CommandTimeoutError
+        Error raised when the command does not finish before the deadline set with
+        ``command_deadline``. The command and any processes it started are killed.
     """
     LOG.debug(f"Running the following command: \n\n {' '.join(args)}")
-    popen = Popen(args, stdout=PIPE, stderr=PIPE, universal_newlines=True)
-    out, err = popen.communicate()
-    if popen.returncode:
-        raise RuntimeError(
-            f"Unable to run the following command: \n\n {' '.join(args)} \n\n"
-            f"Returned the following stdout: \n\n {out} \n\n"
-            f"Returned the following stderr: \n\n {err} \n\n"
+    timeout = _remaining_time(args)
+    env = _command_env(env)
+    options: Dict[str, Any] = {}
+    if env is not None:
+        options["env"] = env
+    if timeout is not None:
+        # Kill the whole process group on timeout
+        options["start_new_session"] = True
+    popen = Popen(
+        args, stdout=PIPE, stderr=PIPE, universal_newlines=True, cwd=cwd, **options
+    )
+    if timeout is not None:
+        _limit_cpu_time(popen.pid, timeout)
+    log_path = _LOG_FILE.get()
+    log = OutputLog(log_path, args) if log_path is not None else None
+    # The complete output is only kept for ``stdout``, which callers parse
+    lines: List[str] = []
+    try:
+        if log is None:
+            out, err = popen.communicate(timeout=timeout)
+        else:
+            log.drain("stdout", popen.stdout, keep=lines)  # type: ignore
+            log.drain("stderr", popen.stderr)  # type: ignore
+            popen.wait(timeout=timeout)
+    except TimeoutExpired:
+        _kill_process_group(popen.pid)
+        if log is None:
+            popen.communicate()
+        else:
+            popen.wait()
+        raise CommandTimeoutError(
+            f"Timed out running the following command: \n\n {' '.join(args)}"
         ) from None
+    finally:
+        if log is not None:
+            log.close()
+    if log is not None:
+        out, err = "".join(lines), log.tail("stderr")
+    if popen.returncode:
+        raise RuntimeError(_command_error(args, out, err, log)) from None
 
     return out, popen.returncode
 
 
+@contextmanager
+def command_variables(variables: Optional[Dict[str, str]]) -> Iterator[None]:
+    """Add environment variables to the commands run through ``_run_command``.
+
+    The variables apply to the current thread or ``asyncio`` task, so each
+    environment can be set up with its own variables.
+
+    Parameters
+    ----------
+    variables : dict
+        The environment variables to add. ``None`` to leave the environment as it is.
+    """
+    if variables is None:
+        yield
+        return
+    token = _VARIABLES.set(variables)
+    try:
+        yield
+    finally:
+        _VARIABLES.reset(token)
+
+
+def _command_env(env: Optional[Dict[str, str]]) -> Optional[Dict[str, str]]:
+    """Add the variables set with ``command_variables`` to the environment of a command.
+
+    Parameters
+    ----------
+    env : dict
+        The environment variables for the command. ``None`` for the environment of the
+        current process.
+
+    Returns
+    -------
+    Dict[str, str]
+        The environment variables for the command. ``None`` for the environment of the
+        current process.
+    """
+    variables = _VARIABLES.get()
+    if variables is None:
+        return env
+
+    return {**(os.environ if env is None else env), **variables}
+
+
+async def _run_command_async(
+    *args, cwd: Optional[str] = None, env: Optional[Dict[str, str]] = None
+) -> Tuple[str, int]:
+    """Run a command using ``asyncio`` subprocesses.
+
+    Parameters
+    ----------
+    *args
+        Arguments for the command.
+    cwd : str, optional (default None)
+        The directory to run the command in.
+    env : dict, optional (default None)
+        The environment variables for the command. Defaults to the environment of the
+        current process. Any variables set with ``command_variables`` are added.
+
+    Returns
+    -------
+    str
+        The output
+    int
+        The exit code
+
+    Raises
+    ------
+    RuntimeError
+        Error raised when the command is not successfully executed.
+    CommandTimeoutError
+        Error raised when the command does not finish before the deadline set with
+        ``command_deadline``. The command and any processes it started are killed.
+    """
+    LOG.debug(f"Running the following command: \n\n {' '.join(args)}")
+    timeout = _remaining_time(args)
+    env = _command_env(env)
+    options: Dict[str, Any] = {}
+    if env is not None:
+        options["env"] = env
+    if timeout is not None:
+        options["start_new_session"] = True
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd,
+        **options,
+    )
+    if timeout is not None:
+        _limit_cpu_time(proc.pid, timeout)
+    log_path = _LOG_FILE.get()
+    log = OutputLog(log_path, args) if log_path is not None else None
+    lines: List[str] = []
+    try:
+        if log is None:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+            out, err = stdout.decode(), stderr.decode()
+        else:
+            await asyncio.wait_for(
+                asyncio.gather(
+                    _drain_async(log, "stdout", proc.stdout, keep=lines),  # type: ignore
+                    _drain_async(log, "stderr", proc.stderr),  # type: ignore
+                    proc.wait(),
+                ),
+                timeout,
+            )
+    except asyncio.TimeoutError:
+        _kill_process_group(proc.pid)
+        await proc.wait()
+        raise CommandTimeoutError(
+            f"Timed out running the following command: \n\n {' '.join(args)}"
+        ) from None
+    finally:
+        if log is not None:
+            log.close()
+    if log is not None:
+        out, err = "".join(lines), log.tail("stderr")
+    returncode = await proc.wait()
+    if returncode:
+        raise RuntimeError(_command_error(args, out, err, log)) from None
+
+    return out, returncode
+
+
+async def _drain_async(
+    log: OutputLog,
+    name: str,
+    stream: asyncio.StreamReader,
+    keep: Optional[List[str]] = None,
+) -> None:
+    """Read a stream of an ``asyncio`` subprocess into a log until it closes.
+
+    Parameters
+    ----------
+    log : OutputLog
+        The log to write the output to.
+    name : str
+        The name of the stream, e.g. ``stdout``.
+    stream : asyncio.StreamReader
+        The stream to read.
+    keep : list, optional (default None)
+        A list to collect the complete output of the stream in.
+    """
+    # Read in chunks since lines can be longer than the limit of ``readline``
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        chunk = await stream.read(1 << 16)
+        text = decoder.decode(chunk, final=not chunk)
+        if text:
+            log.write(name, text, keep)
+        if not chunk:
+            break
+
+
+def _tree_memory(pid: int) -> Optional[int]:
+    """Get the total resident memory of a process and all of its descendants.
+
+    The process table is read from ``/proc``, so this only works on Linux.
+
+    Parameters
+    ----------
+    pid : int
+        The ID of the process.
+
+    Returns
+    -------
+    int
+        The sum of the resident set sizes in bytes. ``None`` if ``/proc`` can't be
+        read.
+    """
+    children: Dict[int, List[int]] = {}
+    rss: Dict[int, int] = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return None
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as infile:
+                stat = infile.read()
+        except OSError:
+            # The process exited
+            continue
+        # The command name in parentheses may contain spaces
+        fields = stat[stat.rfind(")") + 2 :].split()
+        rss[int(entry)] = int(fields[21])
+        children.setdefault(int(fields[1]), []).append(int(entry))
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += rss.get(current, 0)
+        stack.extend(children.get(current, []))
+
+    return total * os.sysconf("SC_PAGE_SIZE")
+
+
+def _wait_for_process(popen: Popen) -> Optional[int]:
+    """Wait for a process to finish and get its peak memory usage.
+
+    On Linux, the memory of the whole process tree is sampled every
+    ``MEMORY_SAMPLE_INTERVAL`` seconds, so concurrent workers, e.g. from
+    ``pytest-xdist``, are added up. ``os.wait4`` also reports the maximum resident
+    set size of the largest single process, which catches peaks between samples.
+    It is not available on Windows.
+
+    Parameters
+    ----------
+    popen : Popen
+        The running process. Piped output must be read by another thread.
+
+    Returns
+    -------
+    int
+        The peak memory usage in bytes. ``None`` if it could not be measured.
+    """
+    if popen.returncode is not None or not hasattr(os, "wait4"):
+        popen.wait()
+        return None
+    peak = [0]
+    done = threading.Event()
+
+    def _sample():
+        while not done.is_set():
+            peak[0] = max(peak[0], _tree_memory(popen.pid) or 0)
+            done.wait(MEMORY_SAMPLE_INTERVAL)
+
+    sampler = None
+    if os.path.isdir("/proc"):
+        sampler = threading.Thread(target=_sample, daemon=True)
+        sampler.start()
+    try:
+        _, status, usage = os.wait4(popen.pid, 0)
+    finally:
+        done.set()
+        if sampler is not None:
+            sampler.join()
+    if os.WIFSIGNALED(status):
+        popen.returncode = -os.WTERMSIG(status)
+    else:
+        popen.returncode = os.WEXITSTATUS(status)
+
+    # Linux reports kilobytes and macOS reports bytes
+    maxrss = usage.ru_maxrss * (1 if platform.system() == "Darwin" else 1024)
+
+    return max(maxrss, peak[0])
+
+
+def parse_memory(value: Union[str, int]) -> int:
+    """Parse an amount of memory.
+
+    Parameters
+    ----------
+    value : str or int
+        The number of bytes, optionally with a ``K``, ``M``, ``G`` or ``T`` suffix,
+        e.g. ``6G`` or ``512MB``.
+
+    Returns
+    -------
+    int
+        The number of bytes.
+
+    Raises
+    ------
+    ValueError
+        Error raised if the value is not a valid amount of memory.
+    """
+    if isinstance(value, int):
+        return value
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([KMGT]?)(?:I?B)?", value.strip().upper())
+    if match is None:
+        raise ValueError(f"Invalid amount of memory: {value}")
+
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2)])
+
+
 @contextmanager
 def pushd(new_dir: str):
     """Create a context manager for running commands in sub-directories.
 
+    .. deprecated::
+        ``pushd`` changes the working directory of the whole process, so it is not
+        safe to use from threads. Pass ``cwd`` to the command instead.
+
     Parameters
     ----------
     new_dir : str
         The relative directory to run the command in.
     """
+    warnings.warn(
+        "pushd changes the working directory of the whole process. Pass ``cwd`` to "
+        "the command instead.",
+        DeprecationWarning,
+        stacklevel=3,
+    )
     curr_dir = Path.cwd()
     os.chdir(curr_dir / new_dir)
     try:
@@ -69,11 +771,492 @@ def pushd(new_dir: str):
         os.chdir(curr_dir)
 
 
-def _convert_toml_array_to_string(item: Union[Item, Any]) -> str:
+def _resolve_dirs(dirs: Sequence[Union[str, Path]]) -> Set[Path]:
+    """Resolve directories to compare them with the directories in a walk.
+
+    Parameters
+    ----------
+    dirs : sequence
+        The directories.
+
+    Returns
+    -------
+    Set[Path]
+        The absolute paths with symbolic links resolved.
+    """
+    return {Path(path).resolve() for path in dirs}
+
+
+def _hash_source_tree(
+    package_dir: str, exclude_dirs: Sequence[Union[str, Path]] = ()
+) -> str:
+    """Hash the contents of the source tree of a local package.
+
+    Build artifacts, caches and version control directories are excluded.
+
+    Parameters
+    ----------
+    package_dir : str
+        The location of the local package.
+    exclude_dirs : sequence, optional (default ())
+        Directories to exclude by path, e.g. the base directory if it's inside the
+        package directory.
+
+    Returns
+    -------
+    str
+        The SHA-256 hash of the relative paths and contents of the files.
+    """
+    root = Path(package_dir)
+    excluded = _resolve_dirs(exclude_dirs)
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(root):
+        # Sort in place so the walk order is deterministic
+        dirnames[:] = sorted(
+            name
+            for name in dirnames
+            if name not in SOURCE_EXCLUDES
+            and not name.endswith(".egg-info")
+            and not (excluded and Path(dirpath, name).resolve() in excluded)
+        )
+        for filename in sorted(filenames):
+            path = Path(dirpath, filename)
+            if path.suffix == ".pyc" or not path.is_file():
+                continue
+            digest.update(path.relative_to(root).as_posix().encode() + b"\0")
+            with open(path, "rb") as infile:
+                for chunk in iter(lambda: infile.read(1 << 20), b""):
+                    digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def _clone_file(src: Path, dst: Path, reflink: bool = True) -> bool:
+    """Clone a file with a reflink, falling back to a hard link and then a copy.
+
+    Parameters
+    ----------
+    src : Path
+        The file to clone.
+    dst : Path
+        The new file.
+    reflink : bool, optional (default True)
+        Whether or not to try a reflink first.
+
+    Returns
+    -------
+    bool
+        Whether or not the file was cloned with a reflink.
+    """
+    if reflink:
+        try:
+            import fcntl
+
+            with open(src, "rb") as infile, open(dst, "wb") as outfile:
+                fcntl.ioctl(outfile.fileno(), FICLONE, infile.fileno())
+            return True
+        except (ImportError, OSError):
+            dst.unlink(missing_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+    return False
+
+
+def _clone_tree(
+    root: Path, out: Path, exclude: Callable[[Path], bool] = lambda path: False
+) -> None:
+    """Clone a directory tree file by file with ``_clone_file``.
+
+    Symbolic links are recreated as they are, rather than followed.
+
+    Parameters
+    ----------
+    root : Path
+        The directory to clone.
+    out : Path
+        The location of the clone. Anything already there is replaced.
+    exclude : callable, optional
+        Whether or not to leave out a file or directory, given its path.
+    """
+    if out.is_symlink() or out.is_file():
+        out.unlink()
+    elif out.exists():
+        shutil.rmtree(out)
+    reflink = True
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if not exclude(Path(dirpath, name))]
+        target = out / Path(dirpath).relative_to(root)
+        target.mkdir(parents=True, exist_ok=True)
+        for name in dirnames:
+            if Path(dirpath, name).is_symlink():
+                # ``os.walk`` doesn't follow symbolic links to directories
+                os.symlink(os.readlink(Path(dirpath, name)), target / name)
+        for filename in filenames:
+            src = Path(dirpath, filename)
+            if exclude(src):
+                continue
+            if src.is_symlink():
+                os.symlink(os.readlink(src), target / filename)
+            elif src.is_file():
+                # Stop trying reflinks once the filesystem rejects one
+                reflink = _clone_file(src, target / filename, reflink=reflink)
+
+
+def snapshot_tree(
+    package_dir: str,
+    outdir: Union[str, Path],
+    exclude_dirs: Sequence[Union[str, Path]] = (),
+) -> Path:
+    """Make a cheap snapshot of a local package for a single environment.
+
+    Files are cloned with reflinks where the filesystem supports them, so the snapshot
+    is copy-on-write. Otherwise, files are hard linked, so a test suite which modifies
+    a file *in place* also modifies the original. Files created or replaced in the
+    snapshot, e.g. ``build/``, ``.pytest_cache`` or coverage data, never are. Build
+    artifacts and caches in ``SNAPSHOT_EXCLUDES`` are left out.
+
+    Parameters
+    ----------
+    package_dir : str
+        The location of the local package.
+    outdir : str or Path
+        The location of the snapshot. Any previous snapshot is replaced.
+    exclude_dirs : sequence, optional (default ())
+        Directories to leave out by path, e.g. the base directory if it's inside the
+        package directory. The snapshot itself is always left out.
+
+    Returns
+    -------
+    Path
+        The location of the snapshot.
+    """
+    out = Path(outdir)
+    excluded = _resolve_dirs([*exclude_dirs, out])
+    _clone_tree(
+        Path(package_dir),
+        out,
+        exclude=lambda path: (
+            path.name in SNAPSHOT_EXCLUDES
+            or path.name.endswith(".egg-info")
+            or path.name.endswith(".pyc")
+            or (path.is_dir() and path.resolve() in excluded)
+        ),
+    )
+
+    return out
+
+
+def clone_environment(
+    base: Union[str, Path],
+    outdir: Union[str, Path],
+    exclude_files: Sequence[str] = (),
+) -> Path:
+    """Clone a virtual environment.
+
+    Files are cloned with reflinks where the filesystem supports them, and hard linked
+    otherwise. Installers replace files rather than modify them in place, so
+    installing into the clone leaves the base environment untouched. Scripts and
+    ``pyvenv.cfg`` are rewritten to point to the clone instead of the base
+    environment.
+
+    Parameters
+    ----------
+    base : str or Path
+        The virtual environment to clone.
+    outdir : str or Path
+        The location of the clone. Any previous environment there is replaced.
+    exclude_files : sequence, optional (default ())
+        Names of files at the top of the base environment to leave out, e.g. markers
+        which have to be separate for each environment.
+
+    Returns
+    -------
+    Path
+        The location of the clone.
+    """
+    base, out = Path(base), Path(outdir)
+    _clone_tree(
+        base,
+        out,
+        exclude=lambda path: path.parent == base and path.name in exclude_files,
+    )
+    old, new = str(base).encode(), str(out).encode()
+    for path in [
+        out / "pyvenv.cfg",
+        *(out / "bin").glob("*"),
+        *(out / "Scripts").glob("*"),
+    ]:
+        if path.is_symlink() or not path.is_file():
+            continue
+        content = path.read_bytes()
+        if old not in content:
+            continue
+        mode = path.stat().st_mode
+        # Break the link with the base environment before writing
+        path.unlink()
+        path.write_bytes(content.replace(old, new))
+        path.chmod(mode)
+
+    return out
+
+
+def build_wheel(
+    package_dir: str,
+    outdir: Union[str, Path],
+    exclude_dirs: Sequence[Union[str, Path]] = (),
+) -> str:
+    """Build a wheel of the local package once for every environment.
+
+    Wheels are cached in ``outdir`` by a hash of the source tree, so the package is
+    only rebuilt when the source changes.
+
+    Parameters
+    ----------
+    package_dir : str
+        The location of the local package.
+    outdir : str or Path
+        The directory to cache the wheels in.
+    exclude_dirs : sequence, optional (default ())
+        Directories left out of the hash of the source tree.
+
+    Returns
+    -------
+    str
+        The path to the wheel.
+
+    Raises
+    ------
+    RuntimeError
+        Error raised when the wheel cannot be built.
+    """
+    source_hash = _hash_source_tree(package_dir, exclude_dirs)
+    cache = Path(outdir) / source_hash
+    wheels = sorted(cache.glob("*.whl"))
+    if wheels:
+        LOG.info(f"Using the cached wheel for {package_dir}: {wheels[0].name}")
+        return str(wheels[0])
+    LOG.info(f"Building a wheel for {package_dir}")
+    with TemporaryDirectory() as tmpdir:
+        _run_command("uv", "build", "--wheel", f"--out-dir={tmpdir}", package_dir)
+        wheels = sorted(Path(tmpdir).glob("*.whl"))
+        if not wheels:
+            raise RuntimeError(f"Unable to find the wheel built for {package_dir}")
+        # Rename the wheel into place so the cache never holds a partial copy
+        cache.mkdir(parents=True, exist_ok=True)
+        wheel = cache / wheels[0].name
+        partial = cache / f"{wheels[0].name}.part"
+        shutil.move(str(wheels[0]), str(partial))
+        os.replace(partial, wheel)
+    LOG.info(f"Successfully built {wheel.name}")
+
+    return str(wheel)
+
+
+def build_requires(package_dir: str) -> List[str]:
+    """Get the build requirements of the local package.
+
+    Parameters
+    ----------
+    package_dir : str
+        The location of the local package.
+
+    Returns
+    -------
+    List[str]
+        The ``requires`` of the ``[build-system]`` table in ``pyproject.toml``, or the
+        ``setuptools`` defaults if there isn't one.
+    """
+    path = Path(package_dir, "pyproject.toml")
+    if not path.is_file():
+        return list(DEFAULT_BUILD_REQUIRES)
+    with path.open() as buf:
+        requires = load(buf).get("build-system", {}).get("requires")
+
+    return (
+        list(DEFAULT_BUILD_REQUIRES)
+        if requires is None
+        else [str(req) for req in requires]
+    )
+
+
+def copy_distributions(find_links: str, outdir: Union[str, Path]) -> int:
+    """Copy the distributions from a local directory into the wheelhouse.
+
+    Parameters
+    ----------
+    find_links : str
+        The directory with the distributions.
+    outdir : str or Path
+        The wheelhouse.
+
+    Returns
+    -------
+    int
+        The number of distributions copied. Distributions already in the wheelhouse
+        are not copied again.
+    """
+    out = Path(outdir)
+    out.mkdir(parents=True, exist_ok=True)
+    copied = 0
+    for path in sorted(Path(find_links).iterdir()):
+        if not path.is_file() or not path.name.endswith(DISTRIBUTION_SUFFIXES):
+            continue
+        if (out / path.name).is_file():
+            continue
+        _clone_file(path, out / path.name, reflink=True)
+        copied += 1
+    LOG.info(f"Copied {copied} distributions from {find_links} to {out}")
+
+    return copied
+
+
+def download_distributions(
+    requirements: List[str],
+    outdir: Union[str, Path],
+    python_version: Optional[str] = None,
+) -> None:
+    """Download pinned distributions into the wheelhouse.
+
+    ``uv`` can't download distributions without installing them, so this runs
+    ``pip download`` with the interpreter ``edgetest`` is installed in.
+
+    Parameters
+    ----------
+    requirements : list
+        The pinned requirements. Their dependencies must be included, since they are
+        not resolved again.
+    outdir : str or Path
+        The wheelhouse.
+    python_version : str, optional (default None)
+        The python version to download wheels for. Defaults to the current
+        interpreter, which also allows source distributions.
+
+    Raises
+    ------
+    RuntimeError
+        Error raised when the distributions cannot be downloaded.
+    """
+    out = Path(outdir)
+    out.mkdir(parents=True, exist_ok=True)
+    target = (
+        [f"--python-version={python_version}", "--only-binary=:all:"]
+        if python_version
+        else []
+    )
+    # ``pip`` rejects conflicting versions of a package in a single pass
+    versions: Dict[str, List[str]] = {}
+    for req in requirements:
+        versions.setdefault(Requirement(req).name.lower(), []).append(req)
+    rounds = [
+        [reqs[idx] for reqs in versions.values() if idx < len(reqs)]
+        for idx in range(max((len(reqs) for reqs in versions.values()), default=0))
+    ]
+    LOG.info(f"Downloading {len(requirements)} distributions to {out}")
+    with TemporaryDirectory() as tmpdir:
+        for idx, batch in enumerate(rounds):
+            reqfile = Path(tmpdir, f"requirements-{idx}.txt")
+            reqfile.write_text("\n".join(batch) + "\n")
+            _run_command(
+                sys.executable,
+                "-m",
+                "pip",
+                "download",
+                "--no-deps",
+                f"--dest={out}",
+                *target,
+                "-r",
+                str(reqfile),
+            )
+
+
+def write_wheelhouse_config(outdir: Union[str, Path]) -> Path:
+    """Write the ``uv`` configuration for installing offline from the wheelhouse.
+
+    Parameters
+    ----------
+    outdir : str or Path
+        The wheelhouse.
+
+    Returns
+    -------
+    Path
+        The configuration file, for ``UV_CONFIG_FILE``.
+    """
+    out = Path(outdir)
+    out.mkdir(parents=True, exist_ok=True)
+    config = out / WHEELHOUSE_CONFIG
+    config.write_text(
+        "offline = true\nno-index = true\n"
+        f"find-links = [{json.dumps(str(out.resolve()))}]\n"
+    )
+
+    return config
+
+
+def _site_packages(python_path: str) -> List[Path]:
+    """Find the ``site-packages`` directories of an environment without running it.
+
+    Parameters
+    ----------
+    python_path : str
+        The path to the python executable for the environment.
+
+    Returns
+    -------
+    List[Path]
+        The ``site-packages`` directories. Empty if none can be found.
+    """
+    python = Path(python_path)
+    found: List[Path] = []
+    # ``bin/python`` or ``Scripts/python.exe`` in a virtual environment, or
+    # ``python.exe`` at the root of a conda environment on Windows
+    for root in (python.parent.parent, python.parent):
+        for pattern in ("lib/python*/site-packages", "Lib/site-packages"):
+            found.extend(path for path in root.glob(pattern) if path not in found)
+
+    return found
+
+
+def _read_installed_packages(site_packages: List[Path]) -> List[Dict[str, str]]:
+    """Read the name and version of the installed packages from their metadata.
+
+    Parameters
+    ----------
+    site_packages : list
+        The ``site-packages`` directories to read.
+
+    Returns
+    -------
+    List[Dict[str, str]]
+        The normalized name and version of each installed package, like the
+        output of ``pip list --format json``.
+    """
+    packages: Dict[str, str] = {}
+    for dist in distributions(path=[str(path) for path in site_packages]):
+        name = dist.metadata["Name"]
+        if not name:
+            continue
+        name = canonicalize_name(name)
+        if name not in packages:
+            packages[name] = dist.version
+
+    return [{"name": name, "version": version} for name, version in packages.items()]
+
+
+def _convert_toml_array_to_string(item: Union[Item, Any]) -> Any:
     if isinstance(item, Array):
         return "\n".join(item)
     elif isinstance(item, String):
         return str(item)
+    elif isinstance(item, Bool):
+        return item.value
+    elif isinstance(item, Integer):
+        return int(item)
+    elif isinstance(item, Float):
+        return float(item)
     else:
         raise ValueError
 
@@ -108,7 +1291,7 @@ def convert_requirements(requirements: str, conf: Optional[Dict] = None) -> Dict
         conf["envs"][-1]["upgrade"] = pkg
     # Create an environment with all requirements upgraded
     conf["envs"].append({})
-    conf["envs"][-1]["name"] = "all-requirements"
+    conf["envs"][-1]["name"] = ALL_REQUIREMENTS
     conf["envs"][-1]["upgrade"] = "\n".join(pkgs)
 
     return conf
@@ -383,6 +1566,36 @@ def parse_toml(
     return output
 
 
+def _lift_global_options(conf: Dict, schema: Dict) -> Dict:
+    """Move scalar global options out of the environment configurations.
+
+    The ``edgetest`` section of a configuration file is applied to every environment.
+    Any key in that section which is a global option in the ``schema`` (and not an
+    environment-level option) is popped from the environments and set once at the
+    top level of the configuration.
+
+    Parameters
+    ----------
+    conf : dict
+        The parsed configuration dictionary.
+    schema : dict
+        The Cerberus schema for the configuration.
+
+    Returns
+    -------
+    Dict
+        The configuration dictionary with global options at the top level.
+    """
+    envoptions = schema["envs"]["schema"]["schema"]
+    globaloptions = [key for key in schema if key != "envs" and key not in envoptions]
+    for env in conf.get("envs", []):
+        for key in globaloptions:
+            if key in env:
+                conf.setdefault(key, env.pop(key))
+
+    return conf
+
+
 def upgrade_requirements(
     fname_or_buf: str, upgraded_packages: List[Dict[str, str]]
 ) -> str:
@@ -416,23 +1629,26 @@ def upgrade_requirements(
         for val in cfg.splitlines()
         if not (val.strip().startswith("#") or val.strip() == "")
     ]
-    upgrades = {pkg["name"]: pkg["version"] for pkg in upgraded_packages}
+    upgrades = {
+        canonicalize_name(pkg["name"]): pkg["version"] for pkg in upgraded_packages
+    }
 
     for pkg in pkgs:
-        if pkg.name not in upgrades:
+        name = canonicalize_name(pkg.name)
+        if name not in upgrades:
             continue
         # Replace the spec
         specs = list(pkg.specifier)
         new_spec = list(pkg.specifier)
         for index, value in enumerate(specs):
             if value.operator == "<=":
-                new_spec[index] = Specifier(f"<={upgrades[pkg.name]}")
+                new_spec[index] = Specifier(f"<={upgrades[name]}")
             elif value.operator == "<":
                 new_spec[index] = Specifier(f"!={value.version}")
-                new_spec.append(Specifier(f"<={upgrades[pkg.name]}"))
+                new_spec.append(Specifier(f"<={upgrades[name]}"))
             elif value.operator == "==":
                 new_spec = Specifier(f">={value.version}") & Specifier(
-                    f"<={upgrades[pkg.name]}"
+                    f"<={upgrades[name]}"
                 )  # type: ignore
                 # End the loop
                 break
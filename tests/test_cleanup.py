@@ -0,0 +1,117 @@
+"""Test the garbage collection of the base directory."""
+
+import os
+import time
+from pathlib import Path
+
+from click.testing import CliRunner
+
+from edgetest.cleanup import collect_garbage, disk_usage, find_entries
+from edgetest.core import LAST_USED_MARKER, TestPackage, resolve_envs_dir
+from edgetest.interface import cli
+
+
+def _make_entry(path: Path, size: int, age: float) -> None:
+    """Make a removable entry last used ``age`` days ago."""
+    path.mkdir(parents=True)
+    (path / "data").write_bytes(b"x" * size)
+    (path / LAST_USED_MARKER).touch()
+    last_used = time.time() - age * 86400
+    os.utime(path / LAST_USED_MARKER, (last_used, last_used))
+
+
+def test_disk_usage(tmpdir):
+    """Test counting hard linked files once."""
+    location = Path(str(tmpdir))
+    (location / "first").mkdir()
+    (location / "first" / "data").write_bytes(b"x" * 100000)
+    (location / "second").mkdir()
+    os.link(location / "first" / "data", location / "second" / "data")
+    seen = set()
+
+    assert disk_usage(location / "first", seen) >= 100000
+    assert disk_usage(location / "second", seen) < 100000
+
+
+def test_collect_garbage(tmpdir):
+    """Test removing the least recently used entries."""
+    basedir = Path(str(tmpdir)) / ".edgetest"
+    _make_entry(basedir / "oldenv", 100000, age=30)
+    _make_entry(basedir / ".store" / "abc", 100000, age=10)
+    _make_entry(basedir / "newenv", 100000, age=1)
+    _make_entry(basedir / "logs" / "myrun", 1000, age=20)
+    _make_entry(basedir / "wheels" / "abc", 100000, age=50)
+    os.symlink(basedir / ".store" / "abc", basedir / "cachedenv")
+    (basedir / "myenv.lock").write_text("six==1.17.0\n")
+
+    entries = find_entries(basedir)
+
+    assert [entry.path.name for entry in entries][:2] == ["cachedenv", "newenv"]
+    assert entries[-1].path == basedir / "oldenv"
+
+    removed = collect_garbage(basedir, max_age=15, dry_run=True)
+
+    assert [entry.path.name for entry in removed] == ["oldenv", "myrun"]
+    assert (basedir / "oldenv").is_dir()
+
+    removed = collect_garbage(basedir, max_disk=150000)
+
+    assert [entry.path.name for entry in removed] == ["oldenv", "myrun", "abc"]
+    assert (basedir / "newenv").is_dir()
+    assert not (basedir / ".store" / "abc").exists()
+    # Links to removed environments in the store are removed too
+    assert not (basedir / "cachedenv").is_symlink()
+    # Durable caches and files are kept
+    assert (basedir / "wheels" / "abc").is_dir()
+    assert (basedir / "myenv.lock").is_file()
+
+
+def test_collect_garbage_envs_dir(tmpdir, plugin_manager):
+    """Test leaving data from other tools in a shared directory for environments."""
+    location = Path(str(tmpdir))
+    basedir = location / ".edgetest"
+    shared = location / "shared"
+    for name in ("someone_elses_data", "build-cache"):
+        _make_entry(shared / name, 1000, age=30)
+        (shared / name / LAST_USED_MARKER).unlink()
+    envs_dir = resolve_envs_dir(shared, basedir=basedir)
+    tester = TestPackage(
+        hook=plugin_manager.hook,
+        envname="myenv",
+        upgrade=["myupgrade"],
+        basedir=basedir,
+        envs_dir=envs_dir,
+    )
+    (envs_dir / "myenv").mkdir()
+    tester.setup(skip=True)
+    # Not created by edgetest, even in its own subdirectory
+    (envs_dir / "notanenv").mkdir()
+    os.symlink(shared / "build-cache", envs_dir / "otherlink")
+
+    assert envs_dir == shared / "edgetest"
+    assert [entry.path for entry in find_entries(basedir, envs_dir)] == [
+        envs_dir / "myenv"
+    ]
+
+    removed = collect_garbage(basedir, max_disk=0, envs_dir=envs_dir)
+
+    assert [entry.path for entry in removed] == [envs_dir / "myenv"]
+    assert (shared / "someone_elses_data" / "data").is_file()
+    assert (shared / "build-cache" / "data").is_file()
+    assert (envs_dir / "notanenv").is_dir()
+    assert (envs_dir / "otherlink").is_symlink()
+
+
+def test_gc_command(tmpdir):
+    """Test the ``gc`` command."""
+    basedir = Path(str(tmpdir)) / ".edgetest"
+    _make_entry(basedir / "oldenv", 1000, age=30)
+    _make_entry(basedir / "newenv", 1000, age=1)
+
+    runner = CliRunner()
+    result = runner.invoke(cli, ["gc", f"--basedir={basedir}", "--max-age=7"])
+
+    assert result.exit_code == 0
+    assert "Removed 1 entries" in result.output
+    assert not (basedir / "oldenv").exists()
+    assert (basedir / "newenv").is_dir()
@@ -1,12 +1,32 @@
 """Testing the core module."""
 
+import asyncio
+import gzip
+import json
+import os
 import platform
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from unittest.mock import PropertyMock, call, patch
+from subprocess import TimeoutExpired
+from typing import Dict, List
+from unittest.mock import AsyncMock, PropertyMock, call, patch
 
+import pluggy
 import pytest
 
-from edgetest.core import TestPackage
+from edgetest import hookspecs, lib
+from edgetest.core import (
+    THREAD_ENV_VARS,
+    TestPackage,
+    resolve_basedir,
+    resolve_envs_dir,
+)
+from edgetest.report import gen_report, write_report_file
+from edgetest.utils import CommandTimeoutError
+
+hookimpl = pluggy.HookimplMarker("edgetest")
 
 
 @patch.object(Path, "cwd")
@@ -74,9 +94,19 @@ def test_basic_setup(mock_popen, mock_path, tmpdir, plugin_manager):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=".",
+        ),
+        call(
+            ("uv", "pip", "freeze", f"--python={py_loc!s}"),
+            stdout=-1,
+            stderr=-1,
+            universal_newlines=True,
+            cwd=None,
         ),
     ]
     assert tester.setup_status
+    assert set(tester.timings) == {"create", "install", "update"}
+    assert all(duration >= 0 for duration in tester.timings.values())
 
 
 @patch.object(Path, "cwd")
@@ -177,12 +207,142 @@ def test_setup_extras(mock_popen, mock_path, tmpdir, plugin_manager):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=".",
+        ),
+        call(
+            ("uv", "pip", "freeze", f"--python={py_loc!s}"),
+            stdout=-1,
+            stderr=-1,
+            universal_newlines=True,
+            cwd=None,
         ),
     ]
 
     assert tester.setup_status
 
 
+@patch.object(Path, "cwd")
+@patch("edgetest.utils.Popen", autospec=True)
+def test_setup_wheel(mock_popen, mock_path, tmpdir, plugin_manager):
+    """Test installing a pre-built wheel of the local package."""
+    location = tmpdir.mkdir("mydir")
+    mock_path.return_value = Path(str(location))
+    mock_popen.return_value.communicate.return_value = ("output", "error")
+    type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
+
+    wheel = Path(str(location)) / "mypackage-0.1.0-py3-none-any.whl"
+    tester = TestPackage(
+        hook=plugin_manager.hook, envname="myenv", upgrade=["myupgrade"]
+    )
+    tester.wheel = str(wheel)
+    tester.setup(extras=["tests"])
+
+    env_loc = str(Path(str(location)) / ".edgetest" / "myenv")
+    if platform.system() == "Windows":
+        py_loc = Path(env_loc) / "Scripts" / "python"
+    else:
+        py_loc = Path(env_loc) / "bin" / "python"
+
+    assert mock_popen.call_args_list[0] == call(
+        (
+            "uv",
+            "pip",
+            "install",
+            f"--python={py_loc!s}",
+            f"mypackage[tests] @ {wheel.as_uri()}",
+        ),
+        stdout=-1,
+        stderr=-1,
+        universal_newlines=True,
+        cwd=".",
+    )
+    assert tester.setup_status
+
+
+class FakeCreateEnvironment:
+    """Skip creating the environment."""
+
+    @hookimpl
+    def create_environment(self, basedir: str, envname: str, conf: Dict):
+        """Create the virtual environment for testing."""
+        pass
+
+
+class FakeInstall:
+    """Install the environment in a single resolution."""
+
+    @hookimpl
+    def run_install(self, basedir: str, envname: str, requirements: List[str]):
+        """Install everything at once."""
+        return True
+
+
+@patch.object(Path, "cwd")
+@patch("edgetest.lib._run_command", autospec=True)
+def test_setup_combined_install(mock_run, mock_path, tmpdir):
+    """Test installing everything in a single resolution with the default plugin."""
+    location = tmpdir.mkdir("mydir")
+    mock_path.return_value = Path(str(location))
+    pm = pluggy.PluginManager("edgetest")
+    pm.add_hookspecs(hookspecs)
+    pm.register(lib)
+    pm.register(FakeCreateEnvironment())
+
+    tester = TestPackage(hook=pm.hook, envname="myenv", upgrade=["myupgrade"])
+    tester.setup(extras=["tests"], deps=["-r reqs.txt"], combined_install=True)
+
+    py_loc = lib.path_to_python(str(Path(str(location)) / ".edgetest"), "myenv")
+
+    assert mock_run.call_count == 1
+    assert mock_run.call_args.args[:-1] == (
+        "uv",
+        "pip",
+        "install",
+        f"--python={py_loc}",
+        "-r",
+        "reqs.txt",
+        ".[tests]",
+        "myupgrade",
+        "--override",
+    )
+    assert tester.setup_status
+
+    mock_run.side_effect = RuntimeError("unable to resolve")
+    tester.setup(combined_install=True)
+
+    assert not tester.setup_status
+
+
+@patch.object(Path, "cwd")
+@patch("edgetest.utils.Popen", autospec=True)
+def test_setup_combined_install_fallback(mock_popen, mock_path, tmpdir, plugin_manager):
+    """Test falling back to sequential installs if the plugins cannot combine them."""
+    location = tmpdir.mkdir("mydir")
+    mock_path.return_value = Path(str(location))
+    mock_popen.return_value.communicate.return_value = ("output", "error")
+    type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
+
+    # The fake plugin replaces ``run_update`` without implementing ``run_install``
+    plugin_manager.register(lib)
+    tester = TestPackage(
+        hook=plugin_manager.hook, envname="myenv", upgrade=["myupgrade"]
+    )
+    tester.setup(combined_install=True)
+
+    assert mock_popen.call_args_list[0].args[0][-1] == "."
+    assert all("--override" not in cl.args[0] for cl in mock_popen.call_args_list)
+    assert tester.setup_status
+
+    # Unless the plugin also implements ``run_install``
+    mock_popen.reset_mock()
+    plugin_manager.register(FakeInstall())
+    tester.setup(combined_install=True)
+
+    # Only the lockfile is written
+    assert [args[0][2] for args, _ in mock_popen.call_args_list] == ["freeze"]
+    assert tester.setup_status
+
+
 @patch.object(Path, "cwd")
 @patch("edgetest.utils.Popen", autospec=True)
 def test_setup_pip_deps(mock_popen, mock_path, tmpdir, plugin_manager):
@@ -221,12 +381,21 @@ def test_setup_pip_deps(mock_popen, mock_path, tmpdir, plugin_manager):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=".",
         ),
         call(
             ("uv", "pip", "install", f"--python={py_loc}", "."),
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=".",
+        ),
+        call(
+            ("uv", "pip", "freeze", f"--python={py_loc!s}"),
+            stdout=-1,
+            stderr=-1,
+            universal_newlines=True,
+            cwd=None,
         ),
     ]
 
@@ -271,12 +440,51 @@ def test_setup_pip_deps_error(mock_popen, mock_path, tmpdir, plugin_manager):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=".",
         ),
     ]
 
     assert not tester.setup_status
 
 
+@patch.object(Path, "cwd")
+@patch("edgetest.utils.Popen", autospec=True)
+def test_upgraded_packages(mock_popen, mock_path, tmpdir, plugin_manager):
+    """Test reading the upgraded packages without running a command."""
+    location = tmpdir.mkdir("mydir")
+    mock_path.return_value = Path(str(location))
+
+    tester = TestPackage(
+        hook=plugin_manager.hook, envname="myenv", upgrade=["my-upgrade[extra]"]
+    )
+    site_packages = Path(tester.python_path).parent.parent / "lib" / "python3.11"
+    site_packages = site_packages / "site-packages"
+
+    def _install(version):
+        for dist_info in site_packages.glob("*.dist-info"):
+            (dist_info / "METADATA").unlink()
+            dist_info.rmdir()
+        dist_info = site_packages / f"my_upgrade-{version}.dist-info"
+        dist_info.mkdir(parents=True)
+        (dist_info / "METADATA").write_text(
+            f"Metadata-Version: 2.1\nName: my_upgrade\nVersion: {version}\n"
+        )
+
+    _install("1.0.0")
+
+    assert tester.upgraded_packages() == [{"name": "my-upgrade", "version": "1.0.0"}]
+
+    # The installed packages are cached until the next set up
+    _install("2.0.0")
+
+    assert tester.upgraded_packages() == [{"name": "my-upgrade", "version": "1.0.0"}]
+
+    tester.setup(skip=True)
+
+    assert tester.upgraded_packages() == [{"name": "my-upgrade", "version": "2.0.0"}]
+    mock_popen.assert_not_called()
+
+
 @patch.object(Path, "cwd")
 @patch("edgetest.core.Popen", autospec=True)
 def test_run_tests(mock_popen, mock_path, tmpdir, plugin_manager):
@@ -308,5 +516,770 @@ def test_run_tests(mock_popen, mock_path, tmpdir, plugin_manager):
         call(
             (f"{py_loc}", "-m", "pytest", "tests", "-m", "not integration"),
             universal_newlines=True,
+            cwd=".",
+        )
+    ]
+    assert "test" in tester.timings
+
+
+@patch.object(Path, "cwd")
+@patch("edgetest.core.os.sched_setaffinity", create=True)
+@patch("edgetest.core.Popen", autospec=True)
+def test_run_tests_cpus(mock_popen, mock_affinity, mock_path, tmpdir, plugin_manager):
+    """Test running the tests on a set of CPUs."""
+    mock_path.return_value = Path(str(tmpdir))
+    mock_popen.return_value.pid = 1234
+    type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
+
+    tester = TestPackage(
+        hook=plugin_manager.hook, envname="myenv", upgrade=["myupgrade"]
+    )
+    tester.setup_status = True
+    tester.run_tests(command="pytest", cpus=[2, 3])
+
+    env = mock_popen.call_args.kwargs["env"]
+
+    assert env["EDGETEST_CPUS"] == "2,3"
+    assert all(env[name] == "2" for name in THREAD_ENV_VARS)
+    mock_affinity.assert_called_once_with(1234, [2, 3])
+
+
+@patch.object(Path, "cwd")
+@patch("edgetest.utils.Popen", autospec=True)
+def test_setup_timeout(mock_popen, mock_path, tmpdir, plugin_manager):
+    """Test stopping the set up when it runs past the timeout."""
+    mock_path.return_value = Path(str(tmpdir))
+    # No such process group
+    mock_popen.return_value.pid = 2**30
+
+    def _communicate(timeout=None):
+        if timeout is not None:
+            raise TimeoutExpired(cmd="uv", timeout=timeout)
+        return ("", "")
+
+    mock_popen.return_value.communicate.side_effect = _communicate
+    type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
+
+    tester = TestPackage(
+        hook=plugin_manager.hook, envname="myenv", upgrade=["myupgrade"]
+    )
+    tester.setup(setup_timeout=60)
+
+    assert not tester.setup_status
+    assert tester.timed_out == "setup"
+    assert mock_popen.call_args.kwargs["start_new_session"]
+
+    tester.setup()
+
+    assert tester.setup_status
+    assert tester.timed_out is None
+
+
+@patch("edgetest.core._run_command", autospec=True)
+@patch("edgetest.lib._run_command", autospec=True)
+def test_setup_timeout_in_hook(mock_lib_run, mock_run, tmpdir):
+    """Test recording a timeout wrapped by a plugin hook."""
+    mock_run.return_value = ("", 0)
+    mock_lib_run.side_effect = CommandTimeoutError("Timed out")
+    pm = pluggy.PluginManager("edgetest")
+    pm.add_hookspecs(hookspecs)
+    pm.register(lib)
+    pm.register(FakeCreateEnvironment())
+
+    tester = TestPackage(
+        hook=pm.hook,
+        envname="myenv",
+        upgrade=["myupgrade"],
+        basedir=Path(str(tmpdir)),
+    )
+    tester.setup(setup_timeout=60)
+
+    assert not tester.setup_status
+    assert tester.timed_out == "setup"
+
+
+@patch.object(Path, "cwd")
+@patch.object(TestPackage, "python_path", new_callable=PropertyMock)
+def test_run_tests_timeout(mock_python, mock_path, tmpdir, plugin_manager):
+    """Test killing tests which run past the timeout."""
+    mock_path.return_value = Path(str(tmpdir))
+    mock_python.return_value = sys.executable
+    tester = TestPackage(
+        hook=plugin_manager.hook, envname="myenv", upgrade=["myupgrade"]
+    )
+    tester.setup_status = True
+    command = "timeit -n 1 -r 1 'import time; time.sleep(30)'"
+
+    start = time.monotonic()
+    tester.run_tests(command=command, timeout=1, max_memory=2 * 1024**3)
+
+    assert time.monotonic() - start < 10
+    assert not tester.status
+    assert tester.timed_out == "test"
+
+    tester.timed_out = None
+    asyncio.run(tester.run_tests_async(command=command, timeout=1))
+
+    assert not tester.status
+    assert tester.timed_out == "test"
+
+
+@patch("edgetest.core._run_command", autospec=True)
+@patch.object(TestPackage, "python_path", new_callable=PropertyMock)
+def test_concurrent_testers(mock_python, mock_run, tmpdir, plugin_manager):
+    """Test setting up and testing many environments from a thread pool."""
+    mock_python.return_value = sys.executable
+    mock_run.return_value = ("", 0)
+    cwd = Path.cwd()
+    environ = dict(os.environ)
+    testers = []
+    for idx in range(16):
+        location = tmpdir.mkdir(f"mypackage{idx}")
+        # Run with ``python -m probe`` from the working directory of the tests
+        location.join("probe.py").write(
+            "import os, tempfile; print(os.getcwd()); print(tempfile.gettempdir())\n"
+        )
+        testers.append(
+            TestPackage(
+                hook=plugin_manager.hook,
+                envname=f"myenv{idx}",
+                upgrade=["myupgrade"],
+                package_dir=str(location),
+                run_id="myrun",
+                basedir=Path(str(tmpdir)) / "basedir",
+            )
+        )
+
+    def _run(tester):
+        tester.setup(snapshot=True)
+        tester.run_tests("probe")
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(_run, testers))
+
+    # The state of the current process is untouched
+    assert Path.cwd() == cwd
+    assert dict(os.environ) == environ
+    for tester in testers:
+        assert tester.status
+        with gzip.open(tester.log_files()["test"], "rt") as infile:
+            output = infile.read().splitlines()
+        assert Path(output[1]).resolve() == Path(tester.snapshot_dir).resolve()
+        assert Path(output[2]).resolve() == Path(tester.tmp_dir).resolve()
+    # The local package is installed from each snapshot with its own ``TMPDIR``
+    tmp_dirs = {tester.snapshot_dir: tester.tmp_dir for tester in testers}
+    installs = [kwargs for args, kwargs in mock_run.call_args_list if args[-1] == "."]
+
+    assert len(installs) == len(testers)
+    assert {kwargs["cwd"] for kwargs in installs} == set(tmp_dirs)
+    assert all(
+        kwargs["env"]["TMPDIR"] == tmp_dirs[kwargs["cwd"]] for kwargs in installs
+    )
+
+
+@patch.object(Path, "cwd")
+@patch.object(TestPackage, "python_path", new_callable=PropertyMock)
+def test_run_tests_log(mock_python, mock_path, tmpdir, plugin_manager):
+    """Test streaming the output of the tests to a compressed log."""
+    mock_path.return_value = Path(str(tmpdir))
+    mock_python.return_value = sys.executable
+    tester = TestPackage(
+        hook=plugin_manager.hook,
+        envname="myenv",
+        upgrade=["myupgrade"],
+        run_id="myrun",
+    )
+    tester.setup_status = True
+    log = Path(str(tmpdir)) / ".edgetest" / "logs" / "myrun" / "myenv" / "test.log.gz"
+
+    assert tester.log_files() == {}
+
+    tester.run_tests(command="timeit -n 1 -r 1 'pass'")
+
+    assert tester.status
+    assert tester.log_files() == {"test": str(log)}
+    with gzip.open(log, "rt") as infile:
+        assert "1 loop" in infile.read()
+
+    asyncio.run(tester.run_tests_async(command="timeit -n 1 -r 1 'x ='"))
+
+    assert not tester.status
+    with gzip.open(log, "rt") as infile:
+        assert "SyntaxError" in infile.read()
+
+
+@patch.object(Path, "cwd")
+@patch("edgetest.core.Popen", autospec=True)
+@patch("edgetest.utils.Popen", autospec=True)
+def test_setup_snapshot(mock_popen, mock_cpopen, mock_path, tmpdir, plugin_manager):
+    """Test setting up and testing an environment in a snapshot."""
+    location = tmpdir.mkdir("mydir")
+    location.join("setup.py").write("from setuptools import setup\nsetup()\n")
+    mock_path.return_value = Path(str(location))
+    mock_popen.return_value.communicate.return_value = ("output", "error")
+    type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
+    type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
+
+    tester = TestPackage(
+        hook=plugin_manager.hook,
+        envname="myenv",
+        upgrade=["myupgrade"],
+        package_dir=str(location),
+    )
+    tester.setup(snapshot=True)
+    tester.run_tests("pytest")
+
+    basedir = Path(str(location)) / ".edgetest"
+    snapshot = basedir / ".snapshots" / "myenv"
+
+    assert tester.setup_status
+    assert tester.work_dir == str(snapshot)
+    assert (snapshot / "setup.py").is_file()
+    assert not (snapshot / ".edgetest").exists()
+    assert mock_popen.call_args_list[0].kwargs["cwd"] == str(snapshot)
+    assert mock_cpopen.call_args.kwargs["cwd"] == str(snapshot)
+    assert mock_cpopen.call_args.kwargs["env"]["TMPDIR"] == str(
+        basedir / ".tmp" / "myenv"
+    )
+
+
+@patch.object(Path, "cwd")
+def test_resolve_basedir(mock_path, tmpdir, monkeypatch):
+    """Test resolving the base directory and the directory for the environments."""
+    location = Path(str(tmpdir))
+    mock_path.return_value = location
+    monkeypatch.delenv("EDGETEST_BASEDIR", raising=False)
+    monkeypatch.delenv("EDGETEST_ENVS_DIR", raising=False)
+
+    assert resolve_basedir() == location / ".edgetest"
+    assert resolve_envs_dir() == location / ".edgetest"
+
+    monkeypatch.setenv("EDGETEST_BASEDIR", "durable")
+    monkeypatch.setenv("EDGETEST_ENVS_DIR", str(location / "ramdisk"))
+
+    assert resolve_basedir() == location / "durable"
+    assert resolve_basedir("configured") == location / "configured"
+    # The environments go in a subdirectory of a possibly shared directory
+    assert resolve_envs_dir() == location / "ramdisk" / "edgetest"
+    assert (location / "ramdisk" / "edgetest").is_dir()
+
+
+@patch.object(Path, "cwd")
+def test_envs_dir(mock_path, tmpdir, plugin_manager, monkeypatch):
+    """Test placing the environments apart from the durable files."""
+    location = Path(str(tmpdir))
+    monkeypatch.delenv("EDGETEST_BASEDIR", raising=False)
+    monkeypatch.delenv("EDGETEST_ENVS_DIR", raising=False)
+    tester = TestPackage(
+        hook=plugin_manager.hook,
+        envname="myenv",
+        upgrade=["myupgrade"],
+        run_id="myrun",
+        basedir=location / "durable",
+        envs_dir=location / "ramdisk",
+    )
+
+    assert tester.python_path.startswith(str(location / "ramdisk" / "myenv"))
+    assert tester.lockfile == location / "durable" / "myenv.lock"
+    assert tester.log_dir == location / "durable" / "logs" / "myrun" / "myenv"
+    # The directories are resolved once
+    mock_path.assert_not_called()
+
+    tester = TestPackage(hook=plugin_manager.hook, envname="myenv", upgrade=["a"])
+    mock_path.return_value = location
+
+    assert tester.envs_dir == tester.basedir == location / ".edgetest"
+
+
+@patch.object(TestPackage, "installed_packages", autospec=True)
+def test_cleanup(mock_installed, tmpdir, plugin_manager):
+    """Test removing an environment after testing."""
+    basedir = Path(str(tmpdir)) / "basedir"
+    tester = TestPackage(
+        hook=plugin_manager.hook,
+        envname="myenv",
+        upgrade=["myupgrade"],
+        basedir=basedir,
+    )
+    (basedir / "myenv").mkdir(parents=True)
+    tester.tmp_dir = str(basedir / ".tmp" / "myenv")
+    Path(tester.tmp_dir).mkdir(parents=True)
+    tester.setup_status = True
+    tester.cleanup()
+
+    mock_installed.assert_called_once_with(tester)
+    assert not (basedir / "myenv").exists()
+    assert not (basedir / ".tmp" / "myenv").exists()
+    assert tester.tmp_dir is None
+
+    # Cached environments stay in the store
+    (basedir / ".store" / "abc").mkdir(parents=True)
+    os.symlink(basedir / ".store" / "abc", basedir / "myenv")
+    tester.cleanup()
+
+    assert not (basedir / "myenv").is_symlink()
+    assert (basedir / ".store" / "abc").is_dir()
+
+
+@patch("edgetest.utils.Popen", autospec=True)
+def test_cleanup_failed_setup(mock_popen, tmpdir, plugin_manager_environment_error):
+    """Test reporting on an environment removed after a failed set up."""
+    basedir = Path(str(tmpdir)) / "basedir"
+    mock_popen.return_value.communicate.return_value = ("", "error")
+    type(mock_popen.return_value).returncode = PropertyMock(return_value=1)
+    tester = TestPackage(
+        hook=plugin_manager_environment_error.hook,
+        envname="myenv",
+        upgrade=["myupgrade"],
+        basedir=basedir,
+    )
+    tester.setup()
+    (basedir / "myenv").mkdir(parents=True)
+    tester.cleanup()
+
+    assert not tester.setup_status
+    assert not (basedir / "myenv").exists()
+    assert tester.installed_packages() == []
+    assert tester.upgraded_packages() == []
+    assert "Environment" in gen_report([tester])
+    write_report_file([tester], str(basedir / "report.json"))
+
+    results = json.loads((basedir / "report.json").read_text())["environments"]
+
+    assert results[0]["name"] == "myenv"
+    assert results[0]["upgraded"] == []
+
+
+@patch.object(Path, "cwd")
+@patch("edgetest.core.Popen", autospec=True)
+@patch("edgetest.utils.Popen", autospec=True)
+def test_setup_wheelhouse(mock_popen, mock_cpopen, mock_path, tmpdir, plugin_manager):
+    """Test installing from the wheelhouse."""
+    location = tmpdir.mkdir("mydir")
+    mock_path.return_value = Path(str(location))
+    mock_popen.return_value.communicate.return_value = ("output", "error")
+    type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
+
+    tester = TestPackage(
+        hook=plugin_manager.hook, envname="myenv", upgrade=["myupgrade"]
+    )
+    tester.wheelhouse = str(location / "wheelhouse")
+    tester.setup()
+
+    assert tester.setup_status
+    for args in mock_popen.call_args_list:
+        assert args.kwargs["env"]["UV_CONFIG_FILE"] == str(
+            location / "wheelhouse" / "uv.toml"
         )
+
+    type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
+    tester.run_tests("pytest")
+
+    # The test command runs with the environment of the current process
+    assert "UV_CONFIG_FILE" not in (mock_cpopen.call_args.kwargs.get("env") or {})
+
+
+@patch("edgetest.core._run_command", autospec=True)
+def test_setup_base_env(mock_run, tmpdir, plugin_manager):
+    """Test cloning environments from a shared base environment."""
+    location = tmpdir.mkdir("mypackage")
+    location.join("setup.py").write("from setuptools import setup\nsetup()\n")
+    basedir = Path(str(tmpdir)) / "basedir"
+    mock_run.return_value = ("", 0)
+
+    testers = [
+        TestPackage(
+            hook=plugin_manager.hook,
+            envname=envname,
+            upgrade=["myupgrade"],
+            package_dir=str(location),
+            basedir=basedir,
+        )
+        for envname in ("myenv", "otherenv")
     ]
+    for tester in testers:
+        tester.setup(deps=["otherpkg"], base_env=True)
+
+    bases = list((basedir / ".bases").iterdir())
+
+    assert all(tester.setup_status for tester in testers)
+    assert len(bases) == 1
+    assert (bases[0] / ".edgetest-complete").is_file()
+    assert (basedir / "myenv").is_dir()
+    assert (basedir / "otherenv").is_dir()
+    # Clones get their own markers
+    envs = (bases[0], basedir / "myenv", basedir / "otherenv")
+    markers = [path / ".edgetest-last-used" for path in envs]
+    assert len({marker.stat().st_ino for marker in markers}) == 3
+    assert not (basedir / "myenv" / ".edgetest-complete").exists()
+    os.utime(markers[1], (0, 0))
+    assert markers[0].stat().st_mtime > 0
+    assert markers[2].stat().st_mtime > 0
+    # The dependencies and local package are only installed into the base
+    installs = [
+        args
+        for args, _ in mock_run.call_args_list
+        if args[:3] == ("uv", "pip", "install")
+    ]
+    py_loc = plugin_manager.hook.path_to_python(
+        basedir=str(basedir / ".bases"), envname=bases[0].name
+    )
+    assert installs == [
+        ("uv", "pip", "install", f"--python={py_loc}", "otherpkg"),
+        ("uv", "pip", "install", f"--python={py_loc}", "."),
+    ]
+
+    # Different additional dependencies need a separate base
+    testers[0].setup(base_env=True)
+
+    assert len(list((basedir / ".bases").iterdir())) == 2
+
+
+@patch("edgetest.core._run_command_async", autospec=True)
+def test_setup_async_base_env(mock_run, tmpdir, plugin_manager):
+    """Test waiting for a shared base environment without holding the executor."""
+    location = tmpdir.mkdir("mypackage")
+    location.join("setup.py").write("from setuptools import setup\nsetup()\n")
+    basedir = Path(str(tmpdir)) / "basedir"
+    mock_run.return_value = ("", 0)
+
+    # More environments than worker threads wait for the same base
+    testers = [
+        TestPackage(
+            hook=plugin_manager.hook,
+            envname=f"myenv{idx}",
+            upgrade=["myupgrade"],
+            package_dir=str(location),
+            basedir=basedir,
+        )
+        for idx in range(6)
+    ]
+
+    async def _setup_all():
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=3)
+        )
+        await asyncio.wait_for(
+            asyncio.gather(
+                *(
+                    tester.setup_async(deps=["otherpkg"], base_env=True)
+                    for tester in testers
+                )
+            ),
+            timeout=30,
+        )
+
+    asyncio.run(_setup_all())
+
+    assert all(tester.setup_status for tester in testers)
+    assert len(list((basedir / ".bases").iterdir())) == 1
+    assert all((basedir / tester.envname).is_dir() for tester in testers)
+
+
+@patch.object(Path, "cwd")
+@patch("edgetest.core._run_command_async", autospec=True)
+def test_setup_async(mock_run, mock_path, tmpdir, plugin_manager):
+    """Test creating an environment on the event loop."""
+    location = tmpdir.mkdir("mydir")
+    mock_path.return_value = Path(str(location))
+    mock_run.return_value = ("output", 0)
+
+    tester = TestPackage(
+        hook=plugin_manager.hook, envname="myenv", upgrade=["myupgrade"]
+    )
+    asyncio.run(tester.setup_async(deps=["otherpkg"]))
+
+    env_loc = Path(str(location)) / ".edgetest" / "myenv"
+    if platform.system() == "Windows":
+        py_loc = env_loc / "Scripts" / "python"
+    else:
+        py_loc = env_loc / "bin" / "python"
+
+    assert mock_run.call_args_list == [
+        call("uv", "pip", "install", f"--python={py_loc!s}", "otherpkg", cwd="."),
+        call("uv", "pip", "install", f"--python={py_loc!s}", ".", cwd="."),
+        call("uv", "pip", "freeze", f"--python={py_loc!s}"),
+    ]
+    assert tester.setup_status
+
+    mock_run.side_effect = RuntimeError()
+    asyncio.run(tester.setup_async())
+
+    assert not tester.setup_status
+
+
+@patch.object(Path, "cwd")
+@patch("edgetest.core._run_command", autospec=True)
+def test_setup_from_lock(mock_run, mock_path, tmpdir, plugin_manager):
+    """Test writing the lockfile and rebuilding the environment from it."""
+    location = tmpdir.mkdir("mydir")
+    mock_path.return_value = Path(str(location))
+    package_dir = location.mkdir("mypackage")
+    package_dir.join("setup.cfg").write("[options]\ninstall_requires = six\n")
+
+    def _run(*args, cwd=None):
+        if args[2] == "freeze":
+            local = Path(str(package_dir)).resolve().as_uri()
+            return f"six==1.17.0\nmypackage @ {local}\n", 0
+        return "", 0
+
+    mock_run.side_effect = _run
+    tester = TestPackage(
+        hook=plugin_manager.hook,
+        envname="myenv",
+        upgrade=["six"],
+        package_dir=str(package_dir),
+    )
+    tester.setup(from_lock=True)
+
+    lockfile = Path(str(location)) / ".edgetest" / "myenv.lock"
+    assert tester.lockfile == lockfile
+    lines = lockfile.read_text().splitlines()
+    assert lines[1].startswith("# edgetest inputs: ")
+    # The local package is reinstalled from the source
+    assert lines[2:] == ["six==1.17.0"]
+
+    mock_run.reset_mock()
+    tester.setup(from_lock=True)
+
+    assert tester.setup_status
+    assert mock_run.call_args_list == [
+        call("uv", "pip", "sync", f"--python={tester.python_path}", str(lockfile)),
+        call(
+            "uv",
+            "pip",
+            "install",
+            f"--python={tester.python_path}",
+            "--no-deps",
+            ".",
+            cwd=str(package_dir),
+        ),
+    ]
+
+    # Changing the dependencies of the local package makes the lockfile stale
+    package_dir.join("setup.cfg").write("[options]\ninstall_requires = six<2\n")
+    mock_run.reset_mock()
+    tester.setup(from_lock=True)
+
+    assert "sync" not in [args[2] for args, _ in mock_run.call_args_list]
+    assert tester.setup_status
+
+
+@patch.object(Path, "cwd")
+@patch("edgetest.core._run_command", autospec=True)
+def test_setup_incremental(mock_run, mock_path, tmpdir, plugin_manager):
+    """Test reusing the previous result if nothing has changed."""
+    location = tmpdir.mkdir("mydir")
+    mock_path.return_value = Path(str(location))
+    package_dir = location.mkdir("mypackage")
+    package_dir.join("module.py").write("x = 1\n")
+    mock_run.return_value = ("myupgrade==2.0.0\n", 0)
+
+    tester = TestPackage(
+        hook=plugin_manager.hook,
+        envname="myenv",
+        upgrade=["myupgrade"],
+        package_dir=str(package_dir),
+    )
+    tester.setup(incremental=True, command="pytest")
+
+    assert tester.incremental_key is not None
+    assert not tester.cached
+
+    upgraded = [{"name": "myupgrade", "version": "2.0.0"}]
+    record = {"key": tester.incremental_key, "status": True, "upgraded": upgraded}
+    (Path(str(location)) / ".edgetest" / "results.json").write_text(
+        json.dumps({"myenv": record})
+    )
+    mock_run.reset_mock()
+    tester.setup(incremental=True, command="pytest")
+
+    assert tester.cached
+    assert tester.setup_status
+    assert tester.status
+    assert tester.upgraded_packages() == upgraded
+    # Only the dependencies are resolved
+    assert [args[2] for args, _ in mock_run.call_args_list] == ["compile"]
+
+    # Any change to the source is tested again
+    package_dir.join("module.py").write("x = 2\n")
+    tester.setup(incremental=True, command="pytest")
+
+    assert not tester.cached
+
+
+@patch.object(Path, "cwd")
+@patch("edgetest.core._run_command", autospec=True)
+def test_setup_resolve_requirement_files(mock_run, mock_path, tmpdir, plugin_manager):
+    """Test resolving requirements files included in ``deps`` from the package."""
+    location = tmpdir.mkdir("mydir")
+    mock_path.return_value = Path(str(location))
+    package_dir = location.mkdir("mypackage")
+    requirements = []
+
+    def run(*args, **kwargs):
+        if args[2] == "compile":
+            requirements.append(Path(args[-3]).read_text().splitlines())
+        return ("myupgrade==2.0.0\n", 0)
+
+    mock_run.side_effect = run
+
+    tester = TestPackage(
+        hook=plugin_manager.hook,
+        envname="myenv",
+        upgrade=["myupgrade"],
+        package_dir=str(package_dir),
+    )
+    tester.setup(
+        incremental=True,
+        command="pytest",
+        deps=[
+            "-r requirements-dev.txt",
+            "--constraint=/tmp/constraints.txt",
+            "-rdocs.txt",
+            "pandas>=1.0; python_version < '3.9'",
+        ],
+    )
+
+    base = Path(str(package_dir)).resolve()
+
+    assert requirements == [
+        [
+            ".",
+            f"-r {base / 'requirements-dev.txt'}",
+            "--constraint /tmp/constraints.txt",
+            f"-r {base / 'docs.txt'}",
+            "pandas>=1.0; python_version < '3.9'",
+        ]
+    ]
+
+
+@patch.object(Path, "cwd")
+@patch("edgetest.core.asyncio.create_subprocess_exec", autospec=True)
+def test_run_tests_async(mock_exec, mock_path, tmpdir, plugin_manager):
+    """Test running basic tests on the event loop."""
+    location = tmpdir.mkdir("mydir")
+    mock_path.return_value = Path(str(location))
+    mock_exec.return_value.wait = AsyncMock(return_value=1)
+
+    tester = TestPackage(
+        hook=plugin_manager.hook, envname="myenv", upgrade=["myupgrade"]
+    )
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(tester.run_tests_async(command="pytest tests"))
+
+    tester.setup_status = True
+    out = asyncio.run(tester.run_tests_async(command="pytest tests"))
+
+    assert out == 1
+    assert not tester.status
+    mock_exec.assert_called_with(tester.python_path, "-m", "pytest", "tests", cwd=".")
+
+
+@patch.object(Path, "cwd")
+@patch("edgetest.utils.Popen", autospec=True)
+def test_setup_cache(mock_popen, mock_path, tmpdir, plugin_manager):
+    """Test reusing an environment with the same fingerprint."""
+    location = tmpdir.mkdir("mydir")
+    mock_path.return_value = Path(str(location))
+    mock_popen.return_value.communicate.return_value = ("myupgrade==0.2.0\n", "")
+    type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
+
+    tester = TestPackage(
+        hook=plugin_manager.hook, envname="myenv", upgrade=["myupgrade"]
+    )
+    tester.setup(cache=True)
+
+    assert tester.setup_status
+    assert tester.fingerprint is not None
+    store = Path(str(location)) / ".edgetest" / ".store" / tester.fingerprint
+    assert (store / ".edgetest-complete").is_file()
+    assert tester.python_path == plugin_manager.hook.path_to_python(
+        basedir=store.parent, envname=tester.fingerprint
+    )
+    assert [args[0][2] for args, _ in mock_popen.call_args_list] == [
+        "compile",
+        "install",
+        "freeze",
+    ]
+
+    # A second environment with the same inputs reuses the store
+    mock_popen.reset_mock()
+    other = TestPackage(
+        hook=plugin_manager.hook, envname="otherenv", upgrade=["myupgrade"]
+    )
+    other.setup(cache=True)
+
+    assert other.setup_status
+    assert other.fingerprint == tester.fingerprint
+    # Nothing is installed into the shared environment
+    assert [args[0][2] for args, _ in mock_popen.call_args_list] == [
+        "compile",
+        "freeze",
+    ]
+    assert (Path(str(location)) / ".edgetest" / "otherenv").resolve() == store
+
+    # A change in the local package creates a new environment
+    with patch("edgetest.core._hash_source_tree", return_value="changed"):
+        other.setup(cache=True)
+
+    assert other.fingerprint != tester.fingerprint
+
+    # A change in the resolved versions creates a new environment
+    mock_popen.return_value.communicate.return_value = ("myupgrade==0.3.0\n", "")
+    other.setup(cache=True)
+
+    assert other.fingerprint != tester.fingerprint
+
+
+@patch("edgetest.core._run_command_async", autospec=True)
+def test_setup_async_cache(mock_run, tmpdir, plugin_manager):
+    """Test waiting for a cached environment without holding the executor."""
+    basedir = Path(str(tmpdir)) / "basedir"
+    mock_run.return_value = ("myupgrade==0.2.0\n", 0)
+
+    # More environments than worker threads share one fingerprint
+    testers = [
+        TestPackage(
+            hook=plugin_manager.hook,
+            envname=f"myenv{idx}",
+            upgrade=["myupgrade"],
+            basedir=basedir,
+        )
+        for idx in range(6)
+    ]
+
+    async def _setup_all():
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=3)
+        )
+        await asyncio.wait_for(
+            asyncio.gather(*(tester.setup_async(cache=True) for tester in testers)),
+            timeout=30,
+        )
+
+    asyncio.run(_setup_all())
+
+    assert all(tester.setup_status for tester in testers)
+    assert len({tester.fingerprint for tester in testers}) == 1
+    assert len(list((basedir / ".store").iterdir())) == 1
+
+
+@patch.object(Path, "cwd")
+@patch("edgetest.utils.Popen", autospec=True)
+def test_setup_cache_resolve_error(mock_popen, mock_path, tmpdir, plugin_manager):
+    """Test building without the cache if the dependencies can't be resolved."""
+    location = tmpdir.mkdir("mydir")
+    mock_path.return_value = Path(str(location))
+    mock_popen.return_value.communicate.return_value = ("output", "error")
+    type(mock_popen.return_value).returncode = PropertyMock(side_effect=[1, 0, 0, 0, 0])
+
+    tester = TestPackage(
+        hook=plugin_manager.hook, envname="myenv", upgrade=["myupgrade"]
+    )
+    tester.setup(cache=True)
+
+    assert tester.setup_status
+    assert tester.fingerprint is None
+    assert not (Path(str(location)) / ".edgetest" / ".store").exists()
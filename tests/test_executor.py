@@ -0,0 +1,360 @@
+"""Test the environment executor."""
+
+import asyncio
+import json
+import threading
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+from edgetest.core import TestPackage
+from edgetest.executor import (
+    build_wheels,
+    prefetch_wheelhouse,
+    record_results,
+    run_adaptive,
+    run_async,
+    run_environments,
+)
+from edgetest.schedule import ResourceBudget
+from edgetest.utils import _command_env
+
+ENVS = [
+    {"name": f"myenv{idx}", "upgrade": ["myupgrade"], "command": "pytest"}
+    for idx in range(4)
+]
+
+
+@patch.object(TestPackage, "run_tests", autospec=True)
+@patch.object(TestPackage, "setup", autospec=True)
+def test_run_environments(mock_setup, mock_run_tests, plugin_manager):
+    """Test running environments concurrently while preserving the order."""
+    barrier = threading.Barrier(len(ENVS), timeout=5)
+
+    def _setup(self, **options):
+        # Every environment must be in set up at the same time to pass the barrier
+        barrier.wait()
+        time.sleep(0.01 * (len(ENVS) - int(self.envname[-1])))
+        self.setup_status = True
+
+    mock_setup.side_effect = _setup
+
+    testers = [
+        TestPackage(
+            hook=plugin_manager.hook, envname=env["name"], upgrade=["myupgrade"]
+        )
+        for env in ENVS
+    ]
+    out = run_environments(testers=testers, envs=ENVS, jobs=len(ENVS))
+
+    assert out == testers
+    assert [tester.envname for tester in out] == [env["name"] for env in ENVS]
+    assert mock_run_tests.call_count == len(ENVS)
+
+
+@patch.object(TestPackage, "run_tests", autospec=True)
+@patch.object(TestPackage, "setup", autospec=True)
+def test_run_environments_nosetup_notest(mock_setup, mock_run_tests, plugin_manager):
+    """Test skipping set up and tests."""
+    testers = [
+        TestPackage(
+            hook=plugin_manager.hook, envname=env["name"], upgrade=["myupgrade"]
+        )
+        for env in ENVS
+    ]
+    run_environments(testers=testers, envs=ENVS, jobs=2, nosetup=True, notest=True)
+
+    for tester, env in zip(testers, ENVS):
+        mock_setup.assert_any_call(tester, skip=True, **env)
+    mock_run_tests.assert_not_called()
+
+
+@patch.object(TestPackage, "run_tests", autospec=True)
+@patch.object(TestPackage, "setup", autospec=True)
+def test_run_environments_pipeline(mock_setup, mock_run_tests, plugin_manager):
+    """Test that the next environment is set up while the previous one is tested."""
+    second_setup = threading.Event()
+
+    def _setup(self, **options):
+        if self.envname == "myenv1":
+            second_setup.set()
+        self.setup_status = True
+
+    def _run_tests(self, command):
+        if self.envname == "myenv0":
+            # Only possible if set up and testing are separate stages
+            assert second_setup.wait(timeout=5)
+        self.status = True
+        return 0
+
+    mock_setup.side_effect = _setup
+    mock_run_tests.side_effect = _run_tests
+
+    testers = [
+        TestPackage(
+            hook=plugin_manager.hook, envname=env["name"], upgrade=["myupgrade"]
+        )
+        for env in ENVS
+    ]
+    out = run_environments(testers=testers, envs=ENVS, setup_jobs=1, test_jobs=1)
+
+    assert out == testers
+    assert all(tester.status for tester in out)
+
+
+@patch.object(TestPackage, "run_tests", autospec=True)
+@patch.object(TestPackage, "setup", autospec=True)
+def test_run_environments_order(mock_setup, mock_run_tests, plugin_manager):
+    """Test starting the environments in the scheduled order."""
+    started = []
+
+    def _setup(self, **options):
+        started.append(self.envname)
+        self.setup_status = True
+
+    mock_setup.side_effect = _setup
+
+    testers = [
+        TestPackage(
+            hook=plugin_manager.hook, envname=env["name"], upgrade=["myupgrade"]
+        )
+        for env in ENVS
+    ]
+    out = run_environments(
+        testers=testers, envs=ENVS, setup_jobs=1, test_jobs=2, order=[2, 0, 3, 1]
+    )
+
+    assert started == ["myenv2", "myenv0", "myenv3", "myenv1"]
+    assert out == testers
+
+
+@patch.object(TestPackage, "run_tests", autospec=True)
+@patch.object(TestPackage, "setup", autospec=True)
+def test_run_environments_pin_cpus(mock_setup, mock_run_tests, plugin_manager):
+    """Test running concurrent test commands on disjoint CPUs."""
+    barrier = threading.Barrier(2, timeout=5)
+    cores = {}
+
+    def _setup(self, **options):
+        self.setup_status = True
+
+    def _run_tests(self, command, cpus=None):
+        cores[self.envname] = cpus
+        barrier.wait()
+
+    mock_setup.side_effect = _setup
+    mock_run_tests.side_effect = _run_tests
+
+    testers = [
+        TestPackage(
+            hook=plugin_manager.hook, envname=env["name"], upgrade=["myupgrade"]
+        )
+        for env in ENVS[:2]
+    ]
+    budget = ResourceBudget(cpus=4, pin=True, default_cpus=2)
+    run_environments(testers=testers, envs=ENVS[:2], jobs=2, budget=budget)
+
+    assert sorted(cores.values()) == [[0, 1], [2, 3]]
+
+
+@patch.object(Path, "cwd")
+@patch.object(TestPackage, "run_tests_async", autospec=True)
+@patch.object(TestPackage, "setup_async", autospec=True)
+def test_run_async(mock_setup, mock_run_tests, mock_path, tmpdir, plugin_manager):
+    """Test running environments on the event loop."""
+    mock_path.return_value = Path(str(tmpdir))
+
+    async def _setup(self, skip=False, **options):
+        await asyncio.sleep(0)
+        self.setup_status = self.envname != "myenv3"
+
+    mock_setup.side_effect = _setup
+    conf = {
+        "envs": [dict(env, package_dir=".") for env in ENVS],
+        "jobs": 2,
+    }
+
+    out = asyncio.run(run_async(conf, hook=plugin_manager.hook))
+
+    assert [tester.envname for tester in out] == [env["name"] for env in ENVS]
+    assert mock_setup.call_count == len(ENVS)
+    assert mock_run_tests.call_count == len(ENVS) - 1
+
+
+@patch.object(Path, "cwd")
+@patch("edgetest.executor.build_wheel", autospec=True)
+def test_build_wheels(mock_build, mock_path, tmpdir, plugin_manager):
+    """Test building each local package once."""
+    mock_path.return_value = Path(str(tmpdir))
+    variables = []
+
+    def build(**kwargs):
+        variables.append(_command_env({}))
+        if kwargs["package_dir"] == "other":
+            raise RuntimeError("failed")
+        return "/path/to/mypackage.whl"
+
+    mock_build.side_effect = build
+    testers = [
+        TestPackage(
+            hook=plugin_manager.hook,
+            envname=env["name"],
+            upgrade=["myupgrade"],
+            package_dir="other" if idx == 0 else ".",
+        )
+        for idx, env in enumerate(ENVS)
+    ]
+    for tester in testers[1:]:
+        tester.wheelhouse = "wheelhouse"
+    build_wheels(testers)
+
+    assert mock_build.call_count == 2
+    assert testers[0].wheel is None
+    assert all(tester.wheel == "/path/to/mypackage.whl" for tester in testers[1:])
+    # Build from the wheelhouse once it is filled
+    assert variables == [
+        {},
+        {"UV_CONFIG_FILE": str(Path("wheelhouse", "uv.toml"))},
+    ]
+
+
+@patch.object(Path, "cwd")
+@patch("edgetest.executor.download_distributions", autospec=True)
+@patch.object(TestPackage, "pinned_requirements", autospec=True)
+def test_prefetch_wheelhouse(
+    mock_pins, mock_download, mock_path, tmpdir, plugin_manager
+):
+    """Test prefetching the distributions for every environment in one pass."""
+    mock_path.return_value = Path(str(tmpdir))
+    mock_pins.side_effect = lambda tester, **env: [f"{env['name']}==1.0", "six==1.17.0"]
+    envs = [
+        dict(env, python_version="3.13" if idx == 0 else None)
+        for idx, env in enumerate(ENVS)
+    ]
+    testers = [
+        TestPackage(
+            hook=plugin_manager.hook, envname=env["name"], upgrade=["myupgrade"]
+        )
+        for env in envs
+    ]
+    prefetch_wheelhouse(testers, envs=envs, conf={})
+
+    wheelhouse = Path(str(tmpdir)) / ".edgetest" / "wheelhouse"
+
+    assert mock_download.call_count == 2
+    assert mock_download.call_args_list[1].args == (
+        ["myenv1==1.0", "myenv2==1.0", "myenv3==1.0", "six==1.17.0"],
+        wheelhouse,
+    )
+    assert mock_download.call_args_list[1].kwargs == {"python_version": None}
+    assert all(tester.wheelhouse == str(wheelhouse) for tester in testers)
+    assert (wheelhouse / "uv.toml").is_file()
+
+    # Fall back to the package index unless offline
+    for tester in testers:
+        tester.wheelhouse = None
+    mock_download.side_effect = RuntimeError("no network")
+    prefetch_wheelhouse(testers, envs=envs, conf={})
+
+    assert all(tester.wheelhouse is None for tester in testers)
+
+    prefetch_wheelhouse(testers, envs=envs, conf={"offline": True})
+
+    assert mock_download.call_count == 3
+    assert all(tester.wheelhouse == str(wheelhouse) for tester in testers)
+
+
+@patch.object(Path, "cwd")
+@patch.object(TestPackage, "upgraded_packages", autospec=True)
+def test_record_results(mock_upgraded, mock_path, tmpdir, plugin_manager):
+    """Test recording the results of tested environments."""
+    mock_path.return_value = Path(str(tmpdir))
+    mock_upgraded.return_value = [{"name": "myupgrade", "version": "2.0.0"}]
+    testers = [
+        TestPackage(
+            hook=plugin_manager.hook, envname=env["name"], upgrade=["myupgrade"]
+        )
+        for env in ENVS
+    ]
+    for idx, tester in enumerate(testers):
+        tester.setup_status = idx != 1
+        tester.status = idx == 0
+        tester.incremental_key = None if idx == 3 else f"key{idx}"
+    # A cached result is already recorded
+    testers[2].cached = True
+    record_results(testers)
+
+    results = json.loads((Path(str(tmpdir)) / ".edgetest" / "results.json").read_text())
+
+    assert results == {
+        "myenv0": {
+            "key": "key0",
+            "status": True,
+            "upgraded": [{"name": "myupgrade", "version": "2.0.0"}],
+        }
+    }
+
+
+@patch.object(TestPackage, "run_tests", autospec=True)
+@patch.object(TestPackage, "setup", autospec=True)
+def test_run_adaptive(mock_setup, mock_run_tests, plugin_manager):
+    """Test isolating failing upgrades with fewer environments than requirements."""
+    pkgs = [f"pkg{idx:02d}" for idx in range(16)]
+
+    def _setup(self, **options):
+        self.setup_status = True
+
+    def _run_tests(self, command):
+        # One package fails alone and two packages only fail together
+        upgraded = set(self.upgrade or [])
+        self.status = "pkg01" not in upgraded and not {"pkg02", "pkg03"} <= upgraded
+        return int(not self.status)
+
+    mock_setup.side_effect = _setup
+    mock_run_tests.side_effect = _run_tests
+    conf = {
+        "envs": [
+            {
+                "name": "all-requirements",
+                "upgrade": pkgs,
+                "command": "pytest",
+                "package_dir": ".",
+            },
+            # Covered by the search, like the environments generated per requirement
+            {
+                "name": "pkg00",
+                "upgrade": ["pkg00"],
+                "command": "pytest",
+                "package_dir": ".",
+            },
+            {
+                "name": "lower",
+                "lower": ["pkg00==1.0"],
+                "command": "pytest",
+                "package_dir": ".",
+            },
+        ],
+        "jobs": 2,
+    }
+    testers, culprits = run_adaptive(hook=plugin_manager.hook, conf=conf)
+
+    assert culprits == [["pkg01"], ["pkg02", "pkg03"]]
+    assert len(testers) < len(pkgs) + 1
+    assert testers[-1].envname == "all-requirements"
+    assert not testers[-1].status
+    # Other environments run alongside the search
+    assert testers[0].envname == "lower"
+    assert testers[0].lower == ["pkg00==1.0"]
+    assert testers[0].status
+    assert [tester.envname for tester in testers].count("lower") == 1
+
+    # A passing run only needs one environment
+    def _run_passing(self, command):
+        self.status = True
+        return 0
+
+    mock_run_tests.side_effect = _run_passing
+    testers, culprits = run_adaptive(hook=plugin_manager.hook, conf=conf)
+
+    assert [tester.envname for tester in testers] == ["lower", "all-requirements"]
+    assert culprits == []
@@ -0,0 +1,90 @@
+"""Test the run history."""
+
+import sqlite3
+from pathlib import Path
+from unittest.mock import patch
+
+from click.testing import CliRunner
+
+from edgetest.core import TestPackage
+from edgetest.history import (
+    HISTORY_FNAME,
+    _percentile,
+    env_stats,
+    gen_stats_report,
+    record_run,
+)
+from edgetest.interface import cli
+
+
+def test_percentile():
+    """Test interpolating percentiles."""
+    assert _percentile([], 50) is None
+    assert _percentile([3.0], 95) == 3.0
+    assert _percentile([4.0, 1.0, 3.0, 2.0], 50) == 2.5
+    assert _percentile([float(idx) for idx in range(101)], 95) == 95.0
+
+
+@patch.object(Path, "cwd")
+@patch.object(TestPackage, "upgraded_packages", autospec=True)
+def test_record_run(mock_upgraded, mock_path, tmpdir, plugin_manager):
+    """Test appending runs to the history and summarizing them."""
+    mock_path.return_value = Path(str(tmpdir))
+    mock_upgraded.return_value = [{"name": "myupgrade", "version": "2.0.0"}]
+    basedir = Path(str(tmpdir)) / ".edgetest"
+
+    assert env_stats(basedir) == []
+
+    for idx in range(3):
+        testers = [
+            TestPackage(
+                hook=plugin_manager.hook, envname=envname, upgrade=["myupgrade"]
+            )
+            for envname in ("fast", "slow")
+        ]
+        for tester in testers:
+            scale = 1.0 if tester.envname == "fast" else 10.0
+            tester.setup_status = True
+            tester.status = idx != 0
+            tester.timings = {"create": scale, "install": scale * idx, "test": scale}
+        # A result reused from a previous run doesn't count toward the durations
+        testers[0].cached = idx == 2
+        assert record_run(testers) == idx + 1
+
+    with sqlite3.connect(str(basedir / HISTORY_FNAME)) as conn:
+        versions = conn.execute("SELECT DISTINCT kind, name, version FROM versions")
+        assert versions.fetchall() == [("upgraded", "myupgrade", "2.0.0")]
+
+    stats = env_stats(basedir)
+
+    assert [env["name"] for env in stats] == ["slow", "fast"]
+    assert stats[0]["runs"] == 3
+    assert stats[0]["setup_p50"] == 20.0
+    assert stats[0]["test_p95"] == 10.0
+    assert stats[1]["setup_p95"] == 1.95
+    assert stats[1]["pass_rate"] == 2 / 3
+
+    report = gen_stats_report(basedir)
+
+    assert report.splitlines()[3].startswith("slow ")
+    assert "67%" in report
+
+
+@patch.object(Path, "cwd")
+def test_stats_cli(mock_path, tmpdir, plugin_manager):
+    """Test the ``stats`` subcommand."""
+    mock_path.return_value = Path(str(tmpdir))
+    tester = TestPackage(
+        hook=plugin_manager.hook, envname="myenv", upgrade=["myupgrade"]
+    )
+    tester.timings = {"create": 1.0, "test": 2.0}
+    record_run([tester])
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli, ["stats", f"--basedir={Path(str(tmpdir)) / '.edgetest'}"]
+    )
+
+    assert result.exit_code == 0
+    assert "myenv" in result.output
+    assert "Setup p50 (s)" in result.output
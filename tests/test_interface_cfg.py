@@ -2,7 +2,7 @@
 
 import platform
 from pathlib import Path
-from unittest.mock import PropertyMock, call, patch
+from unittest.mock import MagicMock, PropertyMock, call, patch
 
 from click.testing import CliRunner
 
@@ -125,8 +125,11 @@ all-requirements  True                True             myupgrade
 def test_cli_basic(mock_popen, mock_cpopen, mock_builder):
     """Test creating a basic environment."""
     mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    # Output is streamed to the logs
+    mock_popen.return_value.stdout = mock_popen.return_value.stderr = MagicMock()
     type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
     mock_cpopen.return_value.communicate.return_value = ("output", "error")
+    mock_cpopen.return_value.stdout = MagicMock()
     type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
 
     runner = CliRunner()
@@ -152,18 +155,28 @@ def test_cli_basic(mock_popen, mock_cpopen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=".",
         ),
         call(
             ("uv", "pip", "install", f"--python={py_loc!s}", "myupgrade", "--upgrade"),
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
+        ),
+        call(
+            ("uv", "pip", "freeze", f"--python={py_loc!s}"),
+            stdout=-1,
+            stderr=-1,
+            universal_newlines=True,
+            cwd=None,
         ),
         call(
             ("uv", "pip", "list", f"--python={py_loc!s}", "--format", "json"),
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
         ),
     ]
     assert mock_cpopen.call_args_list == [
@@ -176,7 +189,10 @@ def test_cli_basic(mock_popen, mock_cpopen, mock_builder):
                 "-m",
                 "not integration",
             ),
+            stdout=-1,
+            stderr=-2,
             universal_newlines=True,
+            cwd=".",
         )
     ]
 
@@ -189,8 +205,11 @@ def test_cli_basic(mock_popen, mock_cpopen, mock_builder):
 def test_cli_basic_lower(mock_popen, mock_cpopen, mock_builder):
     """Test creating a basic environment."""
     mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    # Output is streamed to the logs
+    mock_popen.return_value.stdout = mock_popen.return_value.stderr = MagicMock()
     type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
     mock_cpopen.return_value.communicate.return_value = ("output", "error")
+    mock_cpopen.return_value.stdout = MagicMock()
     type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
 
     runner = CliRunner()
@@ -216,12 +235,21 @@ def test_cli_basic_lower(mock_popen, mock_cpopen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=".",
         ),
         call(
             ("uv", "pip", "install", f"--python={py_loc!s}", "mylower==0.0.1"),
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
+        ),
+        call(
+            ("uv", "pip", "freeze", f"--python={py_loc!s}"),
+            stdout=-1,
+            stderr=-1,
+            universal_newlines=True,
+            cwd=None,
         ),
     ]
     assert mock_cpopen.call_args_list == [
@@ -234,7 +262,10 @@ def test_cli_basic_lower(mock_popen, mock_cpopen, mock_builder):
                 "-m",
                 "not integration",
             ),
+            stdout=-1,
+            stderr=-2,
             universal_newlines=True,
+            cwd=".",
         )
     ]
 
@@ -247,8 +278,11 @@ def test_cli_basic_lower(mock_popen, mock_cpopen, mock_builder):
 def test_cli_reqs(mock_popen, mock_cpopen, mock_builder):
     """Test running tests based on the requirements file."""
     mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    # Output is streamed to the logs
+    mock_popen.return_value.stdout = mock_popen.return_value.stderr = MagicMock()
     type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
     mock_cpopen.return_value.communicate.return_value = ("output", "error")
+    mock_cpopen.return_value.stdout = MagicMock()
     type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
 
     runner = CliRunner()
@@ -283,6 +317,7 @@ def test_cli_reqs(mock_popen, mock_cpopen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=".",
         ),
         call(
             (
@@ -296,12 +331,21 @@ def test_cli_reqs(mock_popen, mock_cpopen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
+        ),
+        call(
+            ("uv", "pip", "freeze", f"--python={py_myupgrade_loc!s}"),
+            stdout=-1,
+            stderr=-1,
+            universal_newlines=True,
+            cwd=None,
         ),
         call(
             ("uv", "pip", "install", f"--python={py_allreq_loc!s}", "."),
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=".",
         ),
         call(
             (
@@ -315,6 +359,14 @@ def test_cli_reqs(mock_popen, mock_cpopen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
+        ),
+        call(
+            ("uv", "pip", "freeze", f"--python={py_allreq_loc!s}"),
+            stdout=-1,
+            stderr=-1,
+            universal_newlines=True,
+            cwd=None,
         ),
         call(
             (
@@ -328,6 +380,7 @@ def test_cli_reqs(mock_popen, mock_cpopen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
         ),
         call(
             (
@@ -341,16 +394,23 @@ def test_cli_reqs(mock_popen, mock_cpopen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
         ),
     ]
     assert mock_cpopen.call_args_list == [
         call(
             (f"{py_myupgrade_loc!s}", "-m", "pytest"),
+            stdout=-1,
+            stderr=-2,
             universal_newlines=True,
+            cwd=".",
         ),
         call(
             (f"{py_allreq_loc!s}", "-m", "pytest"),
+            stdout=-1,
+            stderr=-2,
             universal_newlines=True,
+            cwd=".",
         ),
     ]
 
@@ -363,8 +423,11 @@ def test_cli_reqs(mock_popen, mock_cpopen, mock_builder):
 def test_cli_setup_reqs_update(mock_popen, mock_cpopen, mock_builder):
     """Test running tests and updating requirements in a ``setup.cfg`` file."""
     mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    # Output is streamed to the logs
+    mock_popen.return_value.stdout = mock_popen.return_value.stderr = MagicMock()
     type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
     mock_cpopen.return_value.communicate.return_value = ("output", "error")
+    mock_cpopen.return_value.stdout = MagicMock()
     type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
 
     runner = CliRunner()
@@ -389,8 +452,11 @@ def test_cli_setup_reqs_update(mock_popen, mock_cpopen, mock_builder):
 def test_cli_setup_extras_update(mock_popen, mock_cpopen, mock_builder):
     """Test running tests and updating extra installation requirements in a ``setup.cfg`` file."""
     mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    # Output is streamed to the logs
+    mock_popen.return_value.stdout = mock_popen.return_value.stderr = MagicMock()
     type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
     mock_cpopen.return_value.communicate.return_value = ("output", "error")
+    mock_cpopen.return_value.stdout = MagicMock()
     type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
 
     runner = CliRunner()
@@ -414,8 +480,11 @@ def test_cli_setup_extras_update(mock_popen, mock_cpopen, mock_builder):
 def test_cli_nosetup(mock_popen, mock_cpopen):
     """Test creating a basic environment."""
     mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    # Output is streamed to the logs
+    mock_popen.return_value.stdout = mock_popen.return_value.stderr = MagicMock()
     type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
     mock_cpopen.return_value.communicate.return_value = ("output", "error")
+    mock_cpopen.return_value.stdout = MagicMock()
     type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
 
     runner = CliRunner()
@@ -440,12 +509,16 @@ def test_cli_nosetup(mock_popen, mock_cpopen):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
         ),
     ]
     assert mock_cpopen.call_args_list == [
         call(
             (f"{py_loc}", "-m", "pytest", "tests", "-m", "not integration"),
+            stdout=-1,
+            stderr=-2,
             universal_newlines=True,
+            cwd=".",
         )
     ]
 
@@ -459,8 +532,11 @@ def test_cli_nosetup(mock_popen, mock_cpopen):
 def test_cli_nosetup_lower(mock_popen, mock_cpopen):
     """Test creating a basic environment."""
     mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    # Output is streamed to the logs
+    mock_popen.return_value.stdout = mock_popen.return_value.stderr = MagicMock()
     type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
     mock_cpopen.return_value.communicate.return_value = ("output", "error")
+    mock_cpopen.return_value.stdout = MagicMock()
     type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
 
     runner = CliRunner()
@@ -482,7 +558,10 @@ def test_cli_nosetup_lower(mock_popen, mock_cpopen):
     assert mock_cpopen.call_args_list == [
         call(
             (f"{py_loc}", "-m", "pytest", "tests", "-m", "not integration"),
+            stdout=-1,
+            stderr=-2,
             universal_newlines=True,
+            cwd=".",
         )
     ]
 
@@ -497,6 +576,8 @@ def test_cli_nosetup_lower(mock_popen, mock_cpopen):
 def test_cli_notest(mock_popen, mock_builder):
     """Test creating a basic environment."""
     mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    # Output is streamed to the logs
+    mock_popen.return_value.stdout = mock_popen.return_value.stderr = MagicMock()
     type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
 
     runner = CliRunner()
@@ -522,6 +603,7 @@ def test_cli_notest(mock_popen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=".",
         ),
         call(
             (
@@ -535,12 +617,21 @@ def test_cli_notest(mock_popen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
+        ),
+        call(
+            ("uv", "pip", "freeze", f"--python={py_loc!s}"),
+            stdout=-1,
+            stderr=-1,
+            universal_newlines=True,
+            cwd=None,
         ),
         call(
             ("uv", "pip", "list", f"--python={py_loc!s}", "--format", "json"),
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
         ),
     ]
 
@@ -552,6 +643,8 @@ def test_cli_notest(mock_popen, mock_builder):
 def test_cli_notest_lower(mock_popen, mock_builder):
     """Test creating a basic environment."""
     mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    # Output is streamed to the logs
+    mock_popen.return_value.stdout = mock_popen.return_value.stderr = MagicMock()
     type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
 
     runner = CliRunner()
@@ -577,6 +670,7 @@ def test_cli_notest_lower(mock_popen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=".",
         ),
         call(
             (
@@ -589,6 +683,14 @@ def test_cli_notest_lower(mock_popen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
+        ),
+        call(
+            ("uv", "pip", "freeze", f"--python={py_loc!s}"),
+            stdout=-1,
+            stderr=-1,
+            universal_newlines=True,
+            cwd=None,
         ),
     ]
 
@@ -596,3 +698,35 @@ def test_cli_notest_lower(mock_popen, mock_builder):
         result.output
         == f"""Skipping tests for myenv_lower\n{TABLE_OUTPUT_NOTEST_LOWER}"""
     )
+
+
+@patch("edgetest.lib.EnvBuilder", autospec=True)
+@patch("edgetest.core.Popen", autospec=True)
+@patch("edgetest.utils.Popen", autospec=True)
+def test_cli_reqs_jobs(mock_popen, mock_cpopen, mock_builder):
+    """Test running the requirements environments concurrently."""
+    mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    # Output is streamed to the logs
+    mock_popen.return_value.stdout = mock_popen.return_value.stderr = MagicMock()
+    type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
+    mock_cpopen.return_value.communicate.return_value = ("output", "error")
+    mock_cpopen.return_value.stdout = MagicMock()
+    type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
+
+    runner = CliRunner()
+
+    with runner.isolated_filesystem() as loc:
+        with open("requirements.txt", "w") as outfile:
+            outfile.write(REQS)
+
+        result = runner.invoke(cli, ["--jobs=2"])
+
+    assert result.exit_code == 0
+    assert len(mock_builder.return_value.create.call_args_list) == 2
+    for envname in ("myupgrade", "all-requirements"):
+        assert (
+            call(env_dir=Path(loc) / ".edgetest" / envname)
+            in mock_builder.return_value.create.call_args_list
+        )
+    assert mock_cpopen.call_count == 2
+    assert result.output == TABLE_OUTPUT_REQS
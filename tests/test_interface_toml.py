@@ -2,7 +2,7 @@
 
 import platform
 from pathlib import Path
-from unittest.mock import PropertyMock, call, patch
+from unittest.mock import MagicMock, PropertyMock, call, patch
 
 from click.testing import CliRunner
 
@@ -117,8 +117,11 @@ all-requirements  True                True             myupgrade
 def test_cli_basic(mock_popen, mock_cpopen, mock_builder):
     """Test creating a basic environment."""
     mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    # Output is streamed to the logs
+    mock_popen.return_value.stdout = mock_popen.return_value.stderr = MagicMock()
     type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
     mock_cpopen.return_value.communicate.return_value = ("output", "error")
+    mock_cpopen.return_value.stdout = MagicMock()
     type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
 
     runner = CliRunner()
@@ -144,6 +147,7 @@ def test_cli_basic(mock_popen, mock_cpopen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=".",
         ),
         call(
             (
@@ -157,12 +161,21 @@ def test_cli_basic(mock_popen, mock_cpopen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
+        ),
+        call(
+            ("uv", "pip", "freeze", f"--python={py_loc!s}"),
+            stdout=-1,
+            stderr=-1,
+            universal_newlines=True,
+            cwd=None,
         ),
         call(
             ("uv", "pip", "list", f"--python={py_loc!s}", "--format", "json"),
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
         ),
     ]
     assert mock_cpopen.call_args_list == [
@@ -175,7 +188,10 @@ def test_cli_basic(mock_popen, mock_cpopen, mock_builder):
                 "-m",
                 "not integration",
             ),
+            stdout=-1,
+            stderr=-2,
             universal_newlines=True,
+            cwd=".",
         )
     ]
 
@@ -188,8 +204,11 @@ def test_cli_basic(mock_popen, mock_cpopen, mock_builder):
 def test_cli_basic_lower(mock_popen, mock_cpopen, mock_builder):
     """Test creating a basic environment."""
     mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    # Output is streamed to the logs
+    mock_popen.return_value.stdout = mock_popen.return_value.stderr = MagicMock()
     type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
     mock_cpopen.return_value.communicate.return_value = ("output", "error")
+    mock_cpopen.return_value.stdout = MagicMock()
     type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
 
     runner = CliRunner()
@@ -215,6 +234,7 @@ def test_cli_basic_lower(mock_popen, mock_cpopen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=".",
         ),
         call(
             (
@@ -227,6 +247,14 @@ def test_cli_basic_lower(mock_popen, mock_cpopen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
+        ),
+        call(
+            ("uv", "pip", "freeze", f"--python={py_loc!s}"),
+            stdout=-1,
+            stderr=-1,
+            universal_newlines=True,
+            cwd=None,
         ),
     ]
     assert mock_cpopen.call_args_list == [
@@ -239,7 +267,10 @@ def test_cli_basic_lower(mock_popen, mock_cpopen, mock_builder):
                 "-m",
                 "not integration",
             ),
+            stdout=-1,
+            stderr=-2,
             universal_newlines=True,
+            cwd=".",
         )
     ]
 
@@ -252,8 +283,11 @@ def test_cli_basic_lower(mock_popen, mock_cpopen, mock_builder):
 def test_cli_reqs(mock_popen, mock_cpopen, mock_builder):
     """Test running tests based on the requirements file."""
     mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    # Output is streamed to the logs
+    mock_popen.return_value.stdout = mock_popen.return_value.stderr = MagicMock()
     type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
     mock_cpopen.return_value.communicate.return_value = ("output", "error")
+    mock_cpopen.return_value.stdout = MagicMock()
     type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
 
     runner = CliRunner()
@@ -288,6 +322,7 @@ def test_cli_reqs(mock_popen, mock_cpopen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=".",
         ),
         call(
             (
@@ -301,6 +336,14 @@ def test_cli_reqs(mock_popen, mock_cpopen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
+        ),
+        call(
+            ("uv", "pip", "freeze", f"--python={py_myupgrade_loc!s}"),
+            stdout=-1,
+            stderr=-1,
+            universal_newlines=True,
+            cwd=None,
         ),
         call(
             (
@@ -313,6 +356,7 @@ def test_cli_reqs(mock_popen, mock_cpopen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=".",
         ),
         call(
             (
@@ -326,6 +370,14 @@ def test_cli_reqs(mock_popen, mock_cpopen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
+        ),
+        call(
+            ("uv", "pip", "freeze", f"--python={py_allreq_loc!s}"),
+            stdout=-1,
+            stderr=-1,
+            universal_newlines=True,
+            cwd=None,
         ),
         call(
             (
@@ -339,6 +391,7 @@ def test_cli_reqs(mock_popen, mock_cpopen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
         ),
         call(
             (
@@ -352,16 +405,23 @@ def test_cli_reqs(mock_popen, mock_cpopen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
         ),
     ]
     assert mock_cpopen.call_args_list == [
         call(
             (f"{py_myupgrade_loc!s}", "-m", "pytest"),
+            stdout=-1,
+            stderr=-2,
             universal_newlines=True,
+            cwd=".",
         ),
         call(
             (f"{py_allreq_loc!s}", "-m", "pytest"),
+            stdout=-1,
+            stderr=-2,
             universal_newlines=True,
+            cwd=".",
         ),
     ]
 
@@ -374,8 +434,11 @@ def test_cli_reqs(mock_popen, mock_cpopen, mock_builder):
 def test_cli_setup_reqs_update(mock_popen, mock_cpopen, mock_builder):
     """Test running tests and updating requirements in a ``pyproject.toml`` file."""
     mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    # Output is streamed to the logs
+    mock_popen.return_value.stdout = mock_popen.return_value.stderr = MagicMock()
     type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
     mock_cpopen.return_value.communicate.return_value = ("output", "error")
+    mock_cpopen.return_value.stdout = MagicMock()
     type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
 
     runner = CliRunner()
@@ -400,8 +463,11 @@ def test_cli_setup_reqs_update(mock_popen, mock_cpopen, mock_builder):
 def test_cli_setup_extras_update(mock_popen, mock_cpopen, mock_builder):
     """Test running tests and updating extra installation requirements in a ``pyproject.toml`` file."""
     mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    # Output is streamed to the logs
+    mock_popen.return_value.stdout = mock_popen.return_value.stderr = MagicMock()
     type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
     mock_cpopen.return_value.communicate.return_value = ("output", "error")
+    mock_cpopen.return_value.stdout = MagicMock()
     type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
 
     runner = CliRunner()
@@ -425,8 +491,11 @@ def test_cli_setup_extras_update(mock_popen, mock_cpopen, mock_builder):
 def test_cli_nosetup(mock_popen, mock_cpopen):
     """Test creating a basic environment."""
     mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    # Output is streamed to the logs
+    mock_popen.return_value.stdout = mock_popen.return_value.stderr = MagicMock()
     type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
     mock_cpopen.return_value.communicate.return_value = ("output", "error")
+    mock_cpopen.return_value.stdout = MagicMock()
     type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
 
     runner = CliRunner()
@@ -451,12 +520,16 @@ def test_cli_nosetup(mock_popen, mock_cpopen):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
         ),
     ]
     assert mock_cpopen.call_args_list == [
         call(
             (f"{py_loc}", "-m", "pytest", "tests", "-m", "not integration"),
+            stdout=-1,
+            stderr=-2,
             universal_newlines=True,
+            cwd=".",
         )
     ]
 
@@ -470,8 +543,11 @@ def test_cli_nosetup(mock_popen, mock_cpopen):
 def test_cli_nosetup_lower(mock_popen, mock_cpopen):
     """Test creating a basic environment."""
     mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    # Output is streamed to the logs
+    mock_popen.return_value.stdout = mock_popen.return_value.stderr = MagicMock()
     type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
     mock_cpopen.return_value.communicate.return_value = ("output", "error")
+    mock_cpopen.return_value.stdout = MagicMock()
     type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
 
     runner = CliRunner()
@@ -493,7 +569,10 @@ def test_cli_nosetup_lower(mock_popen, mock_cpopen):
     assert mock_cpopen.call_args_list == [
         call(
             (f"{py_loc}", "-m", "pytest", "tests", "-m", "not integration"),
+            stdout=-1,
+            stderr=-2,
             universal_newlines=True,
+            cwd=".",
         )
     ]
 
@@ -508,6 +587,8 @@ def test_cli_nosetup_lower(mock_popen, mock_cpopen):
 def test_cli_notest(mock_popen, mock_builder):
     """Test creating a basic environment."""
     mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    # Output is streamed to the logs
+    mock_popen.return_value.stdout = mock_popen.return_value.stderr = MagicMock()
     type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
 
     runner = CliRunner()
@@ -533,6 +614,7 @@ def test_cli_notest(mock_popen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=".",
         ),
         call(
             (
@@ -546,12 +628,21 @@ def test_cli_notest(mock_popen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
+        ),
+        call(
+            ("uv", "pip", "freeze", f"--python={py_loc!s}"),
+            stdout=-1,
+            stderr=-1,
+            universal_newlines=True,
+            cwd=None,
         ),
         call(
             ("uv", "pip", "list", f"--python={py_loc!s}", "--format", "json"),
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
         ),
     ]
 
@@ -563,6 +654,8 @@ def test_cli_notest(mock_popen, mock_builder):
 def test_cli_notest_lower(mock_popen, mock_builder):
     """Test creating a basic environment."""
     mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    # Output is streamed to the logs
+    mock_popen.return_value.stdout = mock_popen.return_value.stderr = MagicMock()
     type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
 
     runner = CliRunner()
@@ -588,6 +681,7 @@ def test_cli_notest_lower(mock_popen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=".",
         ),
         call(
             (
@@ -600,6 +694,14 @@ def test_cli_notest_lower(mock_popen, mock_builder):
             stdout=-1,
             stderr=-1,
             universal_newlines=True,
+            cwd=None,
+        ),
+        call(
+            ("uv", "pip", "freeze", f"--python={py_loc!s}"),
+            stdout=-1,
+            stderr=-1,
+            universal_newlines=True,
+            cwd=None,
         ),
     ]
 
@@ -1,3 +1,4 @@
+import sys
 from pathlib import Path
 from unittest.mock import patch
 
@@ -6,6 +7,7 @@ import pytest
 from edgetest.lib import (
     create_environment,
     path_to_python,
+    run_install,
     run_install_lower,
     run_update,
 )
@@ -39,6 +41,29 @@ def test_create_environment(mock_env_builder):
         create_environment("test", "test", {})
 
 
+@patch("edgetest.lib.EnvBuilder", autospec=True)
+@patch("edgetest.lib._run_command", autospec=True)
+def test_create_environment_uv(mock_run, mock_env_builder, tmpdir):
+    create_environment("test", "test", {"venv_backend": "uv"})
+    mock_run.assert_called_with(
+        "uv", "venv", str(Path("test", "test")), f"--python={sys.executable}", env=None
+    )
+
+    # Requesting an interpreter uses ``uv``
+    cache = Path(str(tmpdir)) / "pythons"
+    create_environment(
+        "test", "test", {"python_version": "3.12", "python_cache": str(cache)}
+    )
+    args, kwargs = mock_run.call_args
+    assert args == ("uv", "venv", str(Path("test", "test")), "--python=3.12")
+    assert kwargs["env"]["UV_PYTHON_INSTALL_DIR"] == str(cache)
+    mock_env_builder.assert_not_called()
+
+    mock_run.side_effect = RuntimeError()
+    with pytest.raises(RuntimeError):
+        create_environment("test", "test", {"python_version": "3.12"})
+
+
 @patch("edgetest.lib._run_command", autospec=True)
 def test_run_update(mock_run):
     python_path = path_to_python("test", "test")
@@ -70,3 +95,40 @@ def test_run_install_lower(mock_run):
         run_install_lower(
             "test", "test", ["package1==1", "package2==2"], {"test": "test"}
         )
+
+
+@patch("edgetest.lib._run_command", autospec=True)
+def test_run_install(mock_run):
+    python_path = path_to_python("test", "test")
+    overrides = []
+
+    def _install(*args, cwd=None):
+        overrides.append(Path(args[-1]).read_text())
+        return "", 0
+
+    mock_run.side_effect = _install
+    assert run_install(
+        "test", "test", ["-r", "reqs.txt", ".[tests]"], ["1", "2"], None, {}, "pkg"
+    )
+    args = mock_run.call_args.args
+    assert args[:-1] == (
+        "uv",
+        "pip",
+        "install",
+        f"--python={python_path}",
+        "-r",
+        "reqs.txt",
+        ".[tests]",
+        "1",
+        "2",
+        "--override",
+    )
+    assert mock_run.call_args.kwargs == {"cwd": "pkg"}
+    assert overrides == ["1\n2\n"]
+
+    run_install("test", "test", ["."], None, ["package1==1"], {}, ".")
+    assert overrides[-1] == "package1==1\n"
+
+    mock_run.side_effect = RuntimeError()
+    with pytest.raises(RuntimeError):
+        run_install("test", "test", ["."], ["1"], None, {}, ".")
@@ -1,9 +1,11 @@
+import json
+import xml.etree.ElementTree as ET
 from unittest.mock import patch
 
 import pytest
 
 from edgetest.core import TestPackage
-from edgetest.report import gen_report
+from edgetest.report import gen_junit, gen_report, gen_results, write_report_file
 
 
 @patch("edgetest.report.tabulate", autospec=True)
@@ -36,3 +38,137 @@ def test_report(
 
     with pytest.raises(ValueError):
         gen_report(tester_list, output_type="bad")
+
+
+@patch("edgetest.core.TestPackage.upgraded_packages", autospec=True)
+def test_report_cached(mock_upgraded, plugin_manager):
+    """Test marking results from a previous run."""
+    mock_upgraded.return_value = [{"name": "myupgrade", "version": "2.0.0"}]
+    tester = TestPackage(
+        hook=plugin_manager.hook, envname="myenv", upgrade=["myupgrade"]
+    )
+    tester.cached = True
+
+    assert "myenv (cached)" in gen_report([tester])
+
+
+@patch("edgetest.core.TestPackage.upgraded_packages", autospec=True)
+def test_report_timings(mock_upgraded, plugin_manager):
+    """Test adding the duration of each phase to the report."""
+    mock_upgraded.return_value = [{"name": "myupgrade", "version": "2.0.0"}]
+    testers = [
+        TestPackage(hook=plugin_manager.hook, envname=name, upgrade=["myupgrade"])
+        for name in ("myenv", "otherenv")
+    ]
+    testers[0].timings = {"create": 1.0, "install": 2.25, "test": 10.0}
+    testers[1].timings = {"create": 1.5, "test": 5.0}
+
+    report = gen_report(testers, output_type="github", timings=True)
+    header, _, first, second, total = report.splitlines()
+
+    assert "Create (s)" in header
+    assert "Test (s)" in header
+    assert [cell.strip() for cell in first.split("|")][-7:-1] == [
+        "",
+        "1.0",
+        "",
+        "2.2",
+        "",
+        "10.0",
+    ]
+    assert "otherenv" in second
+    assert [cell.strip() for cell in total.split("|")][1] == "Total"
+    assert [cell.strip() for cell in total.split("|")][-7:-1] == [
+        "0.0",
+        "2.5",
+        "0.0",
+        "2.2",
+        "0.0",
+        "15.0",
+    ]
+
+
+@patch("edgetest.core.TestPackage.upgraded_packages", autospec=True)
+def test_write_report_file(mock_upgraded, tmpdir, plugin_manager):
+    """Test writing JSON and JUnit XML results."""
+    mock_upgraded.return_value = [{"name": "myupgrade", "version": "2.0.0"}]
+    passing = TestPackage(
+        hook=plugin_manager.hook, envname="myenv", upgrade=["myupgrade"]
+    )
+    passing.setup_status, passing.status, passing.returncode = True, True, 0
+    passing.timings = {"create": 1.0, "test": 2.0}
+    failing = TestPackage(
+        hook=plugin_manager.hook, envname="myenv_lower", lower=["mylower==0.1"]
+    )
+    failing.setup_status, failing.returncode = True, 1
+    broken = TestPackage(
+        hook=plugin_manager.hook, envname="otherenv", upgrade=["myupgrade"]
+    )
+    testers = [passing, failing, broken]
+
+    fname = str(tmpdir.join("report.json"))
+    write_report_file(testers, filename=fname)
+    with open(fname) as infile:
+        results = json.load(infile)["environments"]
+
+    assert results[0] == {
+        "name": "myenv",
+        "setup_status": True,
+        "status": True,
+        "timed_out": None,
+        "returncode": 0,
+        "cached": False,
+        "upgraded": [{"name": "myupgrade", "version": "2.0.0"}],
+        "lowered": [],
+        "timings": {"create": 1.0, "test": 2.0},
+        "logs": {},
+    }
+    assert results[1]["lowered"] == [{"name": "mylower", "version": "0.1"}]
+
+    fname = str(tmpdir.join("report.xml"))
+    write_report_file(testers, filename=fname)
+    suites = ET.parse(fname).getroot()
+    cases = suites.findall("testsuite/testcase")
+
+    assert suites.attrib["tests"] == "3"
+    assert suites.attrib["failures"] == "1"
+    assert suites.attrib["errors"] == "1"
+    assert [case.attrib["name"] for case in cases] == [
+        "myenv",
+        "myenv_lower",
+        "otherenv",
+    ]
+    assert cases[0].attrib["time"] == "3.000"
+    assert cases[0].find("properties/property").attrib == {
+        "name": "upgraded:myupgrade",
+        "value": "2.0.0",
+    }
+    assert cases[0].find("failure") is None
+    assert cases[1].find("failure").attrib["message"].endswith("exit code 1")
+    assert cases[2].find("error") is not None
+
+    with pytest.raises(ValueError):
+        write_report_file(testers, filename=str(tmpdir.join("report.txt")))
+
+
+@patch.object(TestPackage, "upgraded_packages", autospec=True)
+def test_report_timed_out(mock_upgraded, plugin_manager):
+    """Test reporting environments which ran past their timeout."""
+    mock_upgraded.return_value = [{"name": "myupgrade", "version": "2.0.0"}]
+    setup = TestPackage(hook=plugin_manager.hook, envname="myenv", upgrade=["a"])
+    setup.timed_out = "setup"
+    test = TestPackage(hook=plugin_manager.hook, envname="otherenv", upgrade=["a"])
+    test.setup_status, test.timed_out = True, "test"
+
+    report = gen_report([setup, test])
+    rows = report.splitlines()
+
+    assert "Timed out" in rows[3] and "False" in rows[3]
+    assert "True" in rows[4] and "Timed out" in rows[4]
+
+    cases = ET.fromstring(gen_junit(gen_results([setup, test]))).findall(
+        "testsuite/testcase"
+    )
+
+    assert cases[0].find("error").attrib["message"].startswith("Timed out")
+    assert cases[1].find("failure").attrib["message"] == "Tests timed out"
@@ -0,0 +1,217 @@
+"""Test ordering the environments."""
+
+import threading
+from pathlib import Path
+from unittest.mock import patch
+
+import pluggy
+import pytest
+
+from edgetest import hookspecs
+from edgetest.core import TestPackage
+from edgetest.history import record_run
+from edgetest.schedule import (
+    ResourceBudget,
+    estimate_durations,
+    order_environments,
+    resource_budget,
+    schedule_environments,
+)
+
+ENVS = [
+    {"name": "small", "upgrade": ["pkg0"]},
+    {"name": "medium", "upgrade": ["pkg0", "pkg1"]},
+    {"name": "all-requirements", "upgrade": ["pkg0", "pkg1", "pkg2", "pkg3"]},
+    {"name": "new", "upgrade": ["pkg0", "pkg1", "pkg2"]},
+]
+
+STATS = [
+    {
+        "name": "medium",
+        "setup_p50": 30.0,
+        "test_p50": 10.0,
+        "recent_pass_rate": 0.0,
+    },
+    {
+        "name": "small",
+        "setup_p50": 5.0,
+        "test_p50": 5.0,
+        "recent_pass_rate": 1.0,
+    },
+    {
+        "name": "all-requirements",
+        "setup_p50": None,
+        "test_p50": None,
+        "recent_pass_rate": 1.0,
+    },
+]
+
+hookimpl = pluggy.HookimplMarker("edgetest")
+
+
+class FakeOrder:
+    """Run the environments in reverse alphabetical order."""
+
+    @hookimpl
+    def order_environments(self, envs, conf, durations):
+        return sorted((env["name"] for env in envs), reverse=True)[:2]
+
+
+def test_estimate_durations():
+    """Test estimating the duration of environments without history."""
+    durations = estimate_durations(envs=ENVS, stats=STATS)
+
+    # The median of 10 and 20 seconds per package is used for unseen environments
+    assert durations == {
+        "small": 10.0,
+        "medium": 40.0,
+        "all-requirements": 60.0,
+        "new": 45.0,
+    }
+    assert estimate_durations(envs=ENVS, stats=[])["all-requirements"] == 4.0
+
+
+@pytest.mark.parametrize(
+    "schedule, expected",
+    [
+        ("config", ["small", "medium", "all-requirements", "new"]),
+        ("ljf", ["all-requirements", "new", "medium", "small"]),
+        ("fail-fast-first", ["medium", "new", "small", "all-requirements"]),
+    ],
+)
+def test_order_environments(schedule, expected):
+    """Test the scheduling policies."""
+    out = order_environments(
+        envs=ENVS,
+        schedule=schedule,
+        durations=estimate_durations(envs=ENVS, stats=STATS),
+        pass_rates={env["name"]: env["recent_pass_rate"] for env in STATS},
+    )
+
+    assert out == expected
+
+
+def test_order_environments_error():
+    """Test an invalid scheduling policy."""
+    with pytest.raises(ValueError):
+        order_environments(envs=ENVS, schedule="random", durations={}, pass_rates={})
+
+
+def test_schedule_environments(tmpdir, plugin_manager):
+    """Test ordering the environments with the run history and plugins."""
+    basedir = Path(str(tmpdir))
+    testers = [
+        TestPackage(hook=plugin_manager.hook, envname=env["name"], upgrade=["pkg0"])
+        for env in ENVS[:2]
+    ]
+    testers[0].timings = {"create": 100.0}
+    testers[1].timings = {"create": 1.0}
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(Path, "cwd", lambda: basedir)
+        record_run(testers)
+
+    def _schedule(hook, schedule):
+        return schedule_environments(
+            hook=hook,
+            envs=ENVS,
+            conf={"schedule": schedule},
+            basedir=basedir / ".edgetest",
+        )
+
+    assert _schedule(plugin_manager.hook, "config") == [0, 1, 2, 3]
+    # The history puts ``small`` before ``medium`` despite it having fewer packages
+    assert _schedule(plugin_manager.hook, "ljf") == [2, 3, 0, 1]
+
+    pm = pluggy.PluginManager("edgetest")
+    pm.add_hookspecs(hookspecs)
+    pm.register(FakeOrder())
+
+    # Environments left out by the plugin run last
+    assert _schedule(pm.hook, "config") == [0, 3, 1, 2]
+
+
+def test_resource_budget():
+    """Test admitting environments while they fit in the budget."""
+    gb = 1024**3
+    budget = ResourceBudget(
+        cpus=4,
+        memory=10 * gb,
+        requirements={"big": (1, 6 * gb), "big2": (1, 6 * gb), "huge": (8, 20 * gb)},
+    )
+    admitted = threading.Event()
+
+    def _run(envname):
+        with budget.admit(envname):
+            admitted.set()
+
+    with budget.admit("big"):
+        # Unknown environments need 1 CPU and no memory
+        with budget.admit("small"):
+            thread = threading.Thread(target=_run, args=("big2",))
+            thread.start()
+            assert not admitted.wait(timeout=0.1)
+        assert not admitted.wait(timeout=0.1)
+    thread.join(timeout=5)
+    assert admitted.is_set()
+
+    # Environments larger than the budget run alone
+    with budget.admit("huge"):
+        pass
+
+
+@patch.object(Path, "cwd")
+def test_resource_budget_history(mock_path, tmpdir, plugin_manager):
+    """Test the resources each environment needs."""
+    mock_path.return_value = Path(str(tmpdir))
+    tester = TestPackage(hook=plugin_manager.hook, envname="medium", upgrade=["pkg0"])
+    tester.timings = {"test": 1.0}
+    tester.peak_memory = 2048
+    record_run([tester])
+
+    envs = [
+        {"name": "small", "upgrade": ["pkg0"], "cpus": 2, "max_memory": 1024},
+        {"name": "medium", "upgrade": ["pkg0"], "cpus": None, "max_memory": None},
+        {"name": "new", "upgrade": ["pkg0"]},
+    ]
+    basedir = Path(str(tmpdir)) / ".edgetest"
+    budget = resource_budget(envs=envs, conf={"admission": True}, basedir=basedir)
+
+    assert budget.cpus >= 1
+    assert budget.requirements == {
+        "small": (2, 1024),
+        "medium": (1, 2048),
+        # As much as the largest recorded environment
+        "new": (1, 2048),
+    }
+
+    # Without any history, a share of the available memory
+    with patch("edgetest.schedule.available_memory", return_value=8192):
+        budget = resource_budget(
+            envs=envs, conf={"admission": True}, basedir=Path(str(tmpdir)) / "other"
+        )
+
+    assert budget.requirements["new"] == (1, 2048)
+    assert budget.requirements["medium"] == (1, 2048)
+    assert budget.requirements["small"] == (2, 1024)
+
+    # Without admission, only the CPUs are shared between the test commands
+    with patch("edgetest.schedule.available_cores", return_value=list(range(8))):
+        budget = resource_budget(
+            envs=envs, conf={"pin_cpus": True, "test_jobs": 3}, basedir=basedir
+        )
+
+    assert budget.pin
+    assert budget.memory is None
+    assert budget.requirements["new"] == (2, 0)
+    assert budget.requirements["small"] == (2, 1024)
+
+
+def test_resource_budget_cores():
+    """Test giving each environment a disjoint set of CPUs."""
+    budget = ResourceBudget(cpus=4, cores=[2, 3, 5, 7], requirements={"big": (3, 0)})
+
+    with budget.admit("big") as big, budget.admit("small") as small:
+        assert big == [2, 3, 5]
+        assert small == [7]
+    with budget.admit("small") as small:
+        assert small == [2]
@@ -1,20 +1,48 @@
 """Test utility functions."""
 
+import asyncio
+import gzip
+import math
+import os
+import sys
 from pathlib import Path
+from subprocess import Popen
 from unittest.mock import mock_open, patch
 
-from tomlkit import array, string
+import pytest
+from tomlkit import array, boolean, integer, string
 
 from edgetest.schema import BASE_SCHEMA, EdgetestValidator, Schema
 from edgetest.utils import (
+    OUTPUT_TAIL_CHARS,
+    CommandTimeoutError,
     _convert_toml_array_to_string,
+    _hash_source_tree,
     _isin_case_dashhyphen_ins,
+    _lift_global_options,
+    _read_installed_packages,
+    _run_command,
+    _run_command_async,
+    _site_packages,
+    _wait_for_process,
+    build_requires,
+    build_wheel,
+    clone_environment,
+    command_deadline,
+    command_log,
+    command_variables,
+    copy_distributions,
+    download_distributions,
     gen_requirements_config,
     get_lower_bounds,
     parse_cfg,
+    parse_memory,
     parse_toml,
+    snapshot_tree,
     upgrade_pyproject_toml,
+    upgrade_requirements,
     upgrade_setup_cfg,
+    write_wheelhouse_config,
 )
 
 REQS = """
@@ -36,6 +64,21 @@ command =
     pytest tests -m 'not integration'
 """
 
+CFG_GLOBAL_OPTIONS = """
+[edgetest]
+extras =
+    tests
+jobs = 4
+
+[edgetest.envs.myenv]
+upgrade =
+    myupgrade
+
+[edgetest.envs.myenv_lower]
+lower =
+    mylower
+"""
+
 CFG_REQS = """
 [options]
 install_requires =
@@ -517,6 +560,8 @@ def test_convert_toml_array_to_string():
 
     assert _convert_toml_array_to_string(test_array) == "a\nb\nc\nd"
     assert _convert_toml_array_to_string(test_string) == "abcd"
+    assert _convert_toml_array_to_string(integer(4)) == 4
+    assert _convert_toml_array_to_string(boolean("true")) is True
 
 
 def test_upgrade_setup_cfg(tmpdir):
@@ -572,3 +617,395 @@ def test_isin_case_dashhyphen_ins():
     assert _isin_case_dashhyphen_ins("Python_Dateutil", vals)
     assert not _isin_case_dashhyphen_ins("Python_Dateut1l", vals)
     assert not _isin_case_dashhyphen_ins("pandaspython-dateutil", vals)
+
+
+def test_lift_global_options(tmpdir):
+    """Test moving global options out of the environment configurations."""
+    location = tmpdir.mkdir("mylocation")
+    conf_loc = Path(str(location), "myconfig.ini")
+    with open(conf_loc, "w") as outfile:
+        outfile.write(CFG_GLOBAL_OPTIONS)
+
+    cfg = _lift_global_options(conf=parse_cfg(filename=conf_loc), schema=BASE_SCHEMA)
+
+    assert cfg["jobs"] == "4"
+    assert all("jobs" not in env for env in cfg["envs"])
+    assert all(env["extras"] == "\ntests" for env in cfg["envs"])
+
+    validator = EdgetestValidator(schema=BASE_SCHEMA)
+
+    assert validator.validate(cfg)
+    assert validator.document["jobs"] == 4
+
+
+def test_run_command_async():
+    """Test running a command with ``asyncio`` subprocesses."""
+    out, code = asyncio.run(
+        _run_command_async(sys.executable, "-c", "print('hello')", cwd=".")
+    )
+
+    assert out.strip() == "hello"
+    assert code == 0
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(_run_command_async(sys.executable, "-c", "raise SystemExit(1)"))
+
+
+def test_hash_source_tree(tmpdir):
+    """Test hashing the source tree of a local package."""
+    location = tmpdir.mkdir("mypackage")
+    location.join("setup.py").write("from setuptools import setup\nsetup()\n")
+    original = _hash_source_tree(str(location))
+
+    # Build artifacts and caches are excluded
+    location.mkdir("build").join("lib.py").write("x = 1\n")
+    location.mkdir(".edgetest").join("env.txt").write("env\n")
+    location.mkdir("mypackage.egg-info").join("PKG-INFO").write("info\n")
+
+    assert _hash_source_tree(str(location)) == original
+
+    # A base directory inside the package is excluded by path
+    basedir = Path(str(location)) / "cache" / "edgetest"
+    (basedir / "logs").mkdir(parents=True)
+    (basedir / "logs" / "setup.log.gz").write_bytes(b"log")
+    (Path(str(location)) / "cache" / "data.txt").write_text("data\n")
+    with_cache = _hash_source_tree(str(location), exclude_dirs=[basedir])
+    (basedir / "history.db").write_bytes(b"runs")
+
+    assert _hash_source_tree(str(location), exclude_dirs=[basedir]) == with_cache
+    assert _hash_source_tree(str(location)) != with_cache
+
+    location.join("setup.py").write("from setuptools import setup\nsetup(name='x')\n")
+
+    assert _hash_source_tree(str(location), exclude_dirs=[basedir]) != with_cache
+
+
+def test_snapshot_tree(tmpdir):
+    """Test taking a snapshot of a local package."""
+    location = tmpdir.mkdir("mypackage")
+    location.join("setup.py").write("from setuptools import setup\nsetup()\n")
+    location.mkdir("mypackage").join("__init__.py").write("x = 1\n")
+    location.mkdir(".git").join("HEAD").write("ref: refs/heads/main\n")
+    location.mkdir("build").join("lib.py").write("x = 1\n")
+    location.join(".coverage").write("data")
+    os.symlink("mypackage", str(location.join("alias")))
+    outdir = Path(str(tmpdir)) / "snapshots" / "myenv"
+    (outdir / "stale").mkdir(parents=True)
+
+    snapshot = snapshot_tree(str(location), outdir)
+
+    assert snapshot == outdir
+    assert sorted(path.name for path in outdir.iterdir()) == [
+        ".git",
+        "alias",
+        "mypackage",
+        "setup.py",
+    ]
+    assert (outdir / "alias").is_symlink()
+    assert (outdir / "mypackage" / "__init__.py").read_text() == "x = 1\n"
+
+    # New files in the snapshot don't change the package directory
+    (outdir / ".pytest_cache").mkdir()
+
+    assert not location.join(".pytest_cache").exists()
+
+
+def test_snapshot_tree_nested(tmpdir):
+    """Test taking a snapshot into a base directory inside the package."""
+    location = Path(str(tmpdir)) / "mypackage"
+    basedir = location / "cache" / "edgetest"
+    (basedir / "logs").mkdir(parents=True)
+    (location / "cache" / "data.txt").write_text("data\n")
+    (location / "setup.py").write_text("from setuptools import setup\nsetup()\n")
+    outdir = basedir / ".snapshots" / "myenv"
+
+    snapshot_tree(str(location), outdir, exclude_dirs=[basedir])
+    # Taking another snapshot doesn't copy the first one
+    snapshot_tree(str(location), outdir, exclude_dirs=[basedir])
+
+    assert sorted(path.name for path in outdir.iterdir()) == ["cache", "setup.py"]
+    assert [path.name for path in (outdir / "cache").iterdir()] == ["data.txt"]
+
+    # The snapshot is left out even without the base directory
+    other = location / "snapshots" / "myenv"
+    snapshot_tree(str(location), other)
+    snapshot_tree(str(location), other)
+
+    assert (other / "setup.py").is_file()
+    assert not (other / "snapshots" / "myenv").exists()
+
+
+def test_clone_environment(tmpdir):
+    """Test cloning a virtual environment."""
+    base = Path(str(tmpdir)) / "bases" / "mybase"
+    (base / "bin").mkdir(parents=True)
+    (base / "pyvenv.cfg").write_text(f"home = /usr/bin\ncommand = venv {base}\n")
+    (base / "bin" / "pytest").write_text(f"#!{base}/bin/python\nimport pytest\n")
+    (base / "bin" / "pytest").chmod(0o755)
+    os.symlink(sys.executable, str(base / "bin" / "python"))
+    site = base / "lib" / "site-packages"
+    site.mkdir(parents=True)
+    (site / "mypackage.py").write_text("x = 1\n")
+    outdir = Path(str(tmpdir)) / "myenv"
+    outdir.mkdir()
+
+    clone = clone_environment(base, outdir)
+
+    assert clone == outdir
+    assert (outdir / "bin" / "python").is_symlink()
+    assert os.readlink(str(outdir / "bin" / "python")) == sys.executable
+    assert (outdir / "bin" / "pytest").read_text() == (
+        f"#!{outdir}/bin/python\nimport pytest\n"
+    )
+    assert os.access(str(outdir / "bin" / "pytest"), os.X_OK)
+    assert str(outdir) in (outdir / "pyvenv.cfg").read_text()
+    assert (outdir / "lib" / "site-packages" / "mypackage.py").read_text() == "x = 1\n"
+    # The rewritten files don't change the base environment
+    assert (base / "bin" / "pytest").read_text().startswith(f"#!{base}/bin/python")
+    assert str(base) in (base / "pyvenv.cfg").read_text()
+
+
+def test_build_requires(tmpdir):
+    """Test reading the build requirements of a local package."""
+    location = tmpdir.mkdir("mypackage")
+
+    assert build_requires(str(location)) == ["setuptools>=40.8.0", "wheel"]
+
+    location.join("pyproject.toml").write(
+        '[build-system]\nrequires = ["hatchling"]\nbuild-backend = "hatchling.build"\n'
+    )
+
+    assert build_requires(str(location)) == ["hatchling"]
+
+
+@patch("edgetest.utils._run_command", autospec=True)
+def test_wheelhouse(mock_run, tmpdir):
+    """Test filling a wheelhouse and configuring offline installs from it."""
+    find_links = tmpdir.mkdir("find_links")
+    find_links.join("six-1.17.0-py2.py3-none-any.whl").write("wheel")
+    find_links.join("six-1.10.0.tar.gz").write("sdist")
+    find_links.join("README.md").write("readme")
+    wheelhouse = Path(str(tmpdir)) / "wheelhouse"
+
+    assert copy_distributions(str(find_links), wheelhouse) == 2
+    assert sorted(path.name for path in wheelhouse.iterdir()) == [
+        "six-1.10.0.tar.gz",
+        "six-1.17.0-py2.py3-none-any.whl",
+    ]
+    assert copy_distributions(str(find_links), wheelhouse) == 0
+
+    requirements = []
+
+    def _download(*args, cwd=None, env=None):
+        requirements.append(Path(args[-1]).read_text().split())
+        return "", 0
+
+    mock_run.side_effect = _download
+    download_distributions(
+        ["pytest==8.0.0", "six==1.10.0", "six==1.17.0"], wheelhouse, "3.13"
+    )
+
+    # Each pass has at most one version of a package
+    assert requirements == [["pytest==8.0.0", "six==1.10.0"], ["six==1.17.0"]]
+    assert "--python-version=3.13" in mock_run.call_args.args
+    assert "--only-binary=:all:" in mock_run.call_args.args
+
+    config = write_wheelhouse_config(wheelhouse)
+
+    assert config == wheelhouse / "uv.toml"
+    assert "offline = true" in config.read_text()
+    assert str(wheelhouse.resolve()) in config.read_text()
+
+
+@patch("edgetest.utils._run_command", autospec=True)
+def test_build_wheel(mock_run, tmpdir):
+    """Test building a wheel once and reusing it from the cache."""
+    location = tmpdir.mkdir("mypackage")
+    location.join("setup.py").write("from setuptools import setup\nsetup()\n")
+    outdir = Path(str(tmpdir)) / "wheels"
+
+    def _build(*args, cwd=None):
+        outpath = Path(args[3].split("=", 1)[1])
+        (outpath / "mypackage-0.1.0-py3-none-any.whl").write_text("wheel")
+        return "", 0
+
+    mock_run.side_effect = _build
+    wheel = build_wheel(str(location), outdir=outdir)
+
+    assert Path(wheel).name == "mypackage-0.1.0-py3-none-any.whl"
+    assert Path(wheel).parent == outdir / _hash_source_tree(str(location))
+    assert mock_run.call_count == 1
+
+    assert build_wheel(str(location), outdir=outdir) == wheel
+    assert mock_run.call_count == 1
+
+
+def test_read_installed_packages(tmpdir):
+    """Test reading the installed packages from the environment metadata."""
+    env = Path(str(tmpdir)) / "myenv"
+    site_packages = env / "lib" / "python3.11" / "site-packages"
+    for name, version in [("My_Package", "1.0.0"), ("other", "2.0")]:
+        dist_info = site_packages / f"{name}-{version}.dist-info"
+        dist_info.mkdir(parents=True)
+        (dist_info / "METADATA").write_text(
+            f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n"
+        )
+
+    assert _site_packages(str(env / "bin" / "python")) == [site_packages]
+    assert _site_packages(str(Path(str(tmpdir)) / "missing" / "bin" / "python")) == []
+    installed = sorted(
+        _read_installed_packages([site_packages]), key=lambda pkg: pkg["name"]
+    )
+    assert installed == [
+        {"name": "my-package", "version": "1.0.0"},
+        {"name": "other", "version": "2.0"},
+    ]
+    assert (
+        upgrade_requirements(
+            fname_or_buf="My_Package<=0.9,>=0.5\nother<=1.0",
+            upgraded_packages=installed,
+        )
+        == "My_Package<=1.0.0,>=0.5\nother<=2.0"
+    )
+
+
+@pytest.mark.skipif(not hasattr(os, "wait4"), reason="Requires os.wait4")
+def test_wait_for_process():
+    """Test measuring the peak memory usage of a process."""
+    popen = Popen(
+        (
+            sys.executable,
+            "-c",
+            "import sys; data = bytearray(64 * 1024**2); sys.exit(3)",
+        )
+    )
+    peak_memory = _wait_for_process(popen)
+
+    assert popen.returncode == 3
+    assert peak_memory >= 64 * 1024**2
+
+
+@pytest.mark.skipif(not Path("/proc").is_dir(), reason="Requires /proc")
+def test_wait_for_process_tree():
+    """Test adding up the memory usage of concurrent child processes."""
+    child = "import time; data = bytearray(64 * 1024**2); time.sleep(2)"
+    parent = (
+        "import subprocess, sys; "
+        f"procs = [subprocess.Popen([sys.executable, '-c', {child!r}]) "
+        "for _ in range(3)]; "
+        "[proc.wait() for proc in procs]"
+    )
+    popen = Popen((sys.executable, "-c", parent))
+    peak_memory = _wait_for_process(popen)
+
+    assert popen.returncode == 0
+    assert peak_memory >= 3 * 64 * 1024**2
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (1024, 1024),
+        ("1024", 1024),
+        ("512M", 512 * 1024**2),
+        ("1.5 GB", int(1.5 * 1024**3)),
+        ("6g", 6 * 1024**3),
+        ("2GiB", 2 * 1024**3),
+    ],
+)
+def test_parse_memory(value, expected):
+    """Test parsing amounts of memory."""
+    assert parse_memory(value) == expected
+
+
+def test_parse_memory_error():
+    """Test parsing an invalid amount of memory."""
+    with pytest.raises(ValueError):
+        parse_memory("lots")
+
+
+def test_command_deadline():
+    """Test killing commands which run past the deadline."""
+    sleep = (sys.executable, "-c", "import time; time.sleep(30)")
+    with command_deadline(0.5):
+        assert (
+            _run_command(sys.executable, "-c", "print('hello')")[0].strip() == "hello"
+        )
+        with pytest.raises(CommandTimeoutError):
+            _run_command(*sleep)
+        # Later commands fail immediately
+        with pytest.raises(CommandTimeoutError):
+            _run_command(sys.executable, "-c", "print('hello')")
+    with command_deadline(0.5), pytest.raises(CommandTimeoutError):
+        asyncio.run(_run_command_async(*sleep))
+
+    assert _run_command(sys.executable, "-c", "print('hello')")[1] == 0
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Requires Linux")
+def test_command_deadline_cpu_time():
+    """Test limiting the CPU time of commands with a deadline."""
+    import resource
+
+    # Wait for the limit, which is set after the command starts
+    show = (
+        sys.executable,
+        "-c",
+        "import resource, time; time.sleep(0.5); "
+        "print(resource.getrlimit(resource.RLIMIT_CPU)[0])",
+    )
+    limit = math.ceil(10 * (os.cpu_count() or 1))
+    with command_deadline(10):
+        assert 0 < int(_run_command(*show)[0]) <= limit
+        assert 0 < int(asyncio.run(_run_command_async(*show))[0]) <= limit
+
+    # Without a deadline, commands inherit the limit of the current process
+    assert int(_run_command(*show)[0]) == resource.getrlimit(resource.RLIMIT_CPU)[0]
+
+
+def test_command_variables():
+    """Test adding environment variables to commands."""
+    show = (sys.executable, "-c", "import os; print(os.environ.get('MYVAR'))")
+    with command_variables({"MYVAR": "myvalue"}):
+        assert _run_command(*show)[0] == "myvalue\n"
+        assert asyncio.run(_run_command_async(*show))[0] == "myvalue\n"
+        assert _run_command(*show, env={"OTHER": "1"})[0] == "myvalue\n"
+
+    with command_variables(None):
+        assert _run_command(*show)[0] == "None\n"
+
+
+def test_command_log(tmpdir):
+    """Test streaming the output of commands to a compressed log."""
+    log = Path(str(tmpdir)) / "logs" / "setup.log.gz"
+    chatty = (
+        sys.executable,
+        "-c",
+        "import sys; print('result'); "
+        "[print(f'line {idx}', file=sys.stderr) for idx in range(100000)]; "
+        "sys.exit(2)",
+    )
+    with command_log(log):
+        out, _ = _run_command(sys.executable, "-c", "print('hello')")
+
+        assert out == "hello\n"
+
+        with pytest.raises(RuntimeError) as excinfo:
+            _run_command(*chatty)
+        with pytest.raises(RuntimeError):
+            asyncio.run(_run_command_async(*chatty))
+
+    message = str(excinfo.value)
+    # Only the end of the output is kept in memory
+    assert "line 99999" in message
+    assert "line 0\n" not in message
+    assert len(message) < 2 * OUTPUT_TAIL_CHARS + 1000
+    assert str(log) in message
+
+    with gzip.open(log, "rt") as infile:
+        content = infile.read()
+
+    assert content.count("line 0\n") == 2
+    assert content.count("line 99999\n") == 2
+    assert content.count("result\n") == 2
+    assert "hello\n" in content